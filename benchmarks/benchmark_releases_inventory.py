@@ -0,0 +1,124 @@
+"""
+Benchmark of the RELEASES generation from a CAMS inventory on a synthetic global
+0.1° field. The vectorized write_releases_file_for_inventory() is compared with the
+former per-pixel implementation (kept below as a reference), and both RELEASES files
+must be byte-identical.
+
+Usage:
+    python3 benchmarks/benchmark_releases_inventory.py [--zone-size 10] [--keep]
+"""
+import os
+import sys
+import time
+import shutil
+import logging
+import argparse
+import datetime
+import tempfile
+import filecmp
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import girafe
+from synthetic_inputs import write_cams_inventory, write_girafe_config, prepare_working_dir
+
+def reference_write_releases_file_for_inventory(config: girafe.GirafeConfig, working_dir: str) -> int:
+    """
+    Per-pixel implementation of write_releases_file_for_inventory() before vectorization.
+    """
+    file = open(working_dir+"/options/RELEASES","w")
+    file.write("***************************************************************************************************************\n")
+    file.write("*                                                                                                             *\n")
+    file.write("*                                                                                                             *\n")
+    file.write("*                                                                                                             *\n")
+    file.write("*   Input file for the Lagrangian particle dispersion model FLEXPART                                          *\n")
+    file.write("*                        Please select your options                                                           *\n")
+    file.write("*                                                                                                             *\n")
+    file.write("*                                                                                                             *\n")
+    file.write("*                                                                                                             *\n")
+    file.write("***************************************************************************************************************\n")
+    file.write("&RELEASES_CTRL\n")
+    file.write(" NSPEC      =           1, ! Total number of species\n")
+    file.write(" SPECNUM_REL=          "+config.species+", ! Species numbers in directory SPECIES\n")
+    file.write(" /\n")
+    ds = xr.open_dataset(config.emissions)
+    lat_varname, lon_varname = girafe.find_lat_lon_variables(ds)
+    ds = ds.drop_duplicates(dim="time")
+    total_number_parts = 0
+    for release in config.releases:
+        rel_duration       = release.duration_delta
+        rel_start_datetime = release.start_datetime
+        rel_end_datetime   = release.end_datetime
+        for zone in release.zones:
+            sub_ds = ds.sel(time=pd.to_datetime(rel_start_datetime), method="nearest")
+            sub_ds = sub_ds.sel({lat_varname: slice(zone.lat_min, zone.lat_max), lon_varname: slice(zone.lon_min, zone.lon_max)})
+            lon_mesh, lat_mesh = np.meshgrid(sub_ds[lon_varname].values, sub_ds[lat_varname].values)
+            earth_R = 6378.1
+            Lref = np.abs(sub_ds[lon_varname][1].values - sub_ds[lon_varname][0].values)*2*np.pi*earth_R/360.0
+            pixel_surface = (Lref * np.cos(np.radians(lat_mesh))) * Lref
+            emissions = sub_ds[config.emissions_variable] * pixel_surface * rel_duration.total_seconds()
+            iPix = 0
+            for line in range(lat_mesh.shape[0]):
+                for col in range(lat_mesh.shape[1]):
+                    if emissions[line,col]!=0:
+                        iPix = iPix + 1
+                        file.write("&RELEASE\n")
+                        file.write(f" IDATE1 = {datetime.datetime.strftime(rel_start_datetime,'%Y%m%d')},\n")
+                        file.write(f" ITIME1 = {datetime.datetime.strftime(rel_start_datetime,'%H%M%S')},\n")
+                        file.write(f" IDATE2 = {datetime.datetime.strftime(rel_end_datetime,'%Y%m%d')},\n")
+                        file.write(f" ITIME2 = {datetime.datetime.strftime(rel_end_datetime,'%H%M%S')},\n")
+                        file.write(f" LON1 = {lon_mesh[line,col]:.3f},\n")
+                        file.write(f" LON2 = {lon_mesh[line,col]:.3f},\n")
+                        file.write(f" LAT1 = {lat_mesh[line,col]:.3f},\n")
+                        file.write(f" LAT2 = {lat_mesh[line,col]:.3f},\n")
+                        file.write(f" Z1 = {release.altitude_min:.3f},\n")
+                        file.write(f" Z2 = {release.altitude_max:.3f},\n")
+                        file.write(" ZKIND = 1,\n")
+                        mass_string = f" MASS = {emissions[line,col]:E},\n"
+                        file.write(mass_string.replace("e","E"))
+                        file.write(" PARTS = 10000,\n")
+                        file.write(f" COMMENT = \"{release.name}_{zone.name}_{iPix}\",\n")
+                        file.write(" /\n")
+                        total_number_parts = total_number_parts + 10000
+    file.close()
+    return total_number_parts
+
+def time_writer(writer, config: girafe.GirafeConfig, working_dir: str) -> tuple:
+    prepare_working_dir(working_dir)
+    start  = time.perf_counter()
+    Nparts = writer(config, working_dir)
+    return Nparts, time.perf_counter() - start
+
+if __name__=="__main__":
+
+    parser = argparse.ArgumentParser(description="Benchmark of the CAMS inventory RELEASES generation on a synthetic global 0.1° field")
+    parser.add_argument("--zone-size", type=float, default=10.0, help="Side of the square emission zone in degrees (default 10, i.e. 10000 cells).")
+    parser.add_argument("--resolution", type=float, default=0.1, help="Resolution of the synthetic inventory in degrees (default 0.1).")
+    parser.add_argument("--keep", action="store_true", help="Keep the temporary directory with the inputs and RELEASES files.")
+    args = parser.parse_args()
+
+    girafe.LOGGER = girafe.start_log()
+    girafe.LOGGER.setLevel(logging.WARNING)
+
+    tmp_dir   = tempfile.mkdtemp(prefix="girafe_bench_")
+    inventory = write_cams_inventory(f"{tmp_dir}/CAMS-GLOB-ANT_synthetic.nc", resolution=args.resolution)
+    zones     = [("Zone1", 40.0, 40.0+args.zone_size, 10.0, 10.0+args.zone_size)]
+    config    = girafe.load_girafe_config(write_girafe_config(f"{tmp_dir}/config.xml", f"{tmp_dir}/wdir", inventory, zones))
+
+    Nparts_ref, time_ref = time_writer(reference_write_releases_file_for_inventory, config, f"{tmp_dir}/reference")
+    Nparts_new, time_new = time_writer(girafe.write_releases_file_for_inventory, config, f"{tmp_dir}/vectorized")
+    identical = filecmp.cmp(f"{tmp_dir}/reference/options/RELEASES", f"{tmp_dir}/vectorized/options/RELEASES", shallow=False)
+
+    print(f"Synthetic inventory : {args.resolution}° global, zone of {args.zone_size}°x{args.zone_size}° ({Nparts_new//10000} releases)")
+    print(f"Per-pixel reference : {time_ref:8.3f} s")
+    print(f"Vectorized          : {time_new:8.3f} s")
+    print(f"Speedup             : {time_ref/time_new:8.1f} x")
+    print(f"Identical RELEASES  : {identical and Nparts_ref==Nparts_new}")
+
+    if args.keep:
+        print(f"Files kept in {tmp_dir}")
+    else:
+        shutil.rmtree(tmp_dir)
+    sys.exit(0 if identical else 1)
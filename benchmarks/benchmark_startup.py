@@ -0,0 +1,63 @@
+"""
+Benchmark of the command line startup: wall time of `girafe.py validate`, which only
+parses the configuration file, against a startup budget, and the heavy libraries that
+a configuration-only invocation actually loads (none should be).
+
+Usage:
+    python3 benchmarks/benchmark_startup.py [--repeat 5] [--budget 0.5]
+"""
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+import subprocess
+import statistics
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from synthetic_inputs import write_girafe_config
+
+GIRAFE_PY = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "girafe.py")
+
+HEAVY_MODULES = ["pandas", "xarray", "netCDF4", "eccodes", "matplotlib", "cartopy"]
+
+# Imports girafe, validates the configuration and prints the heavy modules really executed
+# (a lazily imported module only becomes a plain module once one of its attributes is used)
+LOADED_MODULES_SCRIPT = """
+import sys, types
+sys.path.insert(0, {package_dir!r})
+import girafe
+girafe.LOGGER = girafe.start_log()
+girafe.load_girafe_config({config_filepath!r})
+print(" ".join([name for name in {modules!r} if type(sys.modules.get(name)) is types.ModuleType]))
+"""
+
+if __name__=="__main__":
+
+    parser = argparse.ArgumentParser(description="Benchmark of the startup time of a configuration-only girafe.py invocation")
+    parser.add_argument("--repeat", type=int, default=5, help="Number of timed invocations (default 5).")
+    parser.add_argument("--budget", type=float, default=0.5, help="Startup budget in seconds for the median invocation (default 0.5).")
+    args = parser.parse_args()
+
+    tmp_dir = tempfile.mkdtemp(prefix="girafe_bench_")
+    config_filepath = write_girafe_config(f"{tmp_dir}/config.xml", f"{tmp_dir}/wdir", f"{tmp_dir}/inventory.nc",
+                                          [("Zone1", 40.0, 50.0, 10.0, 20.0)])
+
+    timings = []
+    for _ in range(args.repeat):
+        start  = time.perf_counter()
+        result = subprocess.run([sys.executable, GIRAFE_PY, "validate", "--config", config_filepath], capture_output=True, text=True)
+        timings.append(time.perf_counter() - start)
+        if result.returncode!=0:
+            print(result.stderr)
+            sys.exit(1)
+    script = LOADED_MODULES_SCRIPT.format(package_dir=os.path.dirname(GIRAFE_PY), config_filepath=config_filepath, modules=HEAVY_MODULES)
+    loaded = subprocess.run([sys.executable, "-c", script], capture_output=True, text=True).stdout.split()
+
+    print(f"girafe.py validate  : median {statistics.median(timings):.3f} s, min {min(timings):.3f} s over {args.repeat} runs")
+    print(f"Startup budget      : {args.budget:.3f} s")
+    print(f"Heavy modules loaded: {', '.join(loaded) if len(loaded)>0 else 'none'}")
+
+    shutil.rmtree(tmp_dir)
+    sys.exit(0 if (statistics.median(timings)<=args.budget) and (len(loaded)==0) else 1)
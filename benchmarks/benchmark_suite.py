@@ -0,0 +1,321 @@
+"""
+Reproducible benchmark suite of the GIRAFE stages on synthetic inputs, runnable offline:
+MODIS MCD14DL fire files and CAMS-like 0.1° inventories for the RELEASES, a GRIB pool
+for the ECMWF checks, a stub FLEXPART installation (see write_stub_flexpart()) for the
+compile and run stages, and FLEXPART-like NetCDF outputs for the post-processing
+(column integration, quicklooks, tiles, archives, point extraction) and particle dumps
+for the hot start, at several sizes.
+
+Every stage runs in a fresh process, is timed over --repeat runs (median kept) and its
+peak resident memory is recorded, with the memory of the process before the stage. The
+results are saved in a JSON file with the commit they were measured on, and compared
+with the results of another commit by --compare: a stage slower, or using more memory,
+than its baseline by more than --threshold is a regression and the exit code is 1, as
+when a stage fails.
+
+To measure another commit with the same inputs, check it out in a worktree and point
+--girafe-dir to it (stages the commit does not have are reported as unavailable):
+    git worktree add /tmp/girafe_base <commit>
+    python3 benchmarks/benchmark_suite.py --girafe-dir /tmp/girafe_base --output base.json
+    python3 benchmarks/benchmark_suite.py --output new.json --compare base.json
+
+Usage:
+    python3 benchmarks/benchmark_suite.py [--sizes small medium] [--stages ...] [--repeat 3]
+                                          [--output results.json] [--compare baseline.json] [--threshold 0.2]
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import logging
+import argparse
+import datetime
+import platform
+import resource
+import tempfile
+import subprocess
+import statistics
+import multiprocessing
+import concurrent.futures
+from dataclasses import replace
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from synthetic_inputs import (write_modis_file, write_cams_inventory, write_ecmwf_pool, write_flexpart_output, write_points_file,
+                              write_particle_dump, write_stub_flexpart, write_natural_earth_stub, write_girafe_config,
+                              prepare_working_dir)
+
+PACKAGE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SIZES = {"small":  {"detections": 2000,   "zone_size": 2.0,  "days": 1, "resolution": 1.0,  "times": 6,  "heights": 5,  "points": 100,   "max_zoom": 3},
+         "medium": {"detections": 20000,  "zone_size": 10.0, "days": 2, "resolution": 0.5,  "times": 12, "heights": 8,  "points": 1000,  "max_zoom": 4},
+         "large":  {"detections": 200000, "zone_size": 30.0, "days": 4, "resolution": 0.25, "times": 24, "heights": 10, "points": 10000, "max_zoom": 5}}
+
+# Resolution of the output written by the stub FLEXPART in the pipeline stage, whose
+# timing must stay dominated by GIRAFE rather than by the stub
+PIPELINE_RESOLUTION = 2.0
+
+# Regressions smaller than these are measurement noise
+MIN_TIME_DIFFERENCE   = 0.05 # seconds
+MIN_MEMORY_DIFFERENCE = 20.0 # MB
+
+def generate_inputs(size: str, inputs_dir: str) -> dict:
+    """
+    Writes the synthetic inputs of one size in inputs_dir and returns their paths and
+    parameters.
+    """
+    parameters = SIZES[size]
+    os.makedirs(inputs_dir, exist_ok=True)
+    begin  = datetime.datetime(2023, 5, 1)
+    dates  = [begin + datetime.timedelta(days=day) for day in range(parameters["days"])]
+    zone   = ("Zone1", 40.0, 40.0+parameters["zone_size"], 10.0, 10.0+parameters["zone_size"])
+    levels = [100.0*(2**level) for level in range(parameters["heights"])]
+    inputs = {"size": size, **parameters,
+              "modis":     write_modis_file(f"{inputs_dir}/MCD14DL_synthetic.txt", parameters["detections"], [zone],
+                                            dates=[date.strftime("%Y-%m-%d") for date in dates]),
+              "inventory": write_cams_inventory(f"{inputs_dir}/CAMS-GLOB-ANT_synthetic.nc"),
+              "output":    write_flexpart_output(f"{inputs_dir}/grid_conc_20230501000000.nc", resolution=parameters["resolution"],
+                                                 heights=levels, Ntimes=parameters["times"]),
+              "points":    write_points_file(f"{inputs_dir}/points.csv", parameters["points"]),
+              "flexpart_root":     write_stub_flexpart(f"{inputs_dir}/flexpart"),
+              "natural_earth_dir": write_natural_earth_stub(f"{inputs_dir}/natural_earth")}
+    write_ecmwf_pool(f"{inputs_dir}/ecmwf", begin, begin+datetime.timedelta(days=parameters["days"]))
+    release_dates = [date.strftime("%Y%m%d") for date in dates]
+    for name, emissions, resolution in [("modis", inputs["modis"], 1.0), ("inventory", inputs["inventory"], PIPELINE_RESOLUTION)]:
+        inputs[f"config_{name}"] = write_girafe_config(f"{inputs_dir}/config_{name}.xml", f"{inputs_dir}/wdir", emissions, [zone],
+                                                       begin_date=release_dates[0], end_date=release_dates[-1], release_dates=release_dates,
+                                                       ecmwf_dir=f"{inputs_dir}/ecmwf", out_resolution=resolution, height_levels=levels)
+    return inputs
+
+# *************************************************************************************************
+# Stages: setup(girafe, inputs, work_dir) prepares a fresh work_dir and returns the arguments
+# of run(girafe, *arguments), the timed part
+# *************************************************************************************************
+
+def load_config(girafe, inputs: dict, name: str, work_dir: str):
+    return replace(girafe.load_girafe_config(inputs[f"config_{name}"]), working_dir=work_dir)
+
+def setup_releases(girafe, inputs: dict, work_dir: str, name: str) -> tuple:
+    prepare_working_dir(work_dir)
+    return (load_config(girafe, inputs, name, work_dir), work_dir)
+
+def setup_available(girafe, inputs: dict, work_dir: str) -> tuple:
+    os.makedirs(work_dir, exist_ok=True)
+    # Fresh pool index, every GRIB header is read
+    return (replace(load_config(girafe, inputs, "inventory", work_dir), ecmwf_index=f"{work_dir}/ecmwf_index.json"),)
+
+def setup_compile(girafe, inputs: dict, work_dir: str) -> tuple:
+    prepare_working_dir(work_dir)
+    girafe.copy_source_files(work_dir)
+    girafe.write_par_mod_file(load_config(girafe, inputs, "inventory", work_dir), work_dir, 10000)
+    return (work_dir,)
+
+def setup_pipeline(girafe, inputs: dict, work_dir: str) -> tuple:
+    return (replace(load_config(girafe, inputs, "inventory", work_dir), ecmwf_index=f"{work_dir}/ecmwf_index.json"),)
+
+def run_pipeline(girafe, config) -> None:
+    girafe.run_girafe_stages(config, to_stage="run")
+
+def setup_output(girafe, inputs: dict, work_dir: str) -> tuple:
+    os.makedirs(work_dir, exist_ok=True)
+    return (inputs["output"], work_dir)
+
+def setup_particle_dump(girafe, inputs: dict, work_dir: str) -> tuple:
+    """
+    Output directories of a run dumping its particles at every output time step
+    (IPOUT=1, the dump after 3 hours is kept) and of a run dumping them at its end
+    (IPOUT=2, partposit_end), with the particle count of the small inputs.
+    """
+    config = load_config(girafe, inputs, "inventory", work_dir)
+    length = (config.end_datetime-config.begin_datetime).total_seconds()/3600
+    runs = []
+    for ipout, dump_hours in [("1", 3.0), ("2", length)]:
+        run_dir = f"{work_dir}/ipout{ipout}"
+        os.makedirs(f"{run_dir}/output", exist_ok=True)
+        dates = [config.begin_datetime+datetime.timedelta(hours=hours) for hours in range(3, int(length)+1, 3)]
+        filenames = [f"partposit_{date.strftime('%Y%m%d%H%M%S')}" for date in dates] if ipout=="1" else ["partposit_end"]
+        for index, filename in enumerate(filenames):
+            write_particle_dump(f"{run_dir}/output/{filename}", 10*inputs["detections"], itime=3600*3*(index+1))
+        runs.append((replace(config, working_dir=run_dir, restart_dump_hours=dump_hours,
+                             command=girafe.set_command_value(config.command, "IPOUT", ipout)), run_dir))
+    return (runs,)
+
+def run_particle_dump(girafe, runs: list) -> None:
+    # Every run must leave its dump in restart/ and no other dump in output/
+    for config, run_dir in runs:
+        if (girafe.save_particle_dump(config, run_dir) is None) or (len(os.listdir(f"{run_dir}/output"))>0):
+            raise RuntimeError(f"the particle dump of {run_dir} was not kept for the hot start")
+
+STAGES = {"releases_modis":     (lambda girafe, inputs, work_dir: setup_releases(girafe, inputs, work_dir, "modis"),
+                                 lambda girafe, config, work_dir: girafe.write_releases_file_for_modis(config, work_dir)),
+          "releases_inventory": (lambda girafe, inputs, work_dir: setup_releases(girafe, inputs, work_dir, "inventory"),
+                                 lambda girafe, config, work_dir: girafe.write_releases_file_for_inventory(config, work_dir)),
+          "available":          (setup_available,
+                                 lambda girafe, config: girafe.check_ECMWF_pool(config)),
+          "compile":            (setup_compile,
+                                 lambda girafe, work_dir: girafe.compile_flexpart(work_dir)),
+          "pipeline":           (setup_pipeline, run_pipeline),
+          "column_integration": (setup_output,
+                                 lambda girafe, output, work_dir: girafe.quicklook_scales(output)),
+          "quicklooks":         (setup_output,
+                                 lambda girafe, output, work_dir: girafe.plot_girafe_simulation(output, work_dir, max_workers=1)),
+          "tiles":              (lambda girafe, inputs, work_dir: setup_output(girafe, inputs, work_dir) + (inputs["max_zoom"],),
+                                 lambda girafe, output, work_dir, max_zoom: girafe.write_tile_pyramid(output, work_dir, 0, max_zoom)),
+          "archive_dense":      (setup_output,
+                                 lambda girafe, output, work_dir: girafe.archive_flexpart_output(output, f"{work_dir}/archive.nc")),
+          "archive_sparse":     (setup_output,
+                                 lambda girafe, output, work_dir: girafe.archive_flexpart_output(output, f"{work_dir}/archive.nc", sparse=True)),
+          "particle_dump":      (setup_particle_dump, run_particle_dump),
+          "extract_points":     (lambda girafe, inputs, work_dir: (inputs["output"], inputs["points"]),
+                                 lambda girafe, output, points: girafe.extract_points([output], girafe.read_points_file(points)))}
+
+def memory_mb(key: str) -> float:
+    """
+    Current (VmRSS) or peak (VmHWM) resident memory of the process. The peak of
+    ru_maxrss survives exec() on Linux, and would be the one of the parent for a
+    spawned process, so /proc is read when it is available.
+    """
+    try:
+        with open("/proc/self/status", "r") as file:
+            for line in file:
+                if line.startswith(key+":"):
+                    return int(line.split()[1])/1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss/1024
+
+def reset_peak_memory() -> None:
+    # Resets VmHWM to the current resident memory (Linux >= 4.0)
+    try:
+        with open("/proc/self/clear_refs", "w") as file:
+            file.write("5")
+    except OSError:
+        pass
+
+def run_stage(girafe_dir: str, stage: str, inputs: dict, stage_dir: str, repeat: int) -> dict:
+    """
+    Runs one stage repeat times in the calling process (a fresh one, see main) and
+    returns its timings and peak memory, or its status if it could not run.
+    """
+    sys.path.insert(0, girafe_dir)
+    import girafe
+    import cartopy
+    cartopy.config["pre_existing_data_dir"] = inputs["natural_earth_dir"]
+    girafe.LOGGER = girafe.start_log()
+    girafe.LOGGER.setLevel(logging.WARNING)
+    girafe.FLEXPART_ROOT = inputs["flexpart_root"]
+    setup, run = STAGES[stage]
+    timings = []
+    baseline_rss, peak_rss = None, 0.0
+    try:
+        for index in range(repeat):
+            work_dir  = f"{stage_dir}/{stage}_{index}"
+            arguments = setup(girafe, inputs, work_dir)
+            if baseline_rss is None:
+                baseline_rss = memory_mb("VmRSS")
+            reset_peak_memory()
+            start = time.perf_counter()
+            run(girafe, *arguments)
+            timings.append(time.perf_counter() - start)
+            peak_rss = max(peak_rss, memory_mb("VmHWM"))
+            if os.path.exists(work_dir):
+                shutil.rmtree(work_dir)
+    except (AttributeError, TypeError) as error:
+        # The stage does not exist, or has another signature, in this version of girafe.py
+        return {"status": "unavailable", "error": str(error)}
+    except (Exception, SystemExit) as error:
+        return {"status": "failed", "error": repr(error)}
+    return {"status": "ok",
+            "time_s": statistics.median(timings),
+            "times_s": timings,
+            "baseline_rss_mb": baseline_rss,
+            "peak_rss_mb": peak_rss,
+            # Largest subprocess (make, FLEXPART) of the stage
+            "children_peak_rss_mb": resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss/1024}
+
+def git_commit(directory: str) -> dict:
+    def git(*arguments):
+        result = subprocess.run(["git", *arguments], cwd=directory, capture_output=True, text=True)
+        return result.stdout.strip() if result.returncode==0 else None
+    return {"commit": git("rev-parse", "HEAD"), "dirty": git("status", "--porcelain", "--untracked-files=no") not in [None, ""]}
+
+def compare_results(results: dict, baseline: dict, threshold: float) -> list:
+    """
+    Prints the stage timings and peak memory against the baseline ones and returns the
+    regressions, (size, stage, metric, baseline value, value) tuples.
+    """
+    regressions = []
+    print(f"\nComparison with {baseline.get('commit') or 'unknown commit'} (threshold {threshold:.0%})")
+    print(f"{'size':<8} {'stage':<20} {'baseline':>10} {'current':>10} {'ratio':>7}   {'baseline':>10} {'current':>10} {'ratio':>7}")
+    for size, stages in results["results"].items():
+        for stage, result in stages.items():
+            base = baseline["results"].get(size, {}).get(stage)
+            if (result["status"]!="ok") or (base is None) or (base["status"]!="ok"):
+                print(f"{size:<8} {stage:<20} {'-' if base is None else base['status']:>10} {result['status']:>10}")
+                continue
+            flags = []
+            for metric, minimum in [("time_s", MIN_TIME_DIFFERENCE), ("peak_rss_mb", MIN_MEMORY_DIFFERENCE)]:
+                if (result[metric]>base[metric]*(1+threshold)) and (result[metric]-base[metric]>minimum):
+                    regressions.append((size, stage, metric, base[metric], result[metric]))
+                    flags.append(metric)
+            print(f"{size:<8} {stage:<20} {base['time_s']:>9.3f}s {result['time_s']:>9.3f}s {result['time_s']/base['time_s']:>7.2f}"
+                  f"   {base['peak_rss_mb']:>8.0f}MB {result['peak_rss_mb']:>8.0f}MB {result['peak_rss_mb']/base['peak_rss_mb']:>7.2f}"
+                  + ("   REGRESSION ("+", ".join(flags)+")" if len(flags)>0 else ""))
+    return regressions
+
+if __name__=="__main__":
+
+    parser = argparse.ArgumentParser(description="Benchmark suite of the GIRAFE stages on synthetic inputs")
+    parser.add_argument("--sizes", nargs="+", choices=list(SIZES), default=["small", "medium"], help="Input sizes (default small medium).")
+    parser.add_argument("--stages", nargs="+", choices=list(STAGES), default=list(STAGES), help="Stages to run (default all).")
+    parser.add_argument("--repeat", type=int, default=3, help="Number of timed runs of every stage (default 3).")
+    parser.add_argument("--girafe-dir", default=PACKAGE_DIR, help="Directory of the girafe.py to benchmark (default this repository).")
+    parser.add_argument("--output", help="JSON file to save the results in.")
+    parser.add_argument("--compare", help="JSON results of a baseline commit to compare with.")
+    parser.add_argument("--threshold", type=float, default=0.2, help="Relative slowdown or memory increase counted as a regression (default 0.2).")
+    parser.add_argument("--keep", action="store_true", help="Keep the synthetic inputs and the stage outputs.")
+    args = parser.parse_args()
+
+    girafe_dir = os.path.abspath(args.girafe_dir)
+    results = {**git_commit(girafe_dir),
+               "date": datetime.datetime.now().isoformat(timespec="seconds"),
+               "python": platform.python_version(),
+               "platform": platform.platform(),
+               "cpu_count": os.cpu_count(),
+               "repeat": args.repeat,
+               "results": {}}
+    tmp_dir = tempfile.mkdtemp(prefix="girafe_bench_")
+    context = multiprocessing.get_context("spawn")
+    for size in args.sizes:
+        start  = time.perf_counter()
+        inputs = generate_inputs(size, f"{tmp_dir}/{size}/inputs")
+        print(f"{size} inputs generated in {time.perf_counter()-start:.1f} s")
+        results["results"][size] = {}
+        for stage in args.stages:
+            with concurrent.futures.ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+                result = pool.submit(run_stage, girafe_dir, stage, inputs, f"{tmp_dir}/{size}", args.repeat).result()
+            results["results"][size][stage] = result
+            if result["status"]=="ok":
+                print(f"{size:<8} {stage:<20}: median {result['time_s']:8.3f} s, peak memory {result['peak_rss_mb']:6.0f} MB "
+                      f"({result['peak_rss_mb']-result['baseline_rss_mb']:+6.0f} MB during the stage)")
+            else:
+                print(f"{size:<8} {stage:<20}: {result['status']} ({result['error']})")
+
+    if args.output is not None:
+        with open(args.output, "w") as file:
+            json.dump(results, file, indent=2)
+    if not args.keep:
+        shutil.rmtree(tmp_dir)
+    else:
+        print(f"Inputs and outputs kept in {tmp_dir}")
+
+    regressions = []
+    if args.compare is not None:
+        with open(args.compare, "r") as file:
+            regressions = compare_results(results, json.load(file), args.threshold)
+        print(f"{len(regressions)} regression(s)")
+    # A failed stage (e.g. the particle dump check) is an error too, an unavailable one is not
+    failures = [(size, stage) for size, stages in results["results"].items() for stage, result in stages.items() if result["status"]=="failed"]
+    if len(failures)>0:
+        print(f"{len(failures)} failed stage(s): " + ", ".join([f"{size} {stage}" for size, stage in failures]))
+    sys.exit(1 if (len(regressions)>0) or (len(failures)>0) else 0)
@@ -0,0 +1,361 @@
+"""
+Generators of synthetic GIRAFE inputs for the benchmarks: CAMS-like emission
+inventories, MODIS MCD14DL fire files, ECMWF-like GRIB pools, FLEXPART-like NetCDF
+outputs and particle dumps, point lists, minimal configuration xml files, and a stub FLEXPART
+installation whose executable writes a synthetic output. Nothing here needs ECMWF
+data, a FLEXPART installation or a network access.
+"""
+import os
+import sys
+import datetime
+import numpy as np
+import pandas as pd
+import xarray as xr
+import netCDF4 as nc
+
+CONFIG_TEMPLATE = """<config>
+    <girafe>
+        <simulation_start>
+            <date>{begin_date}</date>
+            <time>000000</time>
+        </simulation_start>
+        <simulation_end>
+            <date>{end_date}</date>
+            <time>233000</time>
+        </simulation_end>
+        <ecmwf_time>
+            <dtime>3</dtime>
+        </ecmwf_time>
+        <flexpart>
+            <par_mod_parameters>
+                <nxmax>361</nxmax>
+                <nymax>181</nymax>
+            </par_mod_parameters>
+            <out_grid>
+                <longitude>
+                    <min>-179</min>
+                    <max>181</max>
+                </longitude>
+                <latitude>
+                    <min>-90</min>
+                    <max>90</max>
+                </latitude>
+                <resolution>{out_resolution}</resolution>
+                <height>
+{height_levels}
+                </height>
+            </out_grid>
+            <command>
+                <time>
+                    <output>3600</output>
+                </time>
+                <iOut>9</iOut>
+            </command>
+            <releases>
+                <species>22</species>
+                <fire_confidence>85</fire_confidence>
+{releases}
+            </releases>
+        </flexpart>
+        <paths>
+            <working_dir>{working_dir}</working_dir>
+            <ecmwf_dir>{ecmwf_dir}</ecmwf_dir>
+            <emissions>{emissions}</emissions>
+            <emissions_variable>{emissions_variable}</emissions_variable>
+        </paths>
+    </girafe>
+</config>
+"""
+
+RELEASE_TEMPLATE = """                <release name="{name}">
+                    <start_date>{start_date}</start_date>
+                    <start_time>00000000</start_time>
+                    <duration>00240000</duration>
+                    <altitude_min>10</altitude_min>
+                    <altitude_max>100</altitude_max>
+                    <zones>
+{zones}
+                    </zones>
+                </release>"""
+
+ZONE_TEMPLATE = """                        <zone name="{name}">
+                            <latmin>{lat_min}</latmin>
+                            <latmax>{lat_max}</latmax>
+                            <lonmin>{lon_min}</lonmin>
+                            <lonmax>{lon_max}</lonmax>
+                        </zone>"""
+
+def write_cams_inventory(filepath: str, resolution: float=0.1, dates: list=None, zero_fraction: float=0.3, seed: int=0) -> str:
+    """
+    Writes a global CAMS-GLOB-ANT-like monthly inventory (kg m-2 s-1) on a regular
+    lat/lon grid with cell-centered coordinates. The first month is duplicated, as in
+    the CAMS files, so the drop_duplicates() path is exercised.
+    """
+    rng   = np.random.default_rng(seed)
+    dates = dates or ["2023-04-01", "2023-05-01", "2023-05-01", "2023-06-01"]
+    lat   = np.round(np.arange(-90+resolution/2, 90, resolution), 4)
+    lon   = np.round(np.arange(resolution/2, 360, resolution), 4)
+    data  = rng.random((len(dates), len(lat), len(lon)), dtype=np.float32)*1e-9
+    data[data<zero_fraction*1e-9] = 0
+    ds = xr.Dataset({"sum": (("time", "lat", "lon"), data)},
+                    coords={"time": pd.to_datetime(dates), "lat": lat, "lon": lon})
+    ds["lat"].attrs["standard_name"] = "latitude"
+    ds["lon"].attrs["standard_name"] = "longitude"
+    ds["sum"].attrs["units"] = "kg m-2 s-1"
+    ds.to_netcdf(filepath)
+    return filepath
+
+def write_girafe_config(filepath: str, working_dir: str, emissions: str, zones: list,
+                        begin_date: str="20230501", end_date: str="20230501",
+                        release_dates: list=None, emissions_variable: str="sum",
+                        ecmwf_dir: str="/tmp", out_resolution: float=1.0, height_levels: list=None) -> str:
+    """
+    Writes a minimal configuration xml file. zones is a list of (name, lat_min, lat_max,
+    lon_min, lon_max) tuples shared by every release; there is one release per date of
+    release_dates.
+    """
+    height_levels = height_levels or [100.0, 500.0, 1000.0, 2000.0, 5000.0]
+    release_dates = release_dates or [begin_date]
+    zones_xml     = "\n".join([ZONE_TEMPLATE.format(name=name, lat_min=lat_min, lat_max=lat_max, lon_min=lon_min, lon_max=lon_max)
+                               for name, lat_min, lat_max, lon_min, lon_max in zones])
+    releases_xml  = "\n".join([RELEASE_TEMPLATE.format(name=f"Release{ii+1}", start_date=date, zones=zones_xml)
+                               for ii, date in enumerate(release_dates)])
+    with open(filepath, "w") as file:
+        file.write(CONFIG_TEMPLATE.format(begin_date=begin_date,
+                                          end_date=end_date,
+                                          out_resolution=out_resolution,
+                                          height_levels="\n".join([f"                    <level>{level}</level>" for level in height_levels]),
+                                          releases=releases_xml,
+                                          working_dir=working_dir,
+                                          ecmwf_dir=ecmwf_dir,
+                                          emissions=emissions,
+                                          emissions_variable=emissions_variable))
+    return filepath
+
+def prepare_working_dir(working_dir: str) -> str:
+    for subdir in ["options", "output", "flexpart_src"]:
+        os.makedirs(f"{working_dir}/{subdir}", exist_ok=True)
+    return working_dir
+
+def write_modis_file(filepath: str, Ndetections: int, zones: list, dates: list=None, inside_fraction: float=0.7, seed: int=0) -> str:
+    """
+    Writes a MODIS MCD14DL-like text file with Ndetections fire detections spread over
+    the acquisition dates, inside_fraction of them in the (name, lat_min, lat_max,
+    lon_min, lon_max) zones and the others anywhere on the globe.
+    """
+    rng    = np.random.default_rng(seed)
+    dates  = dates or ["2023-05-01"]
+    Ninside = int(Ndetections*inside_fraction)
+    zone_index = rng.integers(0, len(zones), Ninside)
+    zone_array = np.array([zone[1:] for zone in zones], dtype=np.float64)[zone_index]
+    latitude  = np.concatenate([rng.uniform(zone_array[:,0], zone_array[:,1]), rng.uniform(-60, 70, Ndetections-Ninside)])
+    longitude = np.concatenate([rng.uniform(zone_array[:,2], zone_array[:,3]), rng.uniform(-180, 180, Ndetections-Ninside)])
+    df = pd.DataFrame({"latitude":   np.round(latitude, 4),
+                       "longitude":  np.round(longitude, 4),
+                       "brightness": np.round(rng.uniform(300, 500, Ndetections), 1),
+                       "scan":       np.round(rng.uniform(1, 4, Ndetections), 1),
+                       "track":      np.round(rng.uniform(1, 2, Ndetections), 1),
+                       "acq_date":   rng.choice(dates, Ndetections),
+                       "acq_time":   rng.integers(0, 24, Ndetections)*100 + rng.integers(0, 60, Ndetections),
+                       "satellite":  rng.choice(["T", "A"], Ndetections),
+                       "confidence": rng.integers(0, 101, Ndetections),
+                       "version":    "6.1NRT",
+                       "bright_t31": np.round(rng.uniform(280, 300, Ndetections), 1),
+                       "frp":        np.round(rng.uniform(1, 100, Ndetections), 1),
+                       "daynight":   rng.choice(["D", "N"], Ndetections)})
+    df.to_csv(filepath, index=False)
+    return filepath
+
+def write_ecmwf_pool(ecmwf_dir: str, begin: datetime.datetime, end: datetime.datetime, dtime: int=3, grid: tuple=(36, 19), levels: int=4) -> list:
+    """
+    Writes one small GRIB file (levels hybrid level messages on a global grid of
+    grid=(Ni, Nj) points, headers as in the ECMWF files of the pool) every dtime
+    hours from begin to end, named as in the AVAILABLE file (ENyymmddhh).
+    """
+    import eccodes
+    os.makedirs(ecmwf_dir, exist_ok=True)
+    filepaths = []
+    date = begin
+    while date<=end:
+        filepath = f"{ecmwf_dir}/EN{date.strftime('%y%m%d%H')}"
+        with open(filepath, "wb") as file:
+            for level in range(1, levels+1):
+                gid = eccodes.codes_grib_new_from_samples("GRIB1")
+                eccodes.codes_set_key_vals(gid, {"Ni": grid[0], "Nj": grid[1],
+                                                 "latitudeOfFirstGridPointInDegrees": 90, "latitudeOfLastGridPointInDegrees": -90,
+                                                 "longitudeOfFirstGridPointInDegrees": 0, "longitudeOfLastGridPointInDegrees": 360-360/grid[0],
+                                                 "iDirectionIncrementInDegrees": 360/grid[0], "jDirectionIncrementInDegrees": 180/(grid[1]-1),
+                                                 "dataDate": int(date.strftime("%Y%m%d")), "dataTime": int(date.strftime("%H%M")),
+                                                 "typeOfLevel": "hybrid", "level": level})
+                eccodes.codes_set_values(gid, np.zeros(grid[0]*grid[1]))
+                eccodes.codes_write(gid, file)
+                eccodes.codes_release(gid)
+        filepaths.append(filepath)
+        date = date + datetime.timedelta(hours=dtime)
+    return filepaths
+
+def plume_profile(coordinates: np.ndarray, center: float, sigma: float, period: float=None) -> np.ndarray:
+    distance = np.abs(coordinates-center)
+    if period is not None:
+        distance = np.minimum(distance, period-distance)
+    return np.exp(-0.5*(distance/sigma)**2)
+
+def write_flexpart_output(filepath: str, resolution: float=1.0, heights: list=None, Ntimes: int=24, start: str="2023-05-01 00:00",
+                          outstep: int=3600, sources: list=None, lon0: float=-179.0, lat0: float=-90.0, nx: int=None, ny: int=None,
+                          seed: int=0, on_step=None) -> str:
+    """
+    Writes a FLEXPART 10.4-like NetCDF output (grid_conc): spec001_mr and spec001_pptv
+    (nageclass, pointspec, time, height, latitude, longitude), WD_spec001 and
+    DD_spec001 deposition fields and the release variables. The concentrations are
+    plumes drifting east from the (lon, lat) sources and spreading with time, zero
+    far from them, so most of the grid is empty as in real runs. The file is written
+    one time step at a time, and on_step(time_index) is called after each one.
+    """
+    rng     = np.random.default_rng(seed)
+    heights = heights or [100.0, 500.0, 1000.0, 2000.0, 5000.0]
+    nx      = nx or int(round(360/resolution))
+    ny      = ny or int(round(180/resolution))
+    sources = sources or [(rng.uniform(-120, 120), rng.uniform(-50, 60)) for _ in range(5)]
+    lon     = lon0 + (np.arange(nx)+0.5)*resolution
+    lat     = lat0 + (np.arange(ny)+0.5)*resolution
+    with nc.Dataset(filepath, "w", format="NETCDF4") as ds:
+        ds.title = "FLEXPART model output (synthetic)"
+        for name, size in [("time", None), ("longitude", nx), ("latitude", ny), ("height", len(heights)),
+                           ("numspec", 1), ("pointspec", 1), ("nageclass", 1), ("nchar", 45), ("numpoint", len(sources))]:
+            ds.createDimension(name, size)
+        time = ds.createVariable("time", "i4", ("time",))
+        time.units = f"seconds since {start}"
+        ds.createVariable("longitude", "f4", ("longitude",))[:] = lon
+        ds.createVariable("latitude", "f4", ("latitude",))[:]  = lat
+        ds.createVariable("height", "f4", ("height",))[:]      = heights
+        ds.createVariable("RELCOM", "S1", ("numpoint", "nchar"))[:] = np.array([list(f"RELEASE_{index}".ljust(45)) for index in range(len(sources))], dtype="S1")
+        ds.createVariable("RELLNG1", "f4", ("numpoint",))[:] = [source[0] for source in sources]
+        ds.createVariable("RELLAT1", "f4", ("numpoint",))[:] = [source[1] for source in sources]
+        fields = {}
+        for name, units in [("spec001_mr", "ng m-3"), ("spec001_pptv", "pptv")]:
+            fields[name] = ds.createVariable(name, "f4", ("nageclass", "pointspec", "time", "height", "latitude", "longitude"),
+                                             zlib=True, complevel=1, chunksizes=(1, 1, 1, len(heights), ny, nx))
+            fields[name].units, fields[name].long_name = units, "CO"
+        for name in ["WD_spec001", "DD_spec001"]:
+            fields[name] = ds.createVariable(name, "f4", ("nageclass", "pointspec", "time", "latitude", "longitude"),
+                                             zlib=True, complevel=1, chunksizes=(1, 1, 1, ny, nx))
+            fields[name].units, fields[name].long_name = "ng m-2", "CO"
+        level_factors = 0.6**np.arange(len(heights))
+        for time_index in range(Ntimes):
+            sigma = 1.0 + 0.3*time_index
+            field = np.zeros((ny, nx), dtype=np.float64)
+            for source_lon, source_lat in sources[:20]:
+                field += np.outer(plume_profile(lat, source_lat, sigma), plume_profile(lon, source_lon+0.5*time_index, 1.5*sigma, period=360.0))
+            field = np.where(field>1e-3, field*1e3, 0.0).astype(np.float32)
+            time[time_index] = (time_index+1)*outstep
+            fields["spec001_mr"][0,0,time_index]   = field[None,:,:]*level_factors[:,None,None]
+            fields["spec001_pptv"][0,0,time_index] = field[None,:,:]*level_factors[:,None,None]*0.87
+            fields["WD_spec001"][0,0,time_index]   = field*0.01
+            fields["DD_spec001"][0,0,time_index]   = field*0.02
+            if on_step is not None:
+                on_step(time_index)
+    return filepath
+
+def write_points_file(filepath: str, Npoints: int, seed: int=0) -> str:
+    rng = np.random.default_rng(seed)
+    pd.DataFrame({"name":      [f"STATION_{index}" for index in range(Npoints)],
+                  "latitude":  np.round(rng.uniform(-60, 70, Npoints), 4),
+                  "longitude": np.round(rng.uniform(-180, 180, Npoints), 4),
+                  "height":    np.round(rng.uniform(0, 3000, Npoints), 1)}).to_csv(filepath, index=False)
+    return filepath
+
+def write_particle_dump(filepath: str, Nparticles: int, itime: int=0, seed: int=0) -> str:
+    """
+    Writes a FLEXPART-like particle dump (partposit file): Fortran unformatted records,
+    the time, one record per particle (release point, position, memorised time, ambient
+    fields and mass of one species) and a last record flagging the end of the dump.
+    """
+    rng = np.random.default_rng(seed)
+    def record(payload: bytes) -> bytes:
+        marker = np.int32(len(payload)).tobytes()
+        return marker + payload + marker
+    particle = np.dtype([("npoint", "<i4"), ("xlon", "<f4"), ("ylat", "<f4"), ("ztra", "<f4"), ("itramem", "<i4"),
+                         ("fields", "<f4", 7), ("xmass", "<f4")])
+    particles = np.zeros(Nparticles+1, dtype=particle)
+    particles["npoint"][:-1] = rng.integers(1, 100, Nparticles)
+    particles["npoint"][-1]  = -99999
+    particles["xlon"][:-1]   = rng.uniform(-180, 180, Nparticles)
+    particles["ylat"][:-1]   = rng.uniform(-90, 90, Nparticles)
+    particles["ztra"][:-1]   = rng.uniform(0, 5000, Nparticles)
+    particles["xmass"][:-1]  = rng.uniform(0, 1, Nparticles)
+    with open(filepath, "wb") as file:
+        file.write(record(np.int32(itime).tobytes()))
+        for row in particles:
+            file.write(record(row.tobytes()))
+    return filepath
+
+# Stub FLEXPART executable: reads the options written by GIRAFE and writes a synthetic
+# output over the OUTGRID for every LOUTSTEP of the simulation, printing the progress
+# lines of FLEXPART
+STUB_FLEXPART = """#!{python}
+import re, sys, datetime
+sys.path.insert(0, {benchmarks_dir!r})
+from synthetic_inputs import write_flexpart_output
+options_dir, output_dir = open("pathnames").read().split("\\n")[:2]
+def values(filename, key):
+    return re.search(r"^\\s*"+key+r"\\s*=\\s*([^\\n/]*)", open(options_dir+filename).read(), re.M).group(1).strip().rstrip(",").split(",")
+begin  = datetime.datetime.strptime(values("COMMAND", "IBDATE")[0]+values("COMMAND", "IBTIME")[0].zfill(6), "%Y%m%d%H%M%S")
+end    = datetime.datetime.strptime(values("COMMAND", "IEDATE")[0]+values("COMMAND", "IETIME")[0].zfill(6), "%Y%m%d%H%M%S")
+step   = int(values("COMMAND", "LOUTSTEP")[0])
+releases = open(options_dir+"RELEASES").read()
+sources  = [(float(lon), float(lat)) for lon, lat in zip(re.findall(r"LON1 = ([-\\d.]+)", releases), re.findall(r"LAT1 = ([-\\d.]+)", releases))]
+Nparts   = sum([int(parts) for parts in re.findall(r"PARTS = (\\d+)", releases)])
+def progress(time_index):
+    print(f"{{(time_index+1)*step:13d}} Seconds simulated: {{Nparts:13d}} Particles:    Uncertainty:   0.000  0.000  0.000", flush=True)
+write_flexpart_output(f"{{output_dir}}grid_conc_{{begin.strftime('%Y%m%d%H%M%S')}}.nc", resolution=float(values("OUTGRID", "DXOUT")[0]),
+                      heights=[float(height) for height in values("OUTGRID", "OUTHEIGHTS") if height.strip()!=""],
+                      Ntimes=int((end-begin).total_seconds()//step), start=begin.strftime("%Y-%m-%d %H:%M"), outstep=step,
+                      sources=sources[:20] or None, lon0=float(values("OUTGRID", "OUTLON0")[0]), lat0=float(values("OUTGRID", "OUTLAT0")[0]),
+                      nx=int(values("OUTGRID", "NUMXGRID")[0]), ny=int(values("OUTGRID", "NUMYGRID")[0]), on_step=progress)
+print("CONGRATULATIONS: YOU HAVE SUCCESSFULLY COMPLETED A FLEXPART MODEL RUN!", flush=True)
+"""
+
+STUB_MAKEFILE = """all: FLEXPART.f90 par_mod.f90
+\tcp flexpart_stub.py FLEXPART && chmod +x FLEXPART
+mpi: FLEXPART_MPI.f90 par_mod.f90
+\tcp flexpart_stub.py FLEXPART_MPI && chmod +x FLEXPART_MPI
+clean:
+\trm -f FLEXPART FLEXPART_MPI
+"""
+
+def write_stub_flexpart(root_dir: str) -> str:
+    """
+    Writes a stub FLEXPART installation to use as girafe.FLEXPART_ROOT: a few source
+    files and a makefile "compiling" the stub executable (STUB_FLEXPART), and the
+    static option files linked in the working directories.
+    """
+    os.makedirs(f"{root_dir}/src", exist_ok=True)
+    os.makedirs(f"{root_dir}/options/SPECIES", exist_ok=True)
+    for filename in ["FLEXPART.f90", "FLEXPART_MPI.f90", "par_mod.f90", "com_mod.f90", "timemanager.f90", "makefile"]:
+        with open(f"{root_dir}/src/{filename}", "w") as file:
+            file.write(STUB_MAKEFILE if filename=="makefile" else f"! stub {filename}\n")
+    with open(f"{root_dir}/src/flexpart_stub.py", "w") as file:
+        file.write(STUB_FLEXPART.format(python=sys.executable, benchmarks_dir=os.path.dirname(os.path.abspath(__file__))))
+    for filename in ["IGBP_int1.dat", "surfdata.t", "surfdepo.t", "SPECIES/SPECIES_022"]:
+        with open(f"{root_dir}/options/{filename}", "w") as file:
+            file.write(f"stub {filename}\n")
+    return root_dir
+
+def write_natural_earth_stub(data_dir: str) -> str:
+    """
+    Writes minimal Natural Earth coastline and border shapefiles, to use as cartopy's
+    pre_existing_data_dir so that the quicklooks are plotted offline, always with the
+    same background.
+    """
+    import shapefile
+    rng = np.random.default_rng(0)
+    for category, name in [("physical", "coastline"), ("cultural", "admin_0_boundary_lines_land")]:
+        os.makedirs(f"{data_dir}/shapefiles/natural_earth/{category}", exist_ok=True)
+        for resolution in ["110m", "50m", "10m"]:
+            with shapefile.Writer(f"{data_dir}/shapefiles/natural_earth/{category}/ne_{resolution}_{name}", shapeType=shapefile.POLYLINE) as writer:
+                writer.field("name", "C")
+                for index in range(20):
+                    start = rng.uniform([-170, -60], [150, 60])
+                    writer.line([np.cumsum(np.vstack([start, rng.normal(0, 2, (50, 2))]), axis=0).tolist()])
+                    writer.record(f"{name}_{index}")
+    return data_dir
@@ -25,6 +25,8 @@
 # +---------------------------------------------------------------------------+
 simu_date="$(date +%Y%m%d)"
 simu_end_date=$(date -d "${simu_date}+5 days" +%Y%m%d)
+previous_simu_date=$(date -d "${simu_date}-1 days" +%Y%m%d)
+previous_simu_end_date=$(date -d "${previous_simu_date}+5 days" +%Y%m%d)
 
 # +---------------------------------------------------------------------------+
 # | 2.                                                                        |
@@ -48,6 +50,9 @@ REMOTE_PYTHON_PATH="/home/resos/git/girafe/girafe.py"
 LAUNCH_SIMULATION=true
 EMISSIONS_FILE="/o3p/iagos/softio/EMISSIONS/CAMS-GLOB-ANT-download/CAMS-GLOB-ANT_Glb_0.1x0.1_anthro_co_v5.3_monthly.nc"
 EMISSIONS_NETCDF_VARIABLE="sum"
+# Each run dumps its particles after 24 hours and the next day run starts from
+# this dump (hot start) instead of simulating again the particles already emitted
+HOT_START=true
 
 # +---------------------------------------------------------------------------+
 # |                         ! ! ! DO NOT CHANGE ! ! !                         |
@@ -58,6 +63,13 @@ GIRAFE_CONFIG_FILE="${WDIR}/girafe-config-${simu_date}.xml"
 REMOTE_WDIR="/home/resos/GIRAFE/cron_test/${simu_date}_${simu_end_date}"
 REMOTE_DATA_DIR="/sedoo/resos/girafe/ecmwf_data/${simu_date}_${simu_end_date}"
 
+if [ "${HOT_START}" = true ]; then
+    PREVIOUS_REMOTE_WDIR="${REMOTE_ROOT_WDIR}/${previous_simu_date}_${previous_simu_end_date}"
+    RESTART_NODE="<restart><dump_after>24</dump_after><previous_run>${PREVIOUS_REMOTE_WDIR}</previous_run></restart>"
+else
+    RESTART_NODE=""
+fi
+
 mkdir -p ${WDIR}
 mkdir -p ${DATA_OUTPUT_DIR}
 
@@ -155,6 +167,7 @@ cat > ${GIRAFE_CONFIG_FILE} <<EOF
                     </zones>
                 </release>
             </releases>
+            ${RESTART_NODE}
         </flexpart>
         <paths>
             <working_dir>${REMOTE_WDIR}</working_dir>
@@ -1,3 +1,4 @@
+from __future__ import annotations
 import os
 import logging
 import datetime
@@ -6,26 +7,102 @@ import xml.etree.ElementTree as ET
 import glob
 import string
 import subprocess
-import netCDF4 as nc
+import importlib.util
 import numpy as np
 import re
 import shutil
-import matplotlib.pyplot as plt
 import math
-import matplotlib.ticker
-import cartopy.crs as crs
-import cartopy.feature as cf
-import cartopy.mpl
-import cartopy.mpl.gridliner
 import numpy.ma as ma
-from matplotlib import colors
-import pandas as pd
-import xarray as xr
+import functools
+import hashlib
+import json
+import tempfile
+import threading
+import queue
+import signal
+import time
+import collections
+import concurrent.futures
+import multiprocessing
+import heapq
+import resource
+import contextlib
+from dataclasses import dataclass, replace
+from types import MappingProxyType
+from typing import Mapping, Optional, Tuple, Union
 
 FLEXPART_ROOT   = "/usr/local/flexpart_v10.4_3d7eebf"
 FLEXPART_EXE    = "/usr/local/flexpart_v10.4_3d7eebf/src/FLEXPART"
 
-plt.rcParams.update({'font.family':'serif'})
+FLEXPART_SOURCE_EXTENSIONS = (".f90", ".f", ".F90", ".F", ".h", ".inc")
+FLEXPART_BUILD_PRODUCTS    = (".o", ".mod", ".a") # left in FLEXPART_ROOT/src by the container build, never staged
+FLEXPART_EXECUTABLES       = ["FLEXPART", "FLEXPART_MPI"] # executables of the makefile (and DBG_* debug builds), never staged
+FLEXPART_STATIC_OPTIONS    = ["IGBP_int1.dat", "surfdata.t", "surfdepo.t", "SPECIES"]
+COPY_BACK_WORKERS          = 4
+MAXPART_BUCKETS            = ["none", "pow2"]
+ECMWF_INDEX_FILENAME       = ".girafe_pool_index.json"
+RUN_METRICS_FILENAME       = "run_metrics.json"
+
+# Default warning thresholds of --plan, overridden by the <plan> node of the configuration file
+PLAN_LIMITS = {"max_memory_gb": 64.0,
+               "max_output_gb": 100.0,
+               "max_particles": 10000000}
+# Approximate sizes of the FLEXPART 10.4 static arrays used by --plan: number of real*4
+# meteorological 3D fields held per time in memory (numwfmem times), and bytes per particle
+FLEXPART_3D_FIELDS = 20
+FLEXPART_PARTICLE_BYTES = 120
+
+# Progress lines printed by FLEXPART at every output step: simulated seconds and number of particles
+FLEXPART_PROGRESS_PATTERNS = [re.compile(r"^\s*(-?\d+)\s+Seconds simulated:\s+(\d+)\s+Particles"),
+                              re.compile(r"Simulated\s+[-\d.]+\s+hours\s+\(\s*(-?\d+)\s+s\),\s+(\d+)\s+particles")]
+# Gridded FLEXPART output fields, linear in the sources, summed when merging release partitions
+SUMMED_OUTPUT_VARIABLES = re.compile(r"^(spec\d+_(mr|pptv)|(WD|DD)_spec\d+)$")
+
+# Wrapper launched by mpirun around every FLEXPART_MPI rank, printing its start/end times and exit code
+MPI_RANK_TIMER = """#!/bin/sh
+start=$(date +%s.%N)
+"$@"
+status=$?
+echo "GIRAFE_RANK_TIMING ${OMPI_COMM_WORLD_RANK:-${PMI_RANK:-0}} $start $(date +%s.%N) $status"
+exit $status
+"""
+MPI_RANK_TIMING_PATTERN = re.compile(r"^GIRAFE_RANK_TIMING (\d+) ([\d.]+) ([\d.]+) (-?\d+)$")
+
+# Maximum size of the chunks of the archived FLEXPART outputs (one time step, split along the next dimensions if larger)
+ARCHIVE_CHUNK_BYTES = 4*1024**2
+
+# Maximum size of the block of time steps read at once to integrate the concentrations over the height levels
+CONC_CHUNK_BYTES = 64*1024**2
+
+# Default zoom of the deepest level of the web-map tile pyramid and size of the tiles (pixels)
+TILES_MAX_ZOOM = 6
+TILE_SIZE      = 256
+
+# Default tolerance of --validate-restart on the normalized L1 difference between a hot-started and a cold run
+RESTART_TOLERANCE = 0.1
+
+LOGGER          = logging.getLogger('my_log')
+
+def lazy_import(name: str):
+    """
+    Returns the module name, actually imported at its first attribute access, so that
+    the commands which do not read NetCDF or GRIB files start without loading them.
+    The plotting libraries are imported in plot_girafe_simulation().
+    """
+    if name in sys.modules:
+        return sys.modules[name]
+    spec   = importlib.util.find_spec(name)
+    loader = importlib.util.LazyLoader(spec.loader)
+    spec.loader = loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    loader.exec_module(module)
+    return module
+
+nc      = lazy_import("netCDF4")
+pd      = lazy_import("pandas")
+xr      = lazy_import("xarray")
+eccodes = lazy_import("eccodes")
 
 DEFAULT_PARAMS = {"pi":3.14159265,
                   "r_earth":6.371e6,
@@ -114,6 +191,15 @@ def start_log() -> logging.Logger:
     logger.setLevel(logging.DEBUG)
     return logger
 
+def start_worker_log(level: int) -> None:
+    """
+    Initializer of the worker processes started by a fork server or spawned: they do
+    not inherit the handler of LOGGER, which is set up again with the level of the parent.
+    """
+    global LOGGER
+    LOGGER = start_log()
+    LOGGER.setLevel(level)
+
 def check_if_in_range(value, lim1, lim2):
     if value>=lim1 and value<=lim2:
         return True
@@ -126,35 +212,188 @@ def verif_xml_file(xml_filepath: str) -> None:
         LOGGER.error(os.path.basename(xml_filepath)+" file does not exist")
         sys.exit(1)
 
-def get_simulation_date(xml_file: str) -> dict:
-    xml  = ET.parse(xml_file)
-    # ________________________________________________________
-    # Check if all nodes are present
-    # xml_nodes = ["girafe/simulation_date",
-    #              "girafe/simulation_date/begin",
-    #              "girafe/simulation_date/end",
-    #              "girafe/simulation_date/dtime"]
-    xml_nodes = ["girafe/simulation_start",
-                 "girafe/simulation_start/date",
-                 "girafe/simulation_end",
-                 "girafe/simulation_end/date",
-                 "girafe/ecmwf_time",
-                 "girafe/ecmwf_time/dtime"]
-    for node in xml_nodes:
-        try:
-            found_node = xml.getroot().find(node)
-        except:
-            LOGGER.error("<simulation_date> node is missing or its children nodes are in incorrect format, check your configuration file!")
+def ddhhmmss_to_timedelta(ddhhmmss: str) -> datetime.timedelta:
+    return datetime.timedelta(days=int(ddhhmmss[:2]),
+                              hours=int(ddhhmmss[2:4]),
+                              minutes=int(ddhhmmss[4:6]),
+                              seconds=int(ddhhmmss[6:8]))
+
+@dataclass(frozen=True)
+class Zone:
+    name: str
+    lat_min: float
+    lat_max: float
+    lon_min: float
+    lon_max: float
+
+@dataclass(frozen=True)
+class Release:
+    name: str
+    start_date: str
+    start_time: str
+    duration: str
+    altitude_min: float
+    altitude_max: float
+    start_datetime: datetime.datetime
+    end_datetime: datetime.datetime
+    zones: Tuple[Zone, ...]
+
+    @property
+    def duration_delta(self) -> datetime.timedelta:
+        return self.end_datetime - self.start_datetime
+
+@dataclass(frozen=True)
+class Receptor:
+    name: str
+    longitude: str
+    latitude: str
+
+@dataclass(frozen=True)
+class OutGrid:
+    lon_min_text: str
+    lat_min_text: str
+    resolution_text: str
+    lon_min: float
+    lon_max: float
+    lat_min: float
+    lat_max: float
+    resolution: float
+    nx: int
+    ny: int
+    height_levels: Tuple[str, ...]
+
+    @property
+    def heights(self) -> np.ndarray:
+        return np.array([float(elem) for elem in self.height_levels])
+
+@dataclass(frozen=True)
+class RunResult:
+    status: str # finished, failed, timeout or stalled
+    return_code: int
+    wall_time: float
+    simulated_seconds: int
+    particles: int
+    log_filepath: str
+    cpu_time: float = 0.0 # seconds, user and system time of the command and of its children
+    peak_rss: int = 0 # bytes, largest resident memory of the command or of one of its children
+
+@dataclass(frozen=True)
+class GirafeConfig:
+    """
+    Immutable view of a GIRAFE configuration xml file. The whole <girafe> tree is
+    parsed and validated once by load_girafe_config(); every writer then takes this
+    object instead of the xml filepath.
+    """
+    filepath: str
+    begin_date: str
+    begin_time: str
+    end_date: str
+    end_time: str
+    dtime: int
+    begin_datetime: datetime.datetime
+    end_datetime: datetime.datetime
+    command: Tuple[Tuple[str, str], ...]
+    par_mod: Mapping[str, Union[int, float]]
+    outgrid: OutGrid
+    receptors: Tuple[Receptor, ...]
+    ageclass: Optional[str]
+    species: str
+    fire_confidence: Optional[float]
+    particle_budget: Optional[int]
+    aggregation_resolution: Optional[float]
+    releases: Tuple[Release, ...]
+    working_dir: str
+    ecmwf_dir: str
+    emissions: str
+    emissions_variable: Optional[str]
+    emissions_cache_dir: Optional[str]
+    build_cache_dir: Optional[str]
+    scratch_dir: Optional[str]
+    ecmwf_index: str
+    maxpart_bucket: str
+    plan_limits: Mapping[str, float]
+    run_timeout: Optional[float]
+    inactivity_timeout: Optional[float]
+    partitions: int
+    mpi_ranks: Optional[int]
+    plot_workers: Optional[int]
+    tiles_zooms: Optional[Tuple[int, int]]
+    archive_complevel: Optional[int]
+    archive_sparse: bool
+    prometheus_textfile: Optional[str]
+    restart_dump_hours: Optional[float]
+    restart_from: Optional[str]
+    restart_tolerance: float
+
+    @property
+    def flexpart_executable(self) -> str:
+        return "FLEXPART" if self.mpi_ranks is None else "FLEXPART_MPI"
+
+COMMAND_KEYS = [("flexpart/command/forward", "LDIRECT"),
+                ("simulation_start/date", "IBDATE"),
+                ("simulation_start/time", "IBTIME"),
+                ("simulation_end/date", "IEDATE"),
+                ("simulation_end/time", "IETIME"),
+                ("flexpart/command/time/output", "LOUTSTEP"),
+                ("flexpart/command/time/averageOutput", "LOUTAVER"),
+                ("flexpart/command/time/sampleRate", "LOUTSAMPLE"),
+                ("flexpart/command/time/particleSplitting", "ITSPLIT"),
+                ("flexpart/command/time/synchronisation", "LSYNCTIME"),
+                ("flexpart/command/ctl", "CTL"),
+                ("flexpart/command/ifine", "IFINE"),
+                ("flexpart/command/iOut", "IOUT"),
+                ("flexpart/command/ipOut", "IPOUT"),
+                ("flexpart/command/lSubGrid", "LSUBGRID"),
+                ("flexpart/command/lConvection", "LCONVECTION"),
+                ("flexpart/command/lAgeSpectra", "LAGESPECTRA"),
+                ("flexpart/command/ipIn", "IPIN"),
+                ("flexpart/command/iOfr", "IOUTPUTFOREACHRELEASE"),
+                ("flexpart/command/iFlux", "IFLUX"),
+                ("flexpart/command/mDomainFill", "MDOMAINFILL"),
+                ("flexpart/command/indSource", "IND_SOURCE"),
+                ("flexpart/command/indReceptor", "IND_RECEPTOR"),
+                ("flexpart/command/mQuasilag", "MQUASILAG"),
+                ("flexpart/command/nestedOutput", "NESTED_OUTPUT"),
+                ("flexpart/command/lInitCond", "LINIT_COND"),
+                ("flexpart/command/surfOnly", "SURF_ONLY"),
+                ("flexpart/command/cblFlag", "CBLFLAG")]
+
+PAR_MOD_KEYS = ["pi", "r_earth", "r_air", "nxmaxn", "nymaxn", "nxmax", "nymax", "nuvzmax", "nwzmax", "nzmax",
+                "maxwf", "maxtable", "numclass", "ni", "maxcolumn", "maxrand", "maxpart"]
+# par_mod.f90 dimensions sized from the ECMWF fields, the configured values are overrides
+PAR_MOD_DIMENSIONS = ["nxmax", "nymax", "nuvzmax", "nwzmax", "nzmax"]
+
+def find_node_text(root: ET.Element, path: str, error_message: str="") -> str:
+    """
+    Returns the text of the node found at path under root. If the node is missing or
+    empty, logs error_message and exits when a message is given, returns None otherwise.
+    """
+    node = root.find(path)
+    if (node is None) or (node.text is None) or (node.text.strip()==""):
+        if error_message!="":
+            LOGGER.error(error_message)
             sys.exit(1)
-    # ________________________________________________________
-    # Get date from the xml
-    xml  = xml.getroot().find("girafe")
+        return None
+    return node.text
+
+def parse_number(text: str) -> Union[int, float]:
+    return float(text) if "." in text else int(text)
+
+def get_simulation_datetimes(root: ET.Element) -> dict:
     date = {}
-    date["begin"] = xml.find("simulation_start").find("date").text
-    date["end"]   = xml.find("simulation_end").find("date").text
-    date["dtime"] = int(xml.find("ecmwf_time").find("dtime").text)
+    date["begin"] = find_node_text(root, "simulation_start/date", "<simulation_start/date> node is missing or empty, check your configuration file!")
+    date["end"]   = find_node_text(root, "simulation_end/date", "<simulation_end/date> node is missing or empty, check your configuration file!")
+    dtime         = find_node_text(root, "ecmwf_time/dtime", "<ecmwf_time/dtime> node is missing or empty, check your configuration file!")
+    time = {}
+    time["begin"] = find_node_text(root, "simulation_start/time", "<simulation_start/time> node is missing or empty, check your configuration file!")
+    time["end"]   = find_node_text(root, "simulation_end/time", "<simulation_end/time> node is missing or empty, check your configuration file!")
     # ________________________________________________________
     # Check if strings are correct
+    try:
+        date["dtime"] = int(dtime)
+    except:
+        LOGGER.error("ECMWF delta step of the data should be an integer number of hours, check your configuration file!")
+        sys.exit(1)
     try:
         begin_date = datetime.datetime.strptime(date["begin"],"%Y%m%d")
     except:
@@ -165,132 +404,383 @@ def get_simulation_date(xml_file: str) -> dict:
     except:
         LOGGER.error("End date of the simulation is incorrect. Correct pattern : YYYYMMDD")
         sys.exit(1)
-    # if (date["dtime"]!=3) and (date["dtime"]!=6):
-    #     LOGGER.error("ECMWF delta step of the data should be either 3 or 6 hours, check your configuration file!")
-    #     sys.exit(1)
     if begin_date > end_date:
         LOGGER.error("Begin date have to be earlier that the end date or be equal to the end date, check your configuration file")
         sys.exit(1)
-    return date
+    try:
+        begin_time = datetime.datetime.strptime(date["begin"]+"-"+time["begin"],"%Y%m%d-%H%M%S")
+    except:
+        LOGGER.error("Begin time of the simulation is incorrect. Correct pattern : HHMMSS")
+        sys.exit(1)
+    try:
+        end_time = datetime.datetime.strptime(date["end"]+"-"+time["end"],"%Y%m%d-%H%M%S")
+    except:
+        LOGGER.error("End time of the simulation is incorrect. Correct pattern : HHMMSS")
+        sys.exit(1)
+    if begin_time > end_time:
+        LOGGER.error("Begin and end date/time of the simulation are inconsistent; begin date and time of the simulation should always be before the end date and time of the simulation; check your configuration file!")
+        sys.exit(1)
+    return {"begin_date": date["begin"], "begin_time": time["begin"],
+            "end_date": date["end"], "end_time": time["end"],
+            "dtime": date["dtime"],
+            "begin_datetime": begin_time, "end_datetime": end_time}
+
+def get_command_values(root: ET.Element) -> Tuple[Tuple[str, str], ...]:
+    command = []
+    for xml_key, flexpart_key in COMMAND_KEYS:
+        value = find_node_text(root, xml_key)
+        if value is None:
+            try:
+                value = str(DEFAULT_PARAMS[os.path.basename(xml_key)])
+            except:
+                LOGGER.error(f"<{xml_key}> node is mandatory but missing, check your configuration file!")
+                sys.exit(1)
+        command.append((flexpart_key, value))
+    return tuple(command)
+
+def set_command_value(command: Tuple[Tuple[str, str], ...], flexpart_key: str, value: str) -> Tuple[Tuple[str, str], ...]:
+    return tuple((key, value if key==flexpart_key else old_value) for key, old_value in command)
+
+def get_par_mod_values(root: ET.Element) -> Mapping[str, Union[int, float]]:
+    xml = root.find("flexpart/par_mod_parameters")
+    keys_values = {}
+    for key in PAR_MOD_KEYS:
+        value = None if xml is None else find_node_text(xml, key)
+        if value is not None:
+            try:
+                keys_values[key] = parse_number(value)
+            except ValueError:
+                LOGGER.error(f"<par_mod_parameters/{key}> value must be a number, check your configuration file!")
+                sys.exit(1)
+    return MappingProxyType(keys_values)
 
-def get_simulation_time(xml_file: str) -> dict:
-    simul_date = get_simulation_date(xml_file)
-    xml  = ET.parse(xml_file)
+def get_outgrid(root: ET.Element) -> OutGrid:
+    xml = root.find("flexpart/out_grid")
+    if xml is None:
+        LOGGER.error("<flexpart/out_grid> node is missing or its children nodes are in incorrect format, check your configuration file!")
+        sys.exit(1)
+    texts = {}
+    for node in ["longitude/min", "longitude/max", "latitude/min", "latitude/max", "resolution"]:
+        texts[node] = find_node_text(xml, node, "<flexpart/out_grid> node is missing or its children nodes are in incorrect format, check your configuration file!")
+    height_node = xml.find("height")
+    height_levels = tuple() if height_node is None else tuple(node.text for node in height_node)
+    try:
+        lon_min, lon_max = float(texts["longitude/min"]), float(texts["longitude/max"])
+        lat_min, lat_max = float(texts["latitude/min"]), float(texts["latitude/max"])
+        resolution       = float(texts["resolution"])
+        heights          = [float(elem) for elem in height_levels]
+    except:
+        LOGGER.error("<flexpart/out_grid> node is missing or its children nodes are in incorrect format, check your configuration file!")
+        sys.exit(1)
     # ________________________________________________________
-    # Check if all nodes are present
-    # xml_nodes = ["girafe/simulation_start",
-    #              "girafe/simulation_time/begin",
-    #              "girafe/simulation_time/end"]
-    xml_nodes = ["girafe/simulation_start",
-                 "girafe/simulation_start/time",
-                 "girafe/simulation_end",
-                 "girafe/simulation_end/time"]
-    for node in xml_nodes:
+    # Check if data is correct
+    if lat_min<-90.0 or lat_max>90.0:
+        LOGGER.error("Latitude of the simulation domain is out of valid range [-90;+90], please check your configuration file.")
+        sys.exit(1)
+    if lat_min>=lat_max:
+        LOGGER.error("Minimum latitude for your simulation domain should be less than the maximum latitude, please check your configuration file.")
+        sys.exit(1)
+    if lon_min>=lon_max:
+        LOGGER.error("Minimum longitude for your simulation domain should be less than the maximum longitude, please check your configuration file.")
+        sys.exit(1)
+    if resolution<=0:
+        LOGGER.error("Spatial resolution should be positive, check your configuration file!")
+        sys.exit(1)
+    Nx = int((lon_max - lon_min)/resolution)
+    Ny = int((lat_max - lat_min)/resolution)
+    if (Nx<=0) or (Ny<=0):
+        LOGGER.error("Minimum latitude and longitude should always be inferior to the maximum values, resolution should be consistent with chosen lat/lon window to avoid zero-size image in X and Y direction, check your configuration file!")
+        sys.exit(1)
+    if np.any([elem<0 for elem in heights]):
+        LOGGER.error("Height values can only be positive, check your configuration file!")
+        sys.exit(1)
+    return OutGrid(lon_min_text=texts["longitude/min"],
+                   lat_min_text=texts["latitude/min"],
+                   resolution_text=texts["resolution"],
+                   lon_min=lon_min, lon_max=lon_max,
+                   lat_min=lat_min, lat_max=lat_max,
+                   resolution=resolution,
+                   nx=Nx, ny=Ny,
+                   height_levels=height_levels)
+
+def get_zones(release_node: ET.Element) -> Tuple[Zone, ...]:
+    zones = []
+    zones_node = release_node.find("zones")
+    if zones_node is None:
+        LOGGER.error(f"<zones> node is missing in the release {release_node.attrib.get('name')}, check your configuration file!")
+        sys.exit(1)
+    for zone_node in zones_node:
         try:
-            found_node = xml.getroot().find(node)
+            lon_min, lon_max = float(zone_node.find("lonmin").text), float(zone_node.find("lonmax").text)
+            lat_min, lat_max = float(zone_node.find("latmin").text), float(zone_node.find("latmax").text)
         except:
-            LOGGER.error("<simulation_time> node is missing or its children nodes are in incorrect format, check your configuration file!")
+            LOGGER.error("Zones of the releases must have latmin, latmax, lonmin and lonmax nodes, check your configuration file!")
             sys.exit(1)
-    # ________________________________________________________
-    # Get time from the xml file
-    xml  = xml.getroot().find("girafe")
-    time = {}
-    time["begin"] = xml.find("simulation_start").find("time").text
-    time["end"]   = xml.find("simulation_end").find("time").text
-    # ________________________________________________________
-    # Check if strings are correct
+        if not ((check_if_in_range(lon_min,-180,180) and check_if_in_range(lon_max,-180,180)) or \
+                (check_if_in_range(lon_min,0,360) and check_if_in_range(lon_max,0,360))):
+            LOGGER.error("Longitude of the release must respect either the [-180°;+180°] or [0°;+360°] convention, please check your configuration file.")
+            sys.exit(1)
+        if not (check_if_in_range(lat_min,-90,90) and check_if_in_range(lat_max,-90,90)):
+            LOGGER.error("Latitude of the release must respect the [-90°;+90°] convention, please check your configuration file.")
+            sys.exit(1)
+        if (lon_min>lon_max) or (lat_min>lat_max):
+            LOGGER.error("Minimum latitude and longitude should always be inferior to the maximum values, check your configuration file!")
+            sys.exit(1)
+        zones.append(Zone(name=zone_node.attrib.get("name", ""),
+                          lat_min=lat_min, lat_max=lat_max,
+                          lon_min=lon_min, lon_max=lon_max))
+    return tuple(zones)
+
+def get_releases(root: ET.Element) -> Tuple[Release, ...]:
+    releases = []
+    releases_node = root.find("flexpart/releases")
+    for release_node in releases_node:
+        if release_node.tag!="release":
+            continue
+        start_date = find_node_text(release_node, "start_date", "<start_date> node is mandatory for every release, check your configuration file!")
+        start_time = find_node_text(release_node, "start_time") or "00000000"
+        duration   = find_node_text(release_node, "duration", "<duration> node is mandatory for every release, check your configuration file!")
+        try:
+            start_datetime = datetime.datetime.strptime(start_date,"%Y%m%d") + ddhhmmss_to_timedelta(start_time)
+            end_datetime   = start_datetime + ddhhmmss_to_timedelta(duration)
+        except:
+            LOGGER.error("Release dates and times are incorrect. Correct patterns : YYYYMMDD for the start date, DDHHMMSS for the start time and the duration")
+            sys.exit(1)
+        try:
+            altitude_min = float(release_node.find("altitude_min").text)
+            altitude_max = float(release_node.find("altitude_max").text)
+        except:
+            LOGGER.error("<altitude_min> and <altitude_max> nodes are mandatory for every release, check your configuration file!")
+            sys.exit(1)
+        if altitude_min>altitude_max:
+            LOGGER.error("Minimum altitude/height should be inferior or equal to the maximum value, check your configuration file!")
+            sys.exit(1)
+        releases.append(Release(name=release_node.attrib.get("name", ""),
+                                start_date=start_date,
+                                start_time=start_time,
+                                duration=duration,
+                                altitude_min=altitude_min,
+                                altitude_max=altitude_max,
+                                start_datetime=start_datetime,
+                                end_datetime=end_datetime,
+                                zones=get_zones(release_node)))
+    return tuple(releases)
+
+@functools.lru_cache(maxsize=None)
+def _load_girafe_config(xml_filepath: str, mtime_ns: int, size: int) -> GirafeConfig:
+    try:
+        root = ET.parse(xml_filepath).getroot().find("girafe")
+    except ET.ParseError as error:
+        LOGGER.error(f"{os.path.basename(xml_filepath)} is not a valid xml file ({error})")
+        sys.exit(1)
+    if root is None:
+        LOGGER.error("<girafe> node is missing, check your configuration file!")
+        sys.exit(1)
+    if root.find("flexpart/releases") is None:
+        LOGGER.error("<flexpart/releases> node is missing, check your configuration file!")
+        sys.exit(1)
+    receptor_node = root.find("flexpart/receptor")
+    receptors = tuple() if receptor_node is None else tuple(Receptor(name=node.attrib["name"],
+                                                                     longitude=node.attrib["longitude"],
+                                                                     latitude=node.attrib["latitude"]) for node in receptor_node)
+    maxpart_bucket = (find_node_text(root, "flexpart/par_mod_parameters/maxpart_bucket") or "none").strip()
+    if maxpart_bucket not in MAXPART_BUCKETS:
+        LOGGER.error(f"maxpart_bucket must be one of {MAXPART_BUCKETS}, check your configuration file!")
+        sys.exit(1)
+    plan_limits = dict(PLAN_LIMITS)
+    for key in PLAN_LIMITS:
+        value = find_node_text(root, f"plan/{key}")
+        try:
+            plan_limits[key] = plan_limits[key] if value is None else float(value)
+        except:
+            LOGGER.error(f"<plan/{key}> value must be a number, check your configuration file!")
+            sys.exit(1)
+    timeouts = {}
+    for key in ["timeout", "inactivity_timeout"]:
+        value = find_node_text(root, f"execution/{key}")
+        try:
+            timeouts[key] = None if value is None else float(value)
+        except:
+            LOGGER.error(f"<execution/{key}> value must be a number of seconds, check your configuration file!")
+            sys.exit(1)
+    partitions = find_node_text(root, "execution/partitions") or "1"
     try:
-        begin_time = datetime.datetime.strptime(simul_date["begin"]+"-"+time["begin"],"%Y%m%d-%H%M%S")
+        partitions = int(partitions)
     except:
-        LOGGER.error("Begin time of the simulation is incorrect. Correct pattern : HHMMSS")
+        partitions = 0
+    if partitions<1:
+        LOGGER.error("<execution/partitions> must be a positive integer, check your configuration file!")
         sys.exit(1)
+    plot_workers = find_node_text(root, "execution/plot_workers")
     try:
-        end_time = datetime.datetime.strptime(simul_date["end"]+"-"+time["end"],"%Y%m%d-%H%M%S")
+        plot_workers = None if plot_workers is None else int(plot_workers)
     except:
-        LOGGER.error("End time of the simulation is incorrect. Correct pattern : HHMMSS")
+        plot_workers = 0
+    if (plot_workers is not None) and (plot_workers<1):
+        LOGGER.error("<execution/plot_workers> must be a positive integer, check your configuration file!")
         sys.exit(1)
-    if begin_time > end_time:
-        LOGGER.error("Begin and end date/time of the simulation are inconsistent; begin date and time of the simulation should always be before the end date and time of the simulation; check your configuration file!")
+    tiles_zooms = None
+    if root.find("tiles") is not None:
+        try:
+            tiles_zooms = (int(find_node_text(root, "tiles/min_zoom") or "0"), int(find_node_text(root, "tiles/max_zoom") or str(TILES_MAX_ZOOM)))
+        except:
+            tiles_zooms = (-1, -1)
+        if not (0<=tiles_zooms[0]<=tiles_zooms[1]):
+            LOGGER.error("<tiles/min_zoom> and <tiles/max_zoom> must be integers with 0 <= min_zoom <= max_zoom, check your configuration file!")
+            sys.exit(1)
+    archive_complevel, archive_sparse = None, False
+    if root.find("archive") is not None:
+        try:
+            archive_complevel = int(find_node_text(root, "archive/complevel") or "4")
+        except:
+            archive_complevel = 0
+        archive_sparse = (find_node_text(root, "archive/sparse") or "false").strip().lower()
+        if (not 1<=archive_complevel<=9) or (archive_sparse not in ["true", "false"]):
+            LOGGER.error("<archive/complevel> must be an integer from 1 to 9 and <archive/sparse> true or false, check your configuration file!")
+            sys.exit(1)
+        archive_sparse = archive_sparse=="true"
+    mpi_node  = root.find("execution/mpi")
+    mpi_ranks = None
+    if mpi_node is not None:
+        try:
+            mpi_ranks = int(mpi_node.attrib["ranks"])
+        except:
+            mpi_ranks = 0
+        if mpi_ranks<1:
+            LOGGER.error("<execution/mpi> node needs a positive number of ranks (<mpi ranks=\"N\"/>), check your configuration file!")
+            sys.exit(1)
+    fire_confidence = find_node_text(root, "flexpart/releases/fire_confidence")
+    try:
+        fire_confidence = None if fire_confidence is None else float(fire_confidence)
+    except:
+        LOGGER.error("fire_confidence value must be a number, check your configuration file!")
+        sys.exit(1)
+    particle_budget        = find_node_text(root, "flexpart/releases/particle_budget")
+    aggregation_resolution = find_node_text(root, "flexpart/releases/aggregation_resolution")
+    try:
+        particle_budget        = None if particle_budget is None else int(particle_budget)
+        aggregation_resolution = None if aggregation_resolution is None else float(aggregation_resolution)
+    except:
+        LOGGER.error("particle_budget must be an integer and aggregation_resolution a number, check your configuration file!")
         sys.exit(1)
-    return time
+    if ((particle_budget is not None) and (particle_budget<=0)) or ((aggregation_resolution is not None) and (aggregation_resolution<=0)):
+        LOGGER.error("particle_budget and aggregation_resolution must be positive, check your configuration file!")
+        sys.exit(1)
+    command = get_command_values(root)
+    dates   = get_simulation_datetimes(root)
+    restart_dump_hours = find_node_text(root, "flexpart/restart/dump_after")
+    restart_tolerance  = find_node_text(root, "flexpart/restart/tolerance")
+    try:
+        restart_dump_hours = None if restart_dump_hours is None else float(restart_dump_hours)
+        restart_tolerance  = RESTART_TOLERANCE if restart_tolerance is None else float(restart_tolerance)
+    except:
+        LOGGER.error("<flexpart/restart/dump_after> (hours) and <flexpart/restart/tolerance> must be numbers, check your configuration file!")
+        sys.exit(1)
+    restart_from = find_node_text(root, "flexpart/restart/previous_run")
+    if ((restart_dump_hours is not None) or (restart_from is not None)) and (partitions>1):
+        LOGGER.error("Particle dumps and hot starts are not supported with release partitioning, check your configuration file!")
+        sys.exit(1)
+    if restart_dump_hours is not None:
+        dump_seconds = restart_dump_hours*3600
+        if (dump_seconds<=0) or (dates["begin_datetime"]+datetime.timedelta(seconds=dump_seconds) > dates["end_datetime"]) or \
+           (dump_seconds % int(dict(command)["LOUTSTEP"])!=0):
+            LOGGER.error("<flexpart/restart/dump_after> must be a positive number of hours within the simulation and a multiple of the output time step, check your configuration file!")
+            sys.exit(1)
+        # FLEXPART dumps the particles at every output time step (IPOUT=1) and the one at
+        # dump_after is kept, or only at the end of the simulation (IPOUT=2) when they match
+        dump_at_end = dates["begin_datetime"]+datetime.timedelta(seconds=dump_seconds) == dates["end_datetime"]
+        command = set_command_value(command, "IPOUT", "2" if dump_at_end else "1")
+    return GirafeConfig(filepath=xml_filepath,
+                        **dates,
+                        command=command,
+                        par_mod=get_par_mod_values(root),
+                        outgrid=get_outgrid(root),
+                        receptors=receptors,
+                        ageclass=find_node_text(root, "flexpart/ageclass/class"),
+                        species=find_node_text(root, "flexpart/releases/species", "<flexpart/releases/species> node is mandatory, check your configuration file!"),
+                        fire_confidence=fire_confidence,
+                        particle_budget=particle_budget,
+                        aggregation_resolution=aggregation_resolution,
+                        releases=get_releases(root),
+                        working_dir=find_node_text(root, "paths/working_dir", "<paths/working_dir> node is mandatory, check your configuration file!"),
+                        ecmwf_dir=find_node_text(root, "paths/ecmwf_dir", "<paths/ecmwf_dir> node is mandatory, check your configuration file!"),
+                        emissions=find_node_text(root, "paths/emissions", "<paths/emissions> node is mandatory, check your configuration file!"),
+                        emissions_variable=find_node_text(root, "paths/emissions_variable"),
+                        emissions_cache_dir=find_node_text(root, "paths/emissions_cache"),
+                        build_cache_dir=find_node_text(root, "paths/build_cache"),
+                        scratch_dir=find_node_text(root, "paths/scratch_dir"),
+                        ecmwf_index=find_node_text(root, "paths/ecmwf_index") or f"{find_node_text(root, 'paths/ecmwf_dir')}/{ECMWF_INDEX_FILENAME}",
+                        prometheus_textfile=find_node_text(root, "paths/prometheus_textfile"),
+                        maxpart_bucket=maxpart_bucket,
+                        plan_limits=MappingProxyType(plan_limits),
+                        run_timeout=timeouts["timeout"],
+                        inactivity_timeout=timeouts["inactivity_timeout"],
+                        partitions=partitions,
+                        mpi_ranks=mpi_ranks,
+                        plot_workers=plot_workers,
+                        tiles_zooms=tiles_zooms,
+                        archive_complevel=archive_complevel,
+                        archive_sparse=archive_sparse,
+                        restart_dump_hours=restart_dump_hours,
+                        restart_from=restart_from,
+                        restart_tolerance=restart_tolerance)
+
+def load_girafe_config(xml_filepath: str) -> GirafeConfig:
+    """
+    Parses and validates the configuration xml file into a GirafeConfig. The result is
+    cached on the file path, modification time and size, so repeated calls on an
+    unchanged file return the same object without parsing the xml again.
+    """
+    verif_xml_file(xml_filepath)
+    stat = os.stat(xml_filepath)
+    return _load_girafe_config(os.path.abspath(xml_filepath), stat.st_mtime_ns, stat.st_size)
 
-def write_available_file(config_xml_filepath: str, working_dir: str) -> None:
+def get_ECMWF_files(config: GirafeConfig) -> list:
+    """
+    Returns the (date, filename) of the ECMWF files covering the simulation, every
+    dtime hours, in the order of the AVAILABLE file.
+    """
+    start_date = datetime.datetime.combine(config.begin_datetime.date(), datetime.time())
+    end_date   = datetime.datetime.combine(config.end_datetime.date(), datetime.time())
+    hour_delta = datetime.timedelta(hours=config.dtime)
+    start_file_date  = start_date + hour_delta*np.floor(int(config.begin_time)/(config.dtime*10000))
+    end_file_date    = end_date   + hour_delta*np.ceil(int(config.end_time)/(config.dtime*10000))
+    file_date        = start_file_date
+    ecmwf_files      = []
+    while file_date <= end_file_date:
+        ecmwf_files.append((file_date, "EN" + datetime.datetime.strftime(file_date,"%y%m%d%H")))
+        file_date = file_date + hour_delta
+    return ecmwf_files
+
+def write_available_file(config: GirafeConfig, working_dir: str) -> None:
     LOGGER.info("Preparing AVAILABLE file for FLEXPART")
-    simul_date = get_simulation_date(config_xml_filepath)
-    simul_time = get_simulation_time(config_xml_filepath)
-    # print(simul_date)
-    # print(simul_time)
     # 	20120101 000000      EA12010100      ON DISK
-    start_date = datetime.datetime.strptime(simul_date["begin"]+"T000000","%Y%m%dT%H%M%S")
-    end_date   = datetime.datetime.strptime(simul_date["end"]+"T000000","%Y%m%dT%H%M%S")
-    hour_delta = datetime.timedelta(hours=simul_date["dtime"])
-    start_file_date  = start_date + hour_delta*np.floor(int(simul_time["begin"])/(simul_date["dtime"]*10000))
-    end_file_date    = end_date   + hour_delta*np.ceil(int(simul_time["end"])/(simul_date["dtime"]*10000))
-    file_date        = start_file_date
     with open(working_dir+"/AVAILABLE","w") as file:
         file.write("XXXXXX EMPTY LINES XXXXXXXXX\n")
         file.write("XXXXXX EMPTY LINES XXXXXXXXX\n")
         file.write("YYYYMMDD HHMMSS   name of the file(up to 80 characters)\n")
-        while file_date <= end_file_date:
+        for file_date, filename in get_ECMWF_files(config):
             line = ""
             line = line + datetime.datetime.strftime(file_date,"%Y%m%d") + " "
             line = line + datetime.datetime.strftime(file_date,"%H%M%S") + "      "
-            line = line + "EN" + datetime.datetime.strftime(file_date,"%y%m%d%H") + "      "
+            line = line + filename + "      "
             line = line + "ON DISK\n"
             file.write(line)
-            file_date = file_date + hour_delta
-
-def get_ECMWF_pool_path(config_xml_filepath: str) -> str:
-    xml  = ET.parse(config_xml_filepath)
-    return xml.getroot().find("girafe").find("paths").find("ecmwf_dir").text
 
-def write_pathnames_file(config_xml_filepath: str, working_dir: str) -> None:
+def write_pathnames_file(config: GirafeConfig, working_dir: str) -> None:
     # options_folder/
     # output_folder/
     # ECMWF_data_folder/
     # path_to_AVAILABLE_file/AVAILABLE
     LOGGER.info("Preparing pathnames file for FLEXPART")
     with open(working_dir+"/pathnames","w") as file:
-        file.write(wdir+"/options/\n")
-        file.write(wdir+"/output/\n")
-        file.write(get_ECMWF_pool_path(config_xml_filepath)+"\n")
-        file.write(wdir+"/AVAILABLE")
+        file.write(working_dir+"/options/\n")
+        file.write(working_dir+"/output/\n")
+        file.write(config.ecmwf_dir+"\n")
+        file.write(working_dir+"/AVAILABLE")
 
-def write_command_file(config_xml_filepath: str, working_dir: str) -> None:
+def write_command_file(config: GirafeConfig, working_dir: str) -> None:
     LOGGER.info("Preparing COMMAND file for FLEXPART")
-    xml  = ET.parse(config_xml_filepath)
-    xml  = xml.getroot().find("girafe")
-    xml_keys = ["flexpart/command/forward",
-                "simulation_start/date",
-                "simulation_start/time",
-                "simulation_end/date",
-                "simulation_end/time",
-                "flexpart/command/time/output",
-                "flexpart/command/time/averageOutput",
-                "flexpart/command/time/sampleRate",
-                "flexpart/command/time/particleSplitting",
-                "flexpart/command/time/synchronisation",
-                "flexpart/command/ctl",
-                "flexpart/command/ifine",
-                "flexpart/command/iOut",
-                "flexpart/command/ipOut",
-                "flexpart/command/lSubGrid",
-                "flexpart/command/lConvection",
-                "flexpart/command/lAgeSpectra",
-                "flexpart/command/ipIn",
-                "flexpart/command/iOfr",
-                "flexpart/command/iFlux",
-                "flexpart/command/mDomainFill",
-                "flexpart/command/indSource",
-                "flexpart/command/indReceptor",
-                "flexpart/command/mQuasilag",
-                "flexpart/command/nestedOutput",
-                "flexpart/command/lInitCond",
-                "flexpart/command/surfOnly",
-                "flexpart/command/cblFlag"]
-    flexpart_keys = ["LDIRECT","IBDATE","IBTIME","IEDATE","IETIME","LOUTSTEP","LOUTAVER","LOUTSAMPLE","ITSPLIT","LSYNCTIME","CTL",
-                     "IFINE","IOUT","IPOUT","LSUBGRID","LCONVECTION","LAGESPECTRA","IPIN","IOUTPUTFOREACHRELEASE","IFLUX","MDOMAINFILL",
-                     "IND_SOURCE","IND_RECEPTOR","MQUASILAG","NESTED_OUTPUT","LINIT_COND","SURF_ONLY","CBLFLAG"]
     with open(working_dir+"/options/COMMAND","w") as file:
         file.write("***************************************************************************************************************\n")
         file.write("*                                                                                                             *\n")
@@ -299,76 +789,19 @@ def write_command_file(config_xml_filepath: str, working_dir: str) -> None:
         file.write("*                                                                                                             *\n")
         file.write("***************************************************************************************************************\n")
         file.write("&COMMAND\n")
-        for ii in range(len(xml_keys)):
-            try:
-                value = xml.find(xml_keys[ii]).text
-            except:
-                try:
-                    value = str(DEFAULT_PARAMS[os.path.basename(xml_keys[ii])])
-                except:
-                    LOGGER.error(f"<{xml_keys[ii]}> node is mandatory but missing, check your configuration file!")
+        for flexpart_key, value in config.command:
             file.write(" "+
-                       flexpart_keys[ii]+"="+
-                       " "*(24-len(flexpart_keys[ii])-1-len(value))+
+                       flexpart_key+"="+
+                       " "*(24-len(flexpart_key)-1-len(value))+
                        value+
                        ",\n")
         file.write(" OHFIELDS_PATH=\""+FLEXPART_ROOT+"/flexin\",\n")
         file.write(" /\n")
 
 
-def write_outgrid_file(config_xml_filepath: str, working_dir: str) -> None:
+def write_outgrid_file(config: GirafeConfig, working_dir: str) -> None:
     LOGGER.info("Preparing OUTGRID file for FLEXPART")
-    xml  = ET.parse(config_xml_filepath)
-    # ________________________________________________________
-    # Check if all nodes are present
-    xml_nodes = ["girafe/flexpart/out_grid",
-                 "girafe/flexpart/out_grid/longitude/min",
-                 "girafe/flexpart/out_grid/longitude/max",
-                 "girafe/flexpart/out_grid/latitude/min",
-                 "girafe/flexpart/out_grid/latitude/max",
-                 "girafe/flexpart/out_grid/resolution"]
-    for node in xml_nodes:
-        try:
-            found_node = xml.getroot().find(node)
-        except:
-            LOGGER.error("<flexpart/out_grid> node is missing or its children nodes are in incorrect format, check your configuration file!")
-            sys.exit(1)
-    # ________________________________________________________
-    # Get data from the xml file
-    xml  = xml.getroot().find("girafe/flexpart/out_grid")
-    Nx = int((float(xml.find("longitude/max").text) - float(xml.find("longitude/min").text))/float(xml.find("resolution").text))
-    Ny = int((float(xml.find("latitude/max").text) - float(xml.find("latitude/min").text))/float(xml.find("resolution").text))
-    height_levels = [node.text for node in xml.find("height")]
-    lon_min, lon_max = float(xml.find("longitude/min").text), float(xml.find("longitude/max").text)
-    lat_min, lat_max = float(xml.find("latitude/min").text), float(xml.find("latitude/max").text)
-    # ________________________________________________________
-    # Check if data is correct
-    if lat_min<-90.0 or lat_max>90.0:
-        LOGGER.error("Latitude of the simulation domain is out of valid range [-90;+90], please check your configuration file.")
-        sys.exit(1)
-    if lat_min>=lat_max:
-        LOGGER.error("Minimum latitude for your simulation domain should be less than the maximum latitude, please check your configuration file.")
-        sys.exit(1)
-    if lon_min>=lon_max:
-        LOGGER.error("Minimum longitude for your simulation domain should be less than the maximum longitude, please check your configuration file.")
-        sys.exit(1)
-    # if (lon_min>=-180.0 and lon_min<180.0 and lon_max>-180.0 and lon_max<=180.0):
-    #     lon_status = 0
-    # elif ((lon_min>=180.0 or lon_max>180.0) and lon_max<=360.0):
-    #     lon_status = 0
-    # else:
-    #     LOGGER.error("Longitude of the simulation domaine must respect either the [-180°;+180°] or [0°;+360°] convention, please check your configuration file.")
-    #     sys.exit(1)
-    if (Nx<=0) or (Ny<=0):
-        LOGGER.error("Minimum latitude and longitude should always be inferior to the maximum values, resolution should be consistent with chosen lat/lon window to avoid zero-size image in X and Y direction, check your configuration file!")
-        sys.exit(1)
-    if float(xml.find("resolution").text)<=0:
-        LOGGER.error("Spatial resolution should be positive, check your configuration file!")
-        sys.exit(1)
-    check_height_levels = [float(elem)<0 for elem in height_levels]
-    if np.any(check_height_levels):
-        LOGGER.error("Height values can only be positive, check your configuration file!")
-        sys.exit(1)
+    outgrid = config.outgrid
     # ________________________________________________________
     # Write OUTGRID file
     with open(working_dir+"/options/OUTGRID","w") as file:
@@ -386,26 +819,24 @@ def write_outgrid_file(config_xml_filepath: str, working_dir: str) -> None:
         file.write("! OUTHEIGHTS = HEIGHT OF LEVELS (UPPER BOUNDARY)                               *\n")
         file.write("!*******************************************************************************\n")
         file.write("&OUTGRID\n")
-        file.write(" OUTLON0="+" "*(18-8-len(xml.find("longitude/min").text))+xml.find("longitude/min").text+",\n")
-        file.write(" OUTLAT0="+" "*(18-8-len(xml.find("latitude/min").text))+xml.find("latitude/min").text+",\n")
-        file.write(" NUMXGRID="+" "*(18-9-len(str(Nx)))+str(Nx)+",\n")
-        file.write(" NUMYGRID="+" "*(18-9-len(str(Ny)))+str(Ny)+",\n")
-        file.write(" DXOUT="+" "*(18-6-len(xml.find("resolution").text))+xml.find("resolution").text+",\n")
-        file.write(" DYOUT="+" "*(18-6-len(xml.find("resolution").text))+xml.find("resolution").text+",\n")
-        file.write(" OUTHEIGHTS= "+", ".join(height_levels)+",\n")
+        file.write(" OUTLON0="+" "*(18-8-len(outgrid.lon_min_text))+outgrid.lon_min_text+",\n")
+        file.write(" OUTLAT0="+" "*(18-8-len(outgrid.lat_min_text))+outgrid.lat_min_text+",\n")
+        file.write(" NUMXGRID="+" "*(18-9-len(str(outgrid.nx)))+str(outgrid.nx)+",\n")
+        file.write(" NUMYGRID="+" "*(18-9-len(str(outgrid.ny)))+str(outgrid.ny)+",\n")
+        file.write(" DXOUT="+" "*(18-6-len(outgrid.resolution_text))+outgrid.resolution_text+",\n")
+        file.write(" DYOUT="+" "*(18-6-len(outgrid.resolution_text))+outgrid.resolution_text+",\n")
+        file.write(" OUTHEIGHTS= "+", ".join(outgrid.height_levels)+",\n")
         file.write(" /\n")
         
-def write_receptors_file(config_xml_filepath: str, working_dir: str) -> None:
+def write_receptors_file(config: GirafeConfig, working_dir: str) -> None:
     LOGGER.info("Preparing RECEPTORS file for FLEXPART")
-    xml  = ET.parse(config_xml_filepath)
-    xml  = xml.getroot().find("girafe/flexpart/receptor")
-    if xml != None:
+    if len(config.receptors)>0:
         with open(working_dir+"/options/RECEPTORS","w") as file:
-            for node in xml:
+            for receptor in config.receptors:
                 file.write("&RECEPTORS\n")
-                file.write(f" RECEPTOR=\"{node.attrib['name']}\",\n")
-                file.write(f" LON={node.attrib['longitude']},\n")
-                file.write(f" LAT={node.attrib['latitude']},\n")
+                file.write(f" RECEPTOR=\"{receptor.name}\",\n")
+                file.write(f" LON={receptor.longitude},\n")
+                file.write(f" LAT={receptor.latitude},\n")
                 file.write(" /\n")
     else:
         LOGGER.info("No receptors were requested")
@@ -418,15 +849,13 @@ def write_receptors_file(config_xml_filepath: str, working_dir: str) -> None:
             file.write(f" LAT=0.0,\n")
             file.write(" /\n")
 
-def write_ageclasses_file(config_xml_filepath: str, working_dir: str) -> None:
+def write_ageclasses_file(config: GirafeConfig, working_dir: str) -> None:
     LOGGER.info("Preparing AGECLASSES file for FLEXPART")
-    xml  = ET.parse(config_xml_filepath)
-    xml  = xml.getroot().find("girafe/flexpart/ageclass")
-    if xml != None:
+    if config.ageclass is not None:
         with open(working_dir+"/options/AGECLASS","w") as file:
             file.write("&AGECLASS\n")
             file.write(" NAGECLASS=1\n")
-            file.write(f" LAGE={xml.find('class').text}\n")
+            file.write(f" LAGE={config.ageclass}\n")
             file.write(" /\n")
     else:
         LOGGER.info("Taking default ageclass value")
@@ -436,38 +865,31 @@ def write_ageclasses_file(config_xml_filepath: str, working_dir: str) -> None:
             file.write(f" LAGE={DEFAULT_PARAMS['ageclass']}\n")
             file.write(" /\n")
 
-def write_par_mod_file(config_xml_filepath: str, working_dir: str, max_number_parts: int) -> None:
+def bucket_maxpart(maxpart: int, policy: str) -> int:
+    """
+    Rounds maxpart up according to the bucketing policy, so that small changes in the
+    number of released particles give the same par_mod.f90 (and the same cached build).
+    """
+    if policy=="pow2":
+        return 1 << (maxpart-1).bit_length()
+    return maxpart
+
+def get_par_mod_parameters(config: GirafeConfig, max_number_parts: int, dimensions: dict=None) -> dict:
+    """
+    Returns the par_mod.f90 parameters: the grid dimensions (see get_par_mod_dimensions(),
+    the global 0.5° defaults without them), the number of particles and the values of
+    <par_mod_parameters>.
+    """
+    keys_values = {key: DEFAULT_PARAMS[key] for key in PAR_MOD_KEYS}
+    keys_values["maxpart"] = max_number_parts
+    keys_values.update(dimensions or {})
+    keys_values.update(config.par_mod)
+    return keys_values
+
+def write_par_mod_file(config: GirafeConfig, working_dir: str, max_number_parts: int, dimensions: dict=None) -> None:
     LOGGER.info("Preparing par_mod.f90 file for FLEXPART")
-    xml          = ET.parse(config_xml_filepath)
-    xml          = xml.getroot().find("girafe/flexpart/par_mod_parameters")
-    xml_keys = {"pi":3.14159265,
-                "r_earth":6.371e6,
-                "r_air":287.05,
-                "nxmaxn":0,
-                "nymaxn":0,
-                "nuvzmax":138,
-                "nwzmax":138,
-                "nzmax":138,
-                "maxwf":50000,
-                "maxtable":1000,
-                "numclass":13,
-                "ni":11,
-                "maxcolumn":3000,
-                "maxrand":1000000,
-                "maxpart":max_number_parts}
-    keys_values = {}
-    for key in xml_keys:
-        if (xml.find(key) is not None) and (xml.find(key).text!="") and (xml.find(key).text is not None):
-            value = float(xml.find(key).text) if "." in xml.find(key).text else int(xml.find(key).text)
-            keys_values.update({key: value}) 
-        else:
-            keys_values.update({key: xml_keys[key]})
-    for key in ["nxmax","nymax"]:
-        if (xml.find(key) is None) or (xml.find(key).text is None):
-            LOGGER.error("nxmax and nymax are mandatory nodes in the configuration file, and they must not be empty")
-        else:
-            value = float(xml.find(key).text) if "." in xml.find(key).text else int(xml.find(key).text)
-            keys_values.update({key: value}) 
+    keys_values = get_par_mod_parameters(config, max_number_parts, dimensions)
+    LOGGER.info(f"par_mod.f90 sized for {keys_values['nxmax']}x{keys_values['nymax']} grid points and {keys_values['nuvzmax']} levels")
     with open(f"{working_dir}/flexpart_src/par_mod.f90", "w") as file:
         file.write(f"module par_mod\n")
         file.write(f"  implicit none\n")
@@ -498,7 +920,7 @@ def write_par_mod_file(config_xml_filepath: str, working_dir: str, max_number_pa
         file.write(f"  integer,parameter :: jpack=4*nxmax*nymax, jpunp=4*jpack\n")
         file.write(f"  integer,parameter :: maxageclass=1,nclassunc=1\n")
         file.write(f"  integer,parameter :: maxreceptor=20\n")
-        file.write(f"  integer,parameter :: maxpart={int(keys_values['maxpart'])+1}\n")
+        file.write(f"  integer,parameter :: maxpart={bucket_maxpart(int(keys_values['maxpart'])+1, config.maxpart_bucket)}\n")
         file.write(f"  integer,parameter :: maxspec=1\n")
         file.write(f"  real,parameter :: minmass=0.0001\n")
         file.write(f"  integer,parameter :: maxwf={keys_values['maxwf']}, maxtable={keys_values['maxtable']}, numclass={keys_values['numclass']}, ni={keys_values['ni']}\n")
@@ -522,15 +944,6 @@ def write_par_mod_file(config_xml_filepath: str, working_dir: str, max_number_pa
         file.write(f"  integer,parameter ::  icmv=-9999\n")
         file.write(f"end module par_mod")
 
-def get_roi_from_config(node):
-    rois = []
-    zones_nodes = node.find("zones")
-    for zone_node in zones_nodes:
-        lon_min, lon_max = float(zone_node.find("lonmin").text), float(zone_node.find("lonmax").text)
-        lat_min, lat_max = float(zone_node.find("latmin").text), float(zone_node.find("latmax").text)
-        rois.append({"lat_min":lat_min, "lat_max":lat_max, "lon_min":lon_min, "lon_max":lon_max})
-    return rois
-
 def km_to_degree(pixel_center_deg, pixel_size_km):
     earthPerimeter = 2.0 * 3.14159265 * 6378.0
     angle_rad = 3.14159265 * pixel_center_deg / 180.0
@@ -547,20 +960,318 @@ def modis_pixel_coordinate(lat_value, lon_value, track_value, scan_value):
     lon_max = lon_value + pixel_size_lon / 2.0
     return lat_min, lat_max, lon_min, lon_max
 
-def reformat_time(init_string: str, old_format: str, new_format: str):
-    return datetime.datetime.strftime(datetime.datetime.strptime(init_string, old_format), new_format)
+def modis_acquisition_datetimes(df: pd.DataFrame) -> pd.Series:
+    """
+    Acquisition datetimes of MODIS detections from the acq_date (YYYY-MM-DD) and
+    acq_time (HHMM, read as an integer so 0045 is 45) columns.
+    """
+    acq_time = df["acq_time"].astype(int)
+    return pd.to_datetime(df["acq_date"], format="%Y-%m-%d") + \
+           pd.to_timedelta(acq_time//100, unit="h") + \
+           pd.to_timedelta(acq_time%100, unit="m")
+
+MODIS_COLUMNS = {"latitude":   "float64",
+                 "longitude":  "float64",
+                 "brightness": "float64",
+                 "scan":       "float64",
+                 "track":      "float64",
+                 "acq_date":   "str",
+                 "acq_time":   "int32",
+                 "confidence": "int32"}
+
+FIRE_STORE_BIN_SIZE = 1.0 # degrees, coarse lat/lon bins indexing the detections of each partition
+
+def read_modis_file(filepath: str) -> pd.DataFrame:
+    """
+    Reads a MODIS MCD14DL text file, only the typed columns used to write the releases.
+    """
+    return pd.read_csv(filepath, usecols=list(MODIS_COLUMNS), dtype=MODIS_COLUMNS)
+
+def is_fire_store(path: str) -> bool:
+    return os.path.isdir(path) and os.path.exists(f"{path}/fire_store.json")
+
+def fire_store_bins(lat: np.ndarray, lon: np.ndarray) -> np.ndarray:
+    Nlon    = int(round(360.0/FIRE_STORE_BIN_SIZE))
+    Nlat    = int(round(180.0/FIRE_STORE_BIN_SIZE))
+    lat_bin = np.clip(np.floor((lat+90.0)/FIRE_STORE_BIN_SIZE).astype(np.int64), 0, Nlat-1)
+    lon_bin = np.clip(np.floor((lon+180.0)/FIRE_STORE_BIN_SIZE).astype(np.int64), 0, Nlon-1)
+    return lat_bin*Nlon + lon_bin
+
+def fire_store_zone_bins(zone: Zone) -> np.ndarray:
+    lat_min, lat_max = max(zone.lat_min, -90.0), min(zone.lat_max, 90.0)
+    lon_min, lon_max = max(zone.lon_min, -180.0), min(zone.lon_max, 180.0)
+    if (lat_min>lat_max) or (lon_min>lon_max):
+        return np.array([], dtype=np.int64)
+    corners = fire_store_bins(np.array([lat_min, lat_max]), np.array([lon_min, lon_max]))
+    Nlon    = int(round(360.0/FIRE_STORE_BIN_SIZE))
+    lat_bins = np.arange(corners[0]//Nlon, corners[1]//Nlon+1)
+    lon_bins = np.arange(corners[0]%Nlon, corners[1]%Nlon+1)
+    return (lat_bins[:,None]*Nlon + lon_bins[None,:]).ravel()
+
+def read_fire_partition(partition_dir: str, rows: np.ndarray=None) -> dict:
+    """
+    Reads the columns of a fire store partition, all of them or only the given rows.
+    Columns are memory-mapped so only the pages holding the requested rows are read.
+    """
+    columns = {}
+    for name in ["detection_id"]+[key for key in MODIS_COLUMNS if key!="acq_date"]:
+        array = np.load(f"{partition_dir}/{name}.npy", mmap_mode="r")
+        columns[name] = np.array(array if rows is None else array[rows])
+    return columns
+
+def write_fire_partition(partition_dir: str, columns: dict) -> None:
+    """
+    Writes the columns of a partition sorted by coarse lat/lon bin (then detection id),
+    with the start row of every occupied bin in bins.npz. The partition is written in a
+    temporary directory which then replaces the previous one.
+    """
+    bins  = fire_store_bins(columns["latitude"], columns["longitude"])
+    order = np.lexsort((columns["detection_id"], bins))
+    tmp_dir = partition_dir+".tmp"
+    if os.path.exists(tmp_dir):
+        shutil.rmtree(tmp_dir)
+    os.makedirs(tmp_dir)
+    for name, array in columns.items():
+        np.save(f"{tmp_dir}/{name}.npy", np.ascontiguousarray(array[order]))
+    occupied_bins, starts = np.unique(bins[order], return_index=True)
+    np.savez(f"{tmp_dir}/bins.npz", bins=occupied_bins, starts=starts, ends=np.append(starts[1:], len(order)))
+    if os.path.exists(partition_dir):
+        os.rename(partition_dir, partition_dir+".old")
+    os.rename(tmp_dir, partition_dir)
+    if os.path.exists(partition_dir+".old"):
+        shutil.rmtree(partition_dir+".old")
+
+def ingest_fire_files(store_dir: str, filepaths: list) -> int:
+    """
+    Appends daily MODIS MCD14DL text files to the fire detection store in store_dir,
+    one partition per acq_date. Files already ingested with the same size and
+    modification time are skipped, and detections already present in a partition
+    (same position and acquisition time) are not duplicated. Returns the number of
+    detections added.
+    """
+    os.makedirs(store_dir, exist_ok=True)
+    manifest_filepath = f"{store_dir}/fire_store.json"
+    if os.path.exists(manifest_filepath):
+        with open(manifest_filepath, "r") as file:
+            manifest = json.load(file)
+    else:
+        manifest = {"bin_size": FIRE_STORE_BIN_SIZE, "next_id": 0, "files": {}}
+    Nadded = 0
+    for filepath in filepaths:
+        stat = os.stat(filepath)
+        file_key = os.path.basename(filepath)
+        if manifest["files"].get(file_key)=={"size": stat.st_size, "mtime": stat.st_mtime}:
+            LOGGER.info(f"{file_key} is already in the fire store, skipping it")
+            continue
+        df = read_modis_file(filepath)
+        df["detection_id"] = np.arange(manifest["next_id"], manifest["next_id"]+len(df), dtype=np.int64)
+        manifest["next_id"] = manifest["next_id"] + len(df)
+        for acq_date, group in df.groupby("acq_date"):
+            partition_dir = f"{store_dir}/acq_date={acq_date}"
+            new_columns = {name: group[name].to_numpy() for name in ["detection_id"]+[key for key in MODIS_COLUMNS if key!="acq_date"]}
+            if os.path.exists(partition_dir):
+                old_columns = read_fire_partition(partition_dir)
+                known = set(zip(old_columns["latitude"].tolist(), old_columns["longitude"].tolist(), old_columns["acq_time"].tolist()))
+                is_new = np.array([key not in known for key in zip(new_columns["latitude"].tolist(), new_columns["longitude"].tolist(), new_columns["acq_time"].tolist())], dtype=bool)
+                new_columns = {name: np.concatenate([old_columns[name], array[is_new]]) for name, array in new_columns.items()}
+                Nadded = Nadded + int(np.sum(is_new))
+            else:
+                Nadded = Nadded + len(group)
+            write_fire_partition(partition_dir, new_columns)
+        manifest["files"][file_key] = {"size": stat.st_size, "mtime": stat.st_mtime}
+        with open(manifest_filepath+".tmp", "w") as file:
+            json.dump(manifest, file, indent=2)
+        os.replace(manifest_filepath+".tmp", manifest_filepath)
+        LOGGER.info(f"{file_key} ingested in the fire store ({len(df)} detections)")
+    return Nadded
+
+def select_modis_detections(df: pd.DataFrame, acq_date: str, zones: Tuple[Zone, ...]) -> pd.DataFrame:
+    """
+    Detections of a MODIS DataFrame on acq_date (YYYY-MM-DD) lying in at least one of the
+    zones. One mask combines all the zones, so overlapping zones select a detection once.
+    """
+    lat = df["latitude"].to_numpy()
+    lon = df["longitude"].to_numpy()
+    zones_mask = np.zeros(len(df), dtype=bool)
+    for zone in zones:
+        zones_mask |= (lat >= zone.lat_min) & (lat <= zone.lat_max) & \
+                      (lon >= zone.lon_min) & (lon <= zone.lon_max)
+    return df[zones_mask & (df["acq_date"] == acq_date).to_numpy()]
+
+def query_fire_store(store_dir: str, acq_date: str, zones: Tuple[Zone, ...]) -> pd.DataFrame:
+    """
+    Returns the detections of the acq_date (YYYY-MM-DD) partition lying in at least one
+    of the zones, indexed by detection id and sorted by it. Only the rows of the coarse
+    bins intersecting the zones are read.
+    """
+    partition_dir = f"{store_dir}/acq_date={acq_date}"
+    if (not os.path.exists(partition_dir)) or (len(zones)==0):
+        return pd.DataFrame(columns=list(MODIS_COLUMNS))
+    index  = np.load(f"{partition_dir}/bins.npz")
+    wanted = np.isin(index["bins"], np.concatenate([fire_store_zone_bins(zone) for zone in zones]))
+    rows   = np.concatenate([np.arange(start, end) for start, end in zip(index["starts"][wanted], index["ends"][wanted])] + [np.array([], dtype=np.int64)])
+    columns = read_fire_partition(partition_dir, rows)
+    zones_mask = np.zeros(len(rows), dtype=bool)
+    for zone in zones:
+        zones_mask |= (columns["latitude"] >= zone.lat_min) & (columns["latitude"] <= zone.lat_max) & \
+                      (columns["longitude"] >= zone.lon_min) & (columns["longitude"] <= zone.lon_max)
+    df = pd.DataFrame({name: array[zones_mask] for name, array in columns.items()})
+    df["acq_date"] = acq_date
+    return df.set_index("detection_id").sort_index()
+
+RELEASE_FIELDS = [("IDATE1", "{}"),
+                  ("ITIME1", "{}"),
+                  ("IDATE2", "{}"),
+                  ("ITIME2", "{}"),
+                  ("LON1", "{:.3f}"),
+                  ("LON2", "{:.3f}"),
+                  ("LAT1", "{:.3f}"),
+                  ("LAT2", "{:.3f}"),
+                  ("Z1", "{:.3f}"),
+                  ("Z2", "{:.3f}"),
+                  ("ZKIND", "{}"),
+                  ("MASS", "{:E}"),
+                  ("PARTS", "{}"),
+                  ("COMMENT", "\"{}\"")]
+
+def render_release_blocks(zkind: int=1, **fields) -> str:
+    """
+    Renders &RELEASE namelist blocks into a single string. Each field of RELEASE_FIELDS
+    (lower case keyword) is either a scalar shared by all the blocks, formatted once, or
+    an array/list with one value per block.
+    """
+    fields["zkind"] = zkind
+    template = "&RELEASE\n"
+    columns  = []
+    for key, value_format in RELEASE_FIELDS:
+        value = fields[key.lower()]
+        if isinstance(value, (list, tuple, np.ndarray, pd.Series)):
+            template = template + f" {key} = {value_format},\n"
+            columns.append(value.tolist() if hasattr(value, "tolist") else value)
+        else:
+            line     = f" {key} = {value_format},\n".format(value)
+            template = template + line.replace("{", "{{").replace("}", "}}")
+    template = template + " /\n"
+    return "".join([template.format(*row) for row in zip(*columns)])
 
-def add_time(init_datetime: str, init_format: str, add_string: str, new_format: str):
-    init_datetime_obj = datetime.datetime.strptime(init_datetime, init_format)
-    new_datetime_obj  = init_datetime_obj + datetime.timedelta(days=int(add_string[:2]),
-                                                               hours=int(add_string[2:4]),
-                                                               minutes=int(add_string[4:6]),
-                                                               seconds=int(add_string[6:8]))
-    return datetime.datetime.strftime(new_datetime_obj, new_format)
+def release_budget_enabled(config: GirafeConfig) -> bool:
+    return (config.particle_budget is not None) or (config.aggregation_resolution is not None)
 
-def write_releases_file_for_modis(config_xml_filepath: str, working_dir: str):
-    xml               = ET.parse(config_xml_filepath)
-    emission_filepath = xml.getroot().find("girafe/paths/emissions").text
+def release_cells_table(chunks: list) -> pd.DataFrame:
+    """
+    Concatenates release chunks, i.e. keyword arguments of render_release_blocks() plus
+    the "source" (comment prefix) and "weight" (particle allocation weight) of every
+    block, into one table with a row per &RELEASE block.
+    """
+    tables = []
+    for chunk in chunks:
+        Nrel = len(chunk["weight"])
+        tables.append(pd.DataFrame({key: (np.asarray(value) if isinstance(value, (list, tuple, np.ndarray, pd.Series)) else [value]*Nrel)
+                                    for key, value in chunk.items()}))
+    return pd.concat(tables, ignore_index=True)
+
+def aggregate_release_cells(cells: pd.DataFrame, resolution: float) -> Tuple[pd.DataFrame, np.ndarray]:
+    """
+    Merges the releases of a same source and time window whose centres fall in the
+    same resolution x resolution box into one release covering their bounding box.
+    Point releases (inventory cells) are widened by the optional "half_dlon"/"half_dlat"
+    columns, half the inventory grid spacing, so that the box covers the merged cells
+    and not only their centres. Mass, particles and weights are summed, so the released
+    mass is conserved. Returns the aggregated releases and, for every input release,
+    the row it was merged into.
+    """
+    keys = ["source", "idate1", "itime1", "idate2", "itime2", "z1", "z2"]
+    boxes = cells[keys].assign(box_x=np.floor((cells["lon1"]+cells["lon2"])/2/resolution).astype(np.int64),
+                               box_y=np.floor((cells["lat1"]+cells["lat2"])/2/resolution).astype(np.int64))
+    groups = boxes.groupby(keys+["box_x", "box_y"], sort=False).ngroup().to_numpy()
+    half_dlon = cells["half_dlon"].fillna(0.0) if "half_dlon" in cells else 0.0
+    half_dlat = cells["half_dlat"].fillna(0.0) if "half_dlat" in cells else 0.0
+    extents = cells.assign(lon1=cells["lon1"]-half_dlon, lon2=cells["lon2"]+half_dlon,
+                           lat1=cells["lat1"]-half_dlat, lat2=cells["lat2"]+half_dlat)
+    aggregated = extents.groupby(groups).agg(**{key: (key, "first") for key in keys},
+                                           lon1=("lon1", "min"), lon2=("lon2", "max"),
+                                           lat1=("lat1", "min"), lat2=("lat2", "max"),
+                                           mass=("mass", "sum"), parts=("parts", "sum"), weight=("weight", "sum"))
+    aggregated["comment"] = aggregated["source"] + "_AGG" + (aggregated.groupby("source").cumcount()+1).astype(str)
+    return aggregated.reset_index(drop=True), groups
+
+def allocate_particles(weights: np.ndarray, budget: int) -> np.ndarray:
+    """
+    Splits budget particles between releases in proportion to their weights (largest
+    remainder method), every release keeping at least one particle.
+    """
+    weights = np.abs(np.asarray(weights, dtype=np.float64))
+    Nrel = len(weights)
+    if budget<Nrel:
+        LOGGER.warning(f"The particle budget ({budget}) is smaller than the number of releases ({Nrel}), one particle per release is used; consider a coarser aggregation_resolution")
+        return np.ones(Nrel, dtype=np.int64)
+    if weights.sum()==0:
+        weights = np.ones(Nrel)
+    share = (budget - Nrel) * weights / weights.sum()
+    parts = 1 + np.floor(share).astype(np.int64)
+    remainder = budget - int(parts.sum())
+    parts[np.argsort(np.floor(share)-share, kind="stable")[:remainder]] += 1
+    return parts
+
+def release_budget_report(cells: pd.DataFrame, releases: pd.DataFrame, groups: np.ndarray, outgrid: OutGrid) -> dict:
+    """
+    Errors of the budgeted/aggregated releases with respect to the original ones: total
+    mass, mass-weighted displacement of the release centres to the mass-weighted centroid
+    of the release they were merged into, fraction of the mass moved to another output
+    grid cell and deviation of the particle shares from the weights.
+    """
+    mass      = np.abs(cells["mass"].to_numpy(dtype=np.float64))
+    lon, lat  = ((cells["lon1"]+cells["lon2"])/2).to_numpy(), ((cells["lat1"]+cells["lat2"])/2).to_numpy()
+    # Releases without mass fall back to the plain mean of the merged centres
+    group_mass  = np.bincount(groups, weights=mass, minlength=len(releases))
+    group_count = np.bincount(groups, minlength=len(releases))
+    massless    = (group_mass==0)
+    group_mass[massless] = group_count[massless]
+    cell_weight = np.where(massless[groups], 1.0, mass)
+    new_lon   = (np.bincount(groups, weights=cell_weight*lon, minlength=len(releases))/group_mass)[groups]
+    new_lat   = (np.bincount(groups, weights=cell_weight*lat, minlength=len(releases))/group_mass)[groups]
+    earth_R   = 6378.1
+    displacement = np.radians(np.hypot((new_lon-lon)*np.cos(np.radians(lat)), new_lat-lat))*earth_R
+    moved = (np.floor((lon-outgrid.lon_min)/outgrid.resolution)!=np.floor((new_lon-outgrid.lon_min)/outgrid.resolution)) | \
+            (np.floor((lat-outgrid.lat_min)/outgrid.resolution)!=np.floor((new_lat-outgrid.lat_min)/outgrid.resolution))
+    parts, weights = releases["parts"].to_numpy(dtype=np.float64), np.abs(releases["weight"].to_numpy(dtype=np.float64))
+    total_mass = float(cells["mass"].sum())
+    return {"releases_before": len(cells),
+            "releases_after": len(releases),
+            "particles_before": int(cells["parts"].sum()),
+            "particles_after": int(releases["parts"].sum()),
+            "mass_relative_error": abs(float(releases["mass"].sum())-total_mass)/abs(total_mass) if total_mass!=0 else 0.0,
+            "mean_displacement_km": float(np.average(displacement, weights=mass)) if mass.sum()>0 else 0.0,
+            "max_displacement_km": float(displacement.max()),
+            "mass_fraction_moved_outgrid_cell": float(mass[moved].sum()/mass.sum()) if mass.sum()>0 else 0.0,
+            "particle_share_error": float(0.5*np.abs(parts/parts.sum()-weights/weights.sum()).sum()) if weights.sum()>0 else 0.0}
+
+def budget_release_cells(config: GirafeConfig, working_dir: str, chunks: list) -> pd.DataFrame:
+    """
+    Applies the <aggregation_resolution> and <particle_budget> of the configuration to
+    the collected release chunks, logs the errors with respect to the unaggregated
+    releases and saves them in release_budget.json in the working directory.
+    """
+    cells = release_cells_table(chunks)
+    if config.aggregation_resolution is not None:
+        releases, groups = aggregate_release_cells(cells, config.aggregation_resolution)
+    else:
+        releases, groups = cells.copy(), np.arange(len(cells))
+    if config.particle_budget is not None:
+        releases["parts"] = allocate_particles(releases["weight"], config.particle_budget)
+    else:
+        # Aggregation alone: the default 10000 particles per (merged) release
+        releases["parts"] = allocate_particles(releases["weight"], 10000*len(releases))
+    report = release_budget_report(cells, releases, groups, config.outgrid)
+    LOGGER.info(f"Releases: {report['releases_before']} -> {report['releases_after']}, particles: {report['particles_before']} -> {report['particles_after']}")
+    LOGGER.info(f"Release errors: mass {report['mass_relative_error']:.2E}, mean/max displacement {report['mean_displacement_km']:.2f}/{report['max_displacement_km']:.2f} km, "
+                f"mass moved to another output cell {100*report['mass_fraction_moved_outgrid_cell']:.2f}%, particle share {100*report['particle_share_error']:.2f}%")
+    with open(f"{working_dir}/release_budget.json", "w") as file:
+        json.dump(report, file, indent=2)
+    return releases
+
+def write_releases_file_for_modis(config: GirafeConfig, working_dir: str):
+    emission_filepath = config.emissions
     if not os.path.exists(emission_filepath):
         return -3
     # ----------------------------------------------------
@@ -579,65 +1290,59 @@ def write_releases_file_for_modis(config_xml_filepath: str, working_dir: str):
     file.write("***************************************************************************************************************\n")
     file.write("&RELEASES_CTRL\n")
     file.write(" NSPEC      =           1, ! Total number of species\n")
-    file.write(" SPECNUM_REL=          "+xml.getroot().find("girafe/flexpart/releases/species").text+", ! Species numbers in directory SPECIES\n")
+    file.write(" SPECNUM_REL=          "+config.species+", ! Species numbers in directory SPECIES\n")
     file.write(" /\n")
     # file.close()
     # --------------------------------------------------------------------------------------------------------
     # read MODIS fire file and find hot points that are in the simulation window frame, datetime frame
     # and with confidence values greater than the minimum confidence value
+    # (emissions can also be a fire store filled by --ingest-fires, queried by date and zones)
     # --------------------------------------------------------------------------------------------------------
-    df = pd.read_csv(emission_filepath)
-    release_nodes = xml.getroot().find("girafe/flexpart/releases")
-    try:
-        fire_confidence = float(release_nodes.find("fire_confidence").text)
-    except:
+    if config.fire_confidence is None:
         LOGGER.error("fire_confidence node is mandatory for MODIS processing, check your configuration file!")
         sys.exit(1)
+    fire_confidence = config.fire_confidence
+    df = None if is_fire_store(emission_filepath) else read_modis_file(emission_filepath)
     total_number_parts = 0
-    for release in release_nodes:
-        if release.tag=="release":
-            release_date     = release.find("start_date").text
-            release_duration = release.find("duration").text
-            rois = get_roi_from_config(release)
-            filtered_df = pd.DataFrame()
-            for roi in rois:
-                filtered_df = pd.concat([filtered_df, df[(df['latitude'] >= roi["lat_min"]) & 
-                                                        (df['latitude'] <= roi["lat_max"]) & 
-                                                        (df['longitude'] >= roi["lon_min"]) & 
-                                                        (df['longitude'] <= roi["lon_max"]) &
-                                                        (df['confidence'] >= fire_confidence) &
-                                                        (df['acq_date'] == reformat_time(release_date, "%Y%m%d", "%Y-%m-%d"))]]
-                                        )
-            if len(filtered_df)==0:
-                continue
-            rate = 0.1
-            Bmin = min(filtered_df["brightness"])
-            Npart_init = 10000
-            filtered_df["Npart"] = (Npart_init * (1 - rate) / Bmin * filtered_df["brightness"]).values
-            for row in filtered_df.iterrows():
-                start_date = row[1]['acq_date']
-                start_time = row[1]['acq_time']
-                end_date   = add_time(f"{start_date} {start_time}", "%Y-%m-%d %H%M", release_duration, "%Y%m%d")
-                end_time   = add_time(f"{start_date} {start_time}", "%Y-%m-%d %H%M", release_duration, "%H%M%S")
-                lat_min, lat_max, lon_min, lon_max = modis_pixel_coordinate(row[1]["latitude"], row[1]["longitude"], row[1]["track"], row[1]["scan"])
-                file.write("&RELEASE\n")
-                file.write(f" IDATE1 = {reformat_time(start_date,'%Y-%m-%d','%Y%m%d')},\n")
-                file.write(f" ITIME1 = {reformat_time(str(start_time),'%H%M','%H%M%S')},\n")
-                file.write(f" IDATE2 = {end_date},\n")
-                file.write(f" ITIME2 = {end_time},\n")
-                file.write(f" LON1 = {lon_min:.3f},\n")
-                file.write(f" LON2 = {lon_max:.3f},\n")
-                file.write(f" LAT1 = {lat_min:.3f},\n")
-                file.write(f" LAT2 = {lat_max:.3f},\n")
-                file.write(f" Z1 = {float(release.find('altitude_min').text):.3f},\n")
-                file.write(f" Z2 = {float(release.find('altitude_max').text):.3f},\n")
-                file.write(" ZKIND = 1,\n")
-                mass_string = f" MASS = {1.0:E},\n"
-                file.write(mass_string.replace("e","E"))
-                file.write(f" PARTS = {int(row[1]['Npart'])},\n")
-                file.write(f" COMMENT = \"RELEASE_{row[0]}\",\n")
-                file.write(" /\n")
-                total_number_parts = total_number_parts + row[1]['Npart']
+    chunks = []
+    for release in config.releases:
+        acq_date = datetime.datetime.strptime(release.start_date, "%Y%m%d").strftime("%Y-%m-%d")
+        if df is None:
+            detections = query_fire_store(emission_filepath, acq_date, release.zones)
+        else:
+            detections = select_modis_detections(df, acq_date, release.zones)
+        filtered_df = detections[(detections["confidence"] >= fire_confidence).to_numpy()]
+        if len(filtered_df)==0:
+            continue
+        rate = 0.1
+        Bmin = min(filtered_df["brightness"])
+        Npart_init = 10000
+        Npart = (Npart_init * (1 - rate) / Bmin * filtered_df["brightness"]).to_numpy()
+        start_datetime = modis_acquisition_datetimes(filtered_df)
+        end_datetime   = start_datetime + release.duration_delta
+        lat_min, lat_max, lon_min, lon_max = modis_pixel_coordinate(filtered_df["latitude"].to_numpy(),
+                                                                    filtered_df["longitude"].to_numpy(),
+                                                                    filtered_df["track"].to_numpy(),
+                                                                    filtered_df["scan"].to_numpy())
+        chunk = dict(idate1=start_datetime.dt.strftime("%Y%m%d"),
+                     itime1=start_datetime.dt.strftime("%H%M%S"),
+                     idate2=end_datetime.dt.strftime("%Y%m%d"),
+                     itime2=end_datetime.dt.strftime("%H%M%S"),
+                     lon1=lon_min, lon2=lon_max, lat1=lat_min, lat2=lat_max,
+                     z1=release.altitude_min, z2=release.altitude_max,
+                     mass=1.0,
+                     parts=Npart.astype(int),
+                     comment=[f"RELEASE_{index}" for index in filtered_df.index],
+                     source="RELEASE", weight=Npart)
+        if release_budget_enabled(config):
+            chunks.append(chunk)
+        else:
+            file.write(render_release_blocks(**chunk))
+        total_number_parts = total_number_parts + float(Npart.sum())
+    if release_budget_enabled(config) and len(chunks)>0:
+        releases = budget_release_cells(config, working_dir, chunks)
+        file.write(render_release_blocks(**releases))
+        total_number_parts = int(releases["parts"].sum())
     file.close()
     return total_number_parts
 
@@ -798,12 +1503,64 @@ def find_lat_lon_variables(dataset: xr.Dataset) -> str:
                 lon_name = var
     return lat_name, lon_name
 
-def write_releases_file_for_inventory(config_xml_filepath: str, working_dir: str) -> int:
-    xml               = ET.parse(config_xml_filepath)
-    emission_filepath = xml.getroot().find("girafe/paths/emissions").text
+def inventory_time_index(ds: xr.Dataset, datetime_value: datetime.datetime) -> int:
+    """
+    Index in the file of the inventory time step nearest to datetime_value. Duplicated
+    time steps are skipped, keeping the first occurrence like drop_duplicates(dim="time").
+    """
+    times   = ds.indexes["time"]
+    first   = np.flatnonzero(~times.duplicated(keep="first"))
+    nearest = times[first].get_indexer([pd.to_datetime(datetime_value)], method="nearest")[0]
+    return int(first[nearest])
+
+def read_inventory_zone(ds: xr.Dataset, emission_variable: str, time_index: int, zone: Zone, lat_varname: str, lon_varname: str) -> dict:
+    """
+    Reads the zone window of one inventory time step and returns the coordinates, area
+    (km²) and emitted mass rate of its non zero cells, in row-major order.
+    """
+    window = ds[emission_variable].isel(time=time_index)
+    window = window.sel({lat_varname: slice(zone.lat_min, zone.lat_max), lon_varname: slice(zone.lon_min, zone.lon_max)})
+
+    lon_mesh, lat_mesh = np.meshgrid(window[lon_varname].values, window[lat_varname].values)
+    earth_R = 6378.1
+    Lref = np.abs(window[lon_varname][1].values - window[lon_varname][0].values)*2*np.pi*earth_R/360.0 # spatial resolution of the data converted from degrees to meters on the eqautor
+    pixel_surface = (Lref * np.cos(np.radians(lat_mesh))) * Lref # longueur suivant X * longueur suivant Y adapte aux coordonnees du point
+    mass_rate = window.values * pixel_surface
+    nonzero   = (mass_rate!=0)
+    return {"lon": lon_mesh[nonzero],
+            "lat": lat_mesh[nonzero],
+            "area": pixel_surface[nonzero],
+            "mass_rate": mass_rate[nonzero]}
+
+def load_inventory_zone(ds: xr.Dataset, emission_variable: str, time_index: int, zone: Zone, lat_varname: str, lon_varname: str, cache_dir: str=None) -> dict:
+    """
+    read_inventory_zone() through an on-disk cache of .npz files keyed by the inventory
+    file (path, size, modification time), the variable, the time index and the zone.
+    """
+    if cache_dir is None:
+        return read_inventory_zone(ds, emission_variable, time_index, zone, lat_varname, lon_varname)
+    emission_filepath = ds.encoding["source"]
+    stat = os.stat(emission_filepath)
+    key  = f"{os.path.abspath(emission_filepath)}|{stat.st_size}|{stat.st_mtime_ns}|{emission_variable}|{time_index}|" \
+           f"{zone.lat_min}|{zone.lat_max}|{zone.lon_min}|{zone.lon_max}"
+    cache_filepath = f"{cache_dir}/{hashlib.sha256(key.encode()).hexdigest()}.npz"
+    if os.path.exists(cache_filepath):
+        with np.load(cache_filepath) as cached:
+            return {name: cached[name] for name in cached.files}
+    cells = read_inventory_zone(ds, emission_variable, time_index, zone, lat_varname, lon_varname)
     try:
-        emission_variable = xml.getroot().find("girafe/paths/emissions_variable").text
-    except:
+        os.makedirs(cache_dir, exist_ok=True)
+        tmp_filepath = f"{cache_filepath[:-4]}.{os.getpid()}.tmp.npz"
+        np.savez(tmp_filepath, **cells)
+        os.replace(tmp_filepath, cache_filepath)
+    except OSError as error:
+        LOGGER.warning(f"Could not store the zone {zone.name} in the emissions cache ({error})")
+    return cells
+
+def write_releases_file_for_inventory(config: GirafeConfig, working_dir: str) -> int:
+    emission_filepath = config.emissions
+    emission_variable = config.emissions_variable
+    if emission_variable is None:
         LOGGER.error("The node emissions_variable is missing in the configuration file; please add the name of the variable to study.")
         sys.exit(1)
     if not os.path.exists(emission_filepath):
@@ -824,156 +1581,348 @@ def write_releases_file_for_inventory(config_xml_filepath: str, working_dir: str
     file.write("***************************************************************************************************************\n")
     file.write("&RELEASES_CTRL\n")
     file.write(" NSPEC      =           1, ! Total number of species\n")
-    file.write(" SPECNUM_REL=          "+xml.getroot().find("girafe/flexpart/releases/species").text+", ! Species numbers in directory SPECIES\n")
+    file.write(" SPECNUM_REL=          "+config.species+", ! Species numbers in directory SPECIES\n")
     file.write(" /\n")
     # ----------------------------------------------------
     # Get time/lat/lon extracts to compute emissions
     # ----------------------------------------------------
+    # The dataset is opened lazily: only the zone windows of the selected time steps
+    # are read, and not at all for the zones found in the emissions cache
     ds = xr.open_dataset(emission_filepath)
     lat_varname, lon_varname = find_lat_lon_variables(ds)
-    ds = ds.drop_duplicates(dim="time")
-    releases_nodes = xml.getroot().find("girafe/flexpart/releases")
+    # Half the inventory grid spacing, to widen the cell centres when releases are aggregated
+    half_dlon = abs(float(ds[lon_varname][1].values - ds[lon_varname][0].values))/2
+    half_dlat = abs(float(ds[lat_varname][1].values - ds[lat_varname][0].values))/2
     total_number_parts = 0
-    for release_node in releases_nodes:
-        if release_node.tag=="release":
-            rel_day = datetime.datetime.strptime(release_node.find("start_date").text,"%Y%m%d")
-            rel_time = release_node.find("start_time").text
-            rel_time = datetime.timedelta(days=int(rel_time[:2]),
-                                          hours=int(rel_time[2:4]),
-                                          minutes=int(rel_time[4:6]),
-                                          seconds=int(rel_time[6:]))
-            rel_duration = release_node.find("duration").text
-            rel_duration = datetime.timedelta(days=int(rel_duration[:2]),
-                                              hours=int(rel_duration[2:4]),
-                                              minutes=int(rel_duration[4:6]),
-                                              seconds=int(rel_duration[6:]))
-            rel_start_datetime = rel_day + rel_time
-            rel_end_datetime   = rel_start_datetime + rel_duration
-            if rel_duration.total_seconds()<=0:
-                LOGGER.error("Emissions (releases) durations is zero or negative, check your configuration file.")
-                sys.exit(1)
-            zones_node = release_node.find("zones")
-            for zone in zones_node:
-                # Check if lat/lon are ok and satisfy conditions
-                rel_lat_min, rel_lat_max = float(zone.find("latmin").text), float(zone.find("latmax").text)
-                rel_lon_min, rel_lon_max = float(zone.find("lonmin").text), float(zone.find("lonmax").text)
-                if (check_if_in_range(rel_lon_min,-180,180) and check_if_in_range(rel_lon_max,-180,180)) or \
-                    (check_if_in_range(rel_lon_min,0,360) and check_if_in_range(rel_lon_min,0,360)):
-                    lon_status = 0
-                else:
-                    LOGGER.error("Longitude of the release must respect either the [-180°;+180°] or [0°;+360°] convention, please check your configuration file.")
-                    sys.exit(1)
-                if check_if_in_range(rel_lat_min,-90,90) and check_if_in_range(rel_lat_min,-90,90):
-                    lat_status = 0
-                else:
-                    LOGGER.error("Latitude of the release must respect the [-90°;+90°] convention, please check your configuration file.")
-                    sys.exit(1)
-                if (rel_lon_min>rel_lon_max) or (rel_lat_min>rel_lat_max):
-                    LOGGER.error("Minimum latitude and longitude should always be inferior to the maximum values, check your configuration file!")
-                    sys.exit(1)
-                if float(release_node.find('altitude_min').text)>float(release_node.find('altitude_max').text):
-                    LOGGER.error("Minimum altitude/height should be inferior or equal to the maximum value, check your configuration file!")
-                    sys.exit(1)
-
-                # Get the subset of the data
-                #LOGGER.info(f"lat_varname={lat_varname}")
-                #LOGGER.info(f"lon_varname={lon_varname}")
-                sub_ds = ds.sel(time=pd.to_datetime(rel_start_datetime), method="nearest")
-                sub_ds = sub_ds.sel({lat_varname: slice(rel_lat_min, rel_lat_max), lon_varname: slice(rel_lon_min, rel_lon_max)})
-
-                lon_mesh, lat_mesh = np.meshgrid(sub_ds[lon_varname].values, sub_ds[lat_varname].values)
-                earth_R = 6378.1
-                Lref = np.abs(sub_ds[lon_varname][1].values - sub_ds[lon_varname][0].values)*2*np.pi*earth_R/360.0 # spatial resolution of the data converted from degrees to meters on the eqautor
-                pixel_surface = (Lref * np.cos(np.radians(lat_mesh))) * Lref # longueur suivant X * longueur suivant Y adapte aux coordonnees du point
-                emissions = sub_ds[emission_variable] * pixel_surface * rel_duration.total_seconds()
-                
-                iPix = 0
-                for line in range(lat_mesh.shape[0]):
-                    for col in range(lat_mesh.shape[1]):
-                        if emissions[line,col]!=0:
-                            iPix = iPix + 1
-                            file.write("&RELEASE\n")
-                            file.write(f" IDATE1 = {datetime.datetime.strftime(rel_start_datetime,'%Y%m%d')},\n")
-                            file.write(f" ITIME1 = {datetime.datetime.strftime(rel_start_datetime,'%H%M%S')},\n")
-                            file.write(f" IDATE2 = {datetime.datetime.strftime(rel_end_datetime,'%Y%m%d')},\n")
-                            file.write(f" ITIME2 = {datetime.datetime.strftime(rel_end_datetime,'%H%M%S')},\n")
-                            file.write(f" LON1 = {lon_mesh[line,col]:.3f},\n")
-                            file.write(f" LON2 = {lon_mesh[line,col]:.3f},\n")
-                            file.write(f" LAT1 = {lat_mesh[line,col]:.3f},\n")
-                            file.write(f" LAT2 = {lat_mesh[line,col]:.3f},\n")
-                            file.write(f" Z1 = {float(release_node.find('altitude_min').text):.3f},\n")
-                            file.write(f" Z2 = {float(release_node.find('altitude_max').text):.3f},\n")
-                            file.write(" ZKIND = 1,\n")
-                            mass_string = f" MASS = {emissions[line,col]:E},\n"
-                            file.write(mass_string.replace("e","E"))
-                            file.write(" PARTS = 10000,\n")
-                            file.write(f" COMMENT = \"{release_node.attrib['name']}_{zone.attrib['name']}_{iPix}\",\n")
-                            file.write(" /\n")
-                            total_number_parts = total_number_parts + 10000
+    chunks = []
+    for release in config.releases:
+        rel_duration       = release.duration_delta
+        rel_start_datetime = release.start_datetime
+        rel_end_datetime   = release.end_datetime
+        if rel_duration.total_seconds()<=0:
+            LOGGER.error("Emissions (releases) durations is zero or negative, check your configuration file.")
+            sys.exit(1)
+        time_index = inventory_time_index(ds, rel_start_datetime)
+        for zone in release.zones:
+            cells = load_inventory_zone(ds, emission_variable, time_index, zone, lat_varname, lon_varname, config.emissions_cache_dir)
+            # Non zero pixels in row-major order, rendered in one block per zone
+            Npix = len(cells["mass_rate"])
+            if Npix==0:
+                continue
+            lons = cells["lon"]
+            lats = cells["lat"]
+            mass  = cells["mass_rate"] * rel_duration.total_seconds()
+            chunk = dict(idate1=datetime.datetime.strftime(rel_start_datetime,'%Y%m%d'),
+                         itime1=datetime.datetime.strftime(rel_start_datetime,'%H%M%S'),
+                         idate2=datetime.datetime.strftime(rel_end_datetime,'%Y%m%d'),
+                         itime2=datetime.datetime.strftime(rel_end_datetime,'%H%M%S'),
+                         lon1=lons, lon2=lons, lat1=lats, lat2=lats,
+                         z1=release.altitude_min, z2=release.altitude_max,
+                         mass=mass,
+                         parts=10000,
+                         comment=[f"{release.name}_{zone.name}_{iPix}" for iPix in range(1, Npix+1)],
+                         source=f"{release.name}_{zone.name}", weight=mass,
+                         half_dlon=half_dlon, half_dlat=half_dlat)
+            if release_budget_enabled(config):
+                chunks.append(chunk)
+            else:
+                file.write(render_release_blocks(**chunk))
+            total_number_parts = total_number_parts + 10000*Npix
+    if release_budget_enabled(config) and len(chunks)>0:
+        releases = budget_release_cells(config, working_dir, chunks)
+        file.write(render_release_blocks(**releases))
+        total_number_parts = int(releases["parts"].sum())
+    ds.close()
     file.close()
     return total_number_parts
 
-def write_releases_file(config_xml_filepath: str, working_dir: str) -> int:
-    xml               = ET.parse(config_xml_filepath)
-    emission_filepath = xml.getroot().find("girafe/paths/emissions").text
-    if ("MCD14DL" in emission_filepath) or ("fire" in emission_filepath):
-        return write_releases_file_for_modis(config_xml_filepath, working_dir)
+def write_releases_file(config: GirafeConfig, working_dir: str) -> int:
+    emission_filepath = config.emissions
+    if is_fire_store(emission_filepath) or ("MCD14DL" in emission_filepath) or ("fire" in emission_filepath):
+        return write_releases_file_for_modis(config, working_dir)
     elif (".nc" in emission_filepath) and ("CAMS" in emission_filepath):
-        return write_releases_file_for_inventory(config_xml_filepath, working_dir)
+        return write_releases_file_for_inventory(config, working_dir)
     else:
         return -1
 
-def compile_flexpart(working_dir: str) -> None:
-    LOGGER.info("Compiling FLEXPART")
+def hash_flexpart_sources(src_dir: str, make_command: list) -> str:
+    """
+    Computes the build cache key of a FLEXPART source directory: a sha256 of the make
+    command and of every source file and makefile (relative path and content), the
+    generated par_mod.f90 included. Object files and executables are ignored.
+    """
+    sha = hashlib.sha256()
+    sha.update(" ".join(make_command).encode()+b"\0")
+    for root, dirs, files in os.walk(src_dir):
+        dirs.sort()
+        for filename in sorted(files):
+            if not (filename.endswith(FLEXPART_SOURCE_EXTENSIONS) or filename.lower().startswith("makefile")):
+                continue
+            filepath = os.path.join(root, filename)
+            sha.update(os.path.relpath(filepath, src_dir).encode()+b"\0")
+            with open(filepath, "rb") as file:
+                sha.update(file.read())
+            sha.update(b"\0")
+    return sha.hexdigest()
+
+def link_or_copy(source: str, destination: str) -> None:
+    if os.path.lexists(destination):
+        os.remove(destination)
+    try:
+        os.link(source, destination)
+    except OSError:
+        shutil.copy2(source, destination)
+
+def store_in_build_cache(executable: str, par_mod_filepath: str, cache_entry_dir: str) -> None:
+    """
+    Copies a freshly compiled executable in the build cache. The copy goes through a
+    temporary file and an atomic rename, so concurrent runs never see a partial binary.
+    """
+    try:
+        os.makedirs(cache_entry_dir, exist_ok=True)
+        executable_name = os.path.basename(executable)
+        tmp_filepath = f"{cache_entry_dir}/.{executable_name}.{os.getpid()}.tmp"
+        shutil.copy2(executable, tmp_filepath)
+        shutil.copy2(par_mod_filepath, f"{cache_entry_dir}/par_mod.f90")
+        os.replace(tmp_filepath, f"{cache_entry_dir}/{executable_name}")
+    except OSError as error:
+        LOGGER.warning(f"Could not store the {os.path.basename(executable)} executable in the build cache ({error})")
+
+def compile_flexpart(working_dir: str, cache_dir: str=None, mpi: bool=False) -> int:
+    """
+    Compiles the serial FLEXPART executable, or FLEXPART_MPI (make mpi) when mpi is
+    True, and copies it in working_dir. Returns 0 on success, 1 if a step failed.
+    """
+    src_dir      = f"{working_dir}/flexpart_src"
+    make_command = ["make", "mpi", "ncf=yes"] if mpi else ["make", "ncf=yes"]
+    executable   = "FLEXPART_MPI" if mpi else "FLEXPART"
+    if cache_dir is not None:
+        cache_entry_dir = f"{cache_dir}/{hash_flexpart_sources(src_dir, make_command)}"
+        if os.path.exists(f"{cache_entry_dir}/{executable}"):
+            LOGGER.info(f"Reusing cached {executable} executable from {cache_entry_dir}")
+            link_or_copy(f"{cache_entry_dir}/{executable}", f"{working_dir}/{executable}")
+            with open(f"{working_dir}/flexpart_compile.out", "w") as file:
+                file.write(f"Reused cached executable {cache_entry_dir}/{executable}\n")
+            return 0
+    LOGGER.info(f"Compiling {executable}")
     # *************************************************************************************************
     bashCommand = ["make", "clean"]
     with open(f"{working_dir}/flexpart_compile.out", "w") as file:
-        result = subprocess.run(bashCommand, cwd=f"{working_dir}/flexpart_src", stdout=file, stderr=file)
+        result = subprocess.run(bashCommand, cwd=src_dir, stdout=file, stderr=file)
     if result.returncode!=0:
         return 1
     # *************************************************************************************************
-    bashCommand = ["make", "ncf=yes"]
+    bashCommand = make_command
     with open(f"{working_dir}/flexpart_compile.out", "a") as file:
-        result = subprocess.run(bashCommand, cwd=f"{working_dir}/flexpart_src", stdout=file, stderr=file)
+        result = subprocess.run(bashCommand, cwd=src_dir, stdout=file, stderr=file)
     if result.returncode!=0:
         return 1
     # *************************************************************************************************
-    bashCommand = ["cp", f"{working_dir}/flexpart_src/FLEXPART", f"{working_dir}/"]
+    # The previous executable may be a hard link into the build cache, it must not be overwritten in place
+    if os.path.lexists(f"{working_dir}/{executable}"):
+        os.remove(f"{working_dir}/{executable}")
+    bashCommand = ["cp", f"{src_dir}/{executable}", f"{working_dir}/"]
     with open(f"{working_dir}/flexpart_compile.out", "a") as file:
         result = subprocess.run(bashCommand, stdout=file, stderr=file)
     if result.returncode!=0:
         return 1
     # *************************************************************************************************
+    if cache_dir is not None:
+        store_in_build_cache(f"{src_dir}/{executable}", f"{src_dir}/par_mod.f90", cache_entry_dir)
     return 0
 
-def check_ECMWF_pool(config_xml_filepath: str, working_dir: str) -> int:
+def read_grib_header(filepath: str) -> dict:
+    """
+    Reads the headers of all the GRIB messages of an ECMWF file (no data is decoded)
+    and returns their valid times (YYYYMMDDHHMM), grid sizes, number of hybrid levels,
+    and whether the grids go all around the globe in longitude (cyclic). The file is
+    not complete if a message is truncated or if the messages do not add up to the
+    file size.
+    """
+    valid_times, grids, levels, cyclic = set(), set(), set(), set()
+    Nmessages, length, complete = 0, 0, True
+    try:
+        with open(filepath, "rb") as file:
+            while True:
+                gid = eccodes.codes_grib_new_from_file(file, headers_only=True)
+                if gid is None:
+                    break
+                try:
+                    Nmessages = Nmessages + 1
+                    length    = length + eccodes.codes_get(gid, "totalLength")
+                    valid_times.add(f"{eccodes.codes_get(gid, 'validityDate'):08d}{eccodes.codes_get(gid, 'validityTime'):04d}")
+                    grids.add((eccodes.codes_get(gid, "Ni"), eccodes.codes_get(gid, "Nj")))
+                    dx = eccodes.codes_get(gid, "iDirectionIncrementInDegrees")
+                    cyclic.add(eccodes.codes_get(gid, "Ni")*dx >= 360-dx/2)
+                    if eccodes.codes_get(gid, "typeOfLevel")=="hybrid":
+                        levels.add(eccodes.codes_get(gid, "level"))
+                finally:
+                    eccodes.codes_release(gid)
+    except (eccodes.CodesInternalError, OSError):
+        complete = False
+    return {"messages": Nmessages,
+            "complete": complete and (Nmessages>0) and (length==os.path.getsize(filepath)),
+            "valid_times": sorted(valid_times),
+            "grids": sorted([list(grid) for grid in grids]),
+            "levels": len(levels),
+            "cyclic": cyclic=={True}}
+
+def index_ECMWF_pool(config: GirafeConfig, filenames: list) -> dict:
+    """
+    Returns the GRIB header metadata of the given files of the ECMWF pool. Headers are
+    kept in a sidecar json index (<paths/ecmwf_index>, by default in the pool) with
+    the size and modification time of every file, and only read again for new or
+    modified files (and for entries of an older index without the cyclic key).
+    """
+    try:
+        with open(config.ecmwf_index, "r") as file:
+            index = json.load(file)
+    except (OSError, ValueError):
+        index = {}
+    headers  = {}
+    modified = False
+    for filename in filenames:
+        stat  = os.stat(f"{config.ecmwf_dir}/{filename}")
+        entry = index.get(filename)
+        if (entry is None) or (entry["size"]!=stat.st_size) or (entry["mtime_ns"]!=stat.st_mtime_ns) or ("cyclic" not in entry):
+            entry = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, **read_grib_header(f"{config.ecmwf_dir}/{filename}")}
+            index[filename] = entry
+            modified = True
+        headers[filename] = entry
+    if modified:
+        try:
+            tmp_filepath = f"{config.ecmwf_index}.{os.getpid()}.tmp"
+            with open(tmp_filepath, "w") as file:
+                json.dump(index, file)
+            os.replace(tmp_filepath, config.ecmwf_index)
+        except OSError as error:
+            LOGGER.warning(f"Could not update the ECMWF pool index {config.ecmwf_index} ({error})")
+    return headers
+
+def check_ECMWF_pool(config: GirafeConfig) -> int:
+    """
+    Checks that every ECMWF file of the simulation is in the pool (one directory scan),
+    complete, valid at its AVAILABLE date, and on the same grid and levels as the other
+    files, within the par_mod dimensions set in the configuration.
+    """
     exit_flag = 0
     LOGGER.info("Checking ECMWF pool for the available files")
-    ecmwf_pool = get_ECMWF_pool_path(config_xml_filepath)
-    with open(working_dir+"/AVAILABLE","r") as file:
-        lines = file.readlines()
-    list_EN_files = [line.split(" ")[7] for line in lines[3:]]
-    for file in list_EN_files:
-        if os.path.exists(ecmwf_pool+"/"+file):
-            # LOGGER.info(file+" exists")
-            trash = 1
-        else:
-            LOGGER.error(file+" does not exist")
+    ecmwf_files = get_ECMWF_files(config)
+    try:
+        with os.scandir(config.ecmwf_dir) as entries:
+            pool = set([entry.name for entry in entries])
+    except OSError as error:
+        LOGGER.error(f"ECMWF directory {config.ecmwf_dir} cannot be read ({error})")
+        return 1
+    missing = set([filename for _, filename in ecmwf_files]) - pool
+    for _, filename in ecmwf_files:
+        if filename in missing:
+            LOGGER.error(filename+" does not exist")
+            exit_flag = 1
+    headers = index_ECMWF_pool(config, [filename for _, filename in ecmwf_files if filename not in missing])
+    if len(headers)==0:
+        return exit_flag
+    reference_grid   = pd.Series([str(header["grids"]) for header in headers.values()]).mode()[0]
+    reference_levels = pd.Series([header["levels"] for header in headers.values()]).mode()[0]
+    for file_date, filename in ecmwf_files:
+        if filename in missing:
+            continue
+        header = headers[filename]
+        if not header["complete"]:
+            LOGGER.error(f"{filename} is truncated or is not a valid GRIB file")
+            exit_flag = 1
+        elif header["valid_times"]!=[datetime.datetime.strftime(file_date,"%Y%m%d%H%M")]:
+            LOGGER.error(f"{filename} is valid at {', '.join(header['valid_times'])} instead of {datetime.datetime.strftime(file_date,'%Y%m%d%H%M')}")
+            exit_flag = 1
+        elif (str(header["grids"])!=reference_grid) or (header["levels"]!=reference_levels):
+            LOGGER.error(f"{filename} grid {header['grids']} with {header['levels']} levels differs from the other files ({reference_grid} with {reference_levels} levels)")
+            exit_flag = 1
+        elif len(undersized_par_mod_dimensions(config, grib_par_mod_dimensions(header)))>0:
+            LOGGER.error(f"{filename} grid {header['grids']} with {header['levels']} levels needs "
+                         f"{', '.join(undersized_par_mod_dimensions(config, grib_par_mod_dimensions(header)))} in <par_mod_parameters>, check your configuration file!")
             exit_flag = 1
     return exit_flag
 
-def get_working_dir(config_xml_filepath: str) -> str:
-    xml          = ET.parse(config_xml_filepath)
-    return xml.getroot().find("girafe/paths/working_dir").text
+def grib_par_mod_dimensions(header: dict) -> dict:
+    """
+    Returns the smallest par_mod.f90 dimensions for the ECMWF fields of a GRIB header
+    (see read_grib_header()): FLEXPART adds a cyclic column to the global grids and the
+    surface to the model levels.
+    """
+    return {"nxmax": max([nx for nx, _ in header["grids"]]) + (1 if header["cyclic"] else 0),
+            "nymax": max([ny for _, ny in header["grids"]]),
+            **{key: header["levels"]+1 for key in ["nuvzmax", "nwzmax", "nzmax"]}}
+
+def undersized_par_mod_dimensions(config: GirafeConfig, dimensions: dict) -> list:
+    return [f"{key}>={value} (not {config.par_mod[key]})" for key, value in dimensions.items()
+            if (key in config.par_mod) and (config.par_mod[key]<value)]
+
+def get_par_mod_dimensions(config: GirafeConfig) -> Optional[dict]:
+    """
+    Returns the par_mod.f90 grid dimensions of the run: the smallest ones for the first
+    ECMWF file of the simulation (GRIB header read through the pool index), replaced by
+    the values of <par_mod_parameters> when they are set, which cannot be smaller. None
+    when the first ECMWF file is missing or invalid, unless all the dimensions are set
+    in the configuration.
+    """
+    _, filename = get_ECMWF_files(config)[0]
+    header = None
+    if os.path.exists(f"{config.ecmwf_dir}/{filename}"):
+        header = index_ECMWF_pool(config, [filename])[filename]
+    if (header is None) or (not header["complete"]) or (len(header["grids"])==0):
+        if all([key in config.par_mod for key in PAR_MOD_DIMENSIONS]):
+            return {key: config.par_mod[key] for key in PAR_MOD_DIMENSIONS}
+        return None
+    dimensions = grib_par_mod_dimensions(header)
+    undersized = undersized_par_mod_dimensions(config, dimensions)
+    if len(undersized)>0:
+        LOGGER.error(f"The grid of {filename} needs {', '.join(undersized)} in <par_mod_parameters>, check your configuration file!")
+        sys.exit(1)
+    return {**dimensions, **{key: config.par_mod[key] for key in PAR_MOD_DIMENSIONS if key in config.par_mod}}
+
+def stage_link(source: str, destination: str) -> None:
+    if os.path.islink(destination) and (os.readlink(destination)==source):
+        return
+    if os.path.isdir(destination) and not os.path.islink(destination):
+        shutil.rmtree(destination)
+    elif os.path.lexists(destination):
+        os.remove(destination)
+    os.symlink(source, destination)
+
+def list_flexpart_sources() -> list:
+    """
+    Returns the paths, relative to FLEXPART_ROOT/src, of the files staged in the
+    working directory to compile FLEXPART: everything but the build products and the
+    executables, excluded by name so that FLEXPART.f90 and FLEXPART_MPI.f90 are staged.
+    """
+    src_dir = f"{FLEXPART_ROOT}/src"
+    sources = []
+    for root, dirs, files in os.walk(src_dir):
+        dirs.sort()
+        for filename in sorted(files):
+            if filename.endswith(FLEXPART_BUILD_PRODUCTS) or (filename in FLEXPART_EXECUTABLES) or filename.startswith("DBG_"):
+                continue
+            sources.append(os.path.relpath(os.path.join(root, filename), src_dir))
+    return sources
 
 def copy_source_files(working_dir: str) -> None:
-    local_src_dir = f"{working_dir}/flexpart_src/"
-    if not os.path.exists(local_src_dir):
-        os.mkdir(local_src_dir)
-    bashCommand = [f"cp -r {FLEXPART_ROOT}/src/* {local_src_dir}"]
-    result = subprocess.run(bashCommand, capture_output=True, shell=True)
-    if result.returncode!=0:
-        LOGGER.error(result.stderr)
+    """
+    Stages the FLEXPART sources in working_dir/flexpart_src as symbolic links to
+    FLEXPART_ROOT/src. par_mod.f90, rewritten for every run, is copied.
+    """
+    local_src_dir = f"{working_dir}/flexpart_src"
+    try:
+        for filename in list_flexpart_sources():
+            destination = f"{local_src_dir}/{filename}"
+            os.makedirs(os.path.dirname(destination), exist_ok=True)
+            if os.path.basename(filename)=="par_mod.f90":
+                if os.path.lexists(destination):
+                    os.remove(destination)
+                shutil.copy(f"{FLEXPART_ROOT}/src/{filename}", destination)
+            else:
+                stage_link(f"{FLEXPART_ROOT}/src/{filename}", destination)
+    except OSError as error:
+        LOGGER.error(error)
         return 1
     return 0
 
@@ -982,7 +1931,7 @@ def prepare_working_dir(working_dir: str) -> None:
         pass
     else:
         try:
-            os.mkdir(wdir)
+            os.mkdir(working_dir)
         except:
             LOGGER.error(f"The working dir ({working_dir}) does not exist, and Python did not manage to create it...")
             return 1
@@ -990,154 +1939,1801 @@ def prepare_working_dir(working_dir: str) -> None:
         os.mkdir(f"{working_dir}/options")
     if not os.path.exists(f"{working_dir}/output"):
         os.mkdir(f"{working_dir}/output")
-    shutil.copy(f"{FLEXPART_ROOT}/options/IGBP_int1.dat", f"{working_dir}/options/")
-    shutil.copy(f"{FLEXPART_ROOT}/options/surfdata.t", f"{working_dir}/options/")
-    shutil.copy(f"{FLEXPART_ROOT}/options/surfdepo.t", f"{working_dir}/options/")
-    if not os.path.exists(f"{working_dir}/options/SPECIES/"):
-        shutil.copytree(f"{FLEXPART_ROOT}/options/SPECIES", f"{working_dir}/options/SPECIES/")
+    # Immutable FLEXPART inputs are linked, not copied. A SPECIES directory edited in the working dir is kept.
+    for filename in FLEXPART_STATIC_OPTIONS:
+        destination = f"{working_dir}/options/{filename}"
+        if (filename=="SPECIES") and os.path.isdir(destination) and not os.path.islink(destination):
+            continue
+        stage_link(f"{FLEXPART_ROOT}/options/{filename}", destination)
     return 0
     
 
-def run_bash_command(command_string: str, working_dir: str) -> None:
-    """
-    Executes bash commands and logs its output simultaneously
-
-    Args:
-        command_string (str): bash command to execute
-    """
-    process = subprocess.Popen(command_string, cwd=working_dir, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-    while True:
-        output = process.stdout.readline()
-        # output_err = process.stderr.readline()
-        if process.poll() is not None:
-            break
-        if output:
-            LOGGER.info(output.strip().decode('utf-8'))
-        # if output_err:
-        #     LOGGER.error(output_err.strip().decode('utf-8'))
-    return_code = process.poll()
-    return return_code
-
-def calc_conc_integrated(nc_dataset: nc.Dataset, var_name: str, altitude_array: np.array):
-    arr = nc_dataset.variables[var_name][0,0,:,:,:,:]
-    conc_i = arr[:,0,:,:]*altitude_array[0]
-    for calt in np.arange(1,len(altitude_array)-1):
-        conc_i = conc_i + arr[:,calt,:,:]*(altitude_array[calt+1]-altitude_array[calt])
-    conc_i = ma.masked_where(conc_i<=0, conc_i)
-    val_min = ma.min(conc_i)
-    val_max = ma.max(conc_i)
-    return conc_i, val_min, val_max
-
-def plot_girafe_simulation(nc_filepath, output_dir):
-    ds                = nc.Dataset(nc_filepath)
-    list_variables    = list(ds.variables)
-    data_variables    = [elem for elem in list_variables if "spec" in elem]
-    # =============================================================================
-    lat  = np.array(ds.variables["latitude"])
-    lon  = np.array(ds.variables["longitude"])
-    alt  = np.array(ds.variables["height"])
-    time = np.array(ds.variables["time"])
-    # =============================================================================
-    start_time   = datetime.datetime.strptime(ds.variables["time"].units.split(" ")[2]+" "+ds.variables["time"].units.split(" ")[3],
-                                            "%Y-%m-%d %H:%M")
-    arr_datetime = [start_time + datetime.timedelta(seconds=float(elem)) for elem in time]
-    # =============================================================================
-    N_releases    = ds.dimensions["numpoint"].size
-    output_type   = {"mr":"Mass concentration",
-                     "pptv":"Volume mixing ratio"}
-    output_units  = {"mr":"ng/m²",
-                     "pptv":"pptv"}
-    lon_mesh, lat_mesh = np.meshgrid(lon,lat)
-    im_ratio           = len(lat)/len(lon)
-    Nlevels            = 21
-
-    for var in data_variables:
-        if "mr" in var:
-            QL_dir = output_dir
-            species_name  = ds.variables[var].long_name
-            # =============================================================================
-            arr_type  = output_type[var.split("_")[-1]]
-            arr_units = output_units[var.split("_")[-1]]
-            # =============================================================================
-            var_array, val_min, val_max = calc_conc_integrated(ds, var, alt)
-            # LOGGER.info(f"Integrated concentration are between {val_min} and {val_max}")
-            non_empty_lats = np.any(var_array, axis=(0, 2))
-            non_empty_lons = np.any(var_array, axis=(0, 1))
-            min_lat, max_lat = np.where(non_empty_lats)[0][[0, -1]]
-            min_lon, max_lon = np.where(non_empty_lons)[0][[0, -1]]
-            countour_levels = np.logspace(math.log10(val_min),math.log10(val_max),Nlevels)
-            # =============================================================================
-            for time_index in range(len(time)):
-                LOGGER.info(f"Creating figure for {var} - time {time_index+1}/{len(time)}")
-                fig = plt.figure(figsize=(11.7,8.3))
-                ax  = fig.add_axes(plt.axes(projection=crs.PlateCarree()))
-                ax.stock_img()
-                ax.set_global()
-
-                # Plot data (contour, scatter points or pixels)
-                obj = ax.contourf(lon,
-                                lat,
-                                var_array[time_index,:,:],
-                                transform=crs.PlateCarree(),
-                                levels=countour_levels,
-                                cmap="jet",
-                                norm = matplotlib.colors.LogNorm(vmin=val_min,vmax=val_max))
-                # obj = ax.scatter(x=lon_mesh,
-                #                  y=lat_mesh,
-                #                  c=conc_i[time_index,:,:],
-                #                  s=7,
-                #                  cmap="jet",
-                #                  vmin=val_min,
-                #                  vmax=val_max,
-                #                  transform=crs.PlateCarree(),
-                #                  norm=matplotlib.colors.LogNorm())
-                # obj = ax.imshow(var_array[time_index,:,:],
-                #                 cmap="jet",
-                #                 extent=[min(lon)-0.05, max(lon)+0.05, min(lat)-0.05, max(lat)+0.05],
-                #                 transform=crs.PlateCarree(),
-                #                 norm=colors.LogNorm(vmin=val_min,vmax=val_max))
-
-                # Draw coastlines on the map
-                ax.add_feature(cf.COASTLINE, linewidth=0.3)
-                ax.add_feature(cf.BORDERS, linewidth=0.3)
-                # ax.set_extent([lon[min_lon], lon[max_lon], lat[min_lat], lat[max_lat]])
+def check_number_parts(Nparts: int) -> None:
+    """
+    Exits with the corresponding error if write_releases_file() failed or found no release.
+    """
+    if Nparts==-1:
+        LOGGER.error("Error in the emissions filepath. Only MODIS MCD14DL txt files or netCDF CAMS inventories are accepted.")
+        sys.exit(1)
+    elif Nparts==-2:
+        LOGGER.error("CAMS inventory does not exist, check the filepath in your configuration file.")
+        sys.exit(1)
+    elif Nparts==-3:
+        LOGGER.error("MODIS fire inventory does not exist, check the filepath in your configuration file.")
+        sys.exit(1)
+    elif Nparts==0:
+        LOGGER.error("No release sources were found, exiting the simulation.")
+        sys.exit(1)
+
+def estimate_run_footprint(config: GirafeConfig) -> dict:
+    """
+    Estimates the footprint of the run without compiling nor launching FLEXPART: the
+    RELEASES file is written in a temporary directory to count the particles and the
+    release points, and the memory and output sizes are derived from the par_mod.f90
+    parameters and the OUTGRID/COMMAND options. Sizes are upper bounds in bytes (no
+    NetCDF compression).
+    """
+    with tempfile.TemporaryDirectory(prefix="girafe_plan_") as tmp_dir:
+        os.mkdir(f"{tmp_dir}/options")
+        Nparts = write_releases_file(config, tmp_dir)
+        check_number_parts(Nparts)
+        with open(f"{tmp_dir}/options/RELEASES", "r") as file:
+            numpoint = file.read().count("&RELEASE\n")
+    Nprocesses = min(config.partitions, numpoint) if release_partitioning_enabled(config) else 1
+    dimensions = get_par_mod_dimensions(config)
+    if dimensions is None:
+        LOGGER.warning("The first ECMWF file of the simulation is missing or invalid, the meteo memory is estimated for a global 0.5° grid with 137 levels")
+    par_mod = get_par_mod_parameters(config, -(-Nparts//Nprocesses), dimensions)
+    maxpart = bucket_maxpart(int(par_mod["maxpart"])+1, config.maxpart_bucket)
+    command = {key: value.strip() for key, value in config.command}
+    iout     = int(command["IOUT"])
+    loutstep = int(command["LOUTSTEP"])
+    npointspec = numpoint if int(command["IOUTPUTFOREACHRELEASE"])==1 else 1
+    nx, ny, nz = config.outgrid.nx, config.outgrid.ny, len(config.outgrid.height_levels)
+    Noutputs   = int((config.end_datetime - config.begin_datetime).total_seconds() // loutstep)
+    Nfields    = 2 if (iout%8) in [3, 7] else 1 # concentration and/or mixing ratio
+    ecmwf_files = get_ECMWF_files(config)
+    ecmwf_bytes = 0
+    for _, filename in ecmwf_files:
+        if os.path.exists(f"{config.ecmwf_dir}/{filename}"):
+            ecmwf_bytes = ecmwf_bytes + os.path.getsize(f"{config.ecmwf_dir}/{filename}")
+    # Every FLEXPART process of a partitioned run, and every MPI rank, holds its own copy of
+    # the fields and grids, MPI ranks share the particles
+    Nranks         = config.mpi_ranks or 1
+    meteo_bytes    = Nprocesses * Nranks * 4 * FLEXPART_3D_FIELDS * 2 * par_mod["nxmax"] * par_mod["nymax"] * par_mod["nzmax"]
+    particle_bytes = Nprocesses * FLEXPART_PARTICLE_BYTES * maxpart
+    grid_bytes     = Nprocesses * Nranks * 4 * 2 * nx * ny * nz * npointspec # gridunc and grid output arrays
+    output_bytes   = 4 * Noutputs * npointspec * nx * ny * (Nfields*nz + 2) # + dry and wet deposition
+    return {"particles": int(Nparts),
+            "numpoint": numpoint,
+            "processes": Nprocesses,
+            "mpi_ranks": Nranks,
+            "maxpart": maxpart,
+            "maxreceptor": 20,
+            "par_mod_grid": (par_mod["nxmax"], par_mod["nymax"], par_mod["nzmax"]),
+            "meteo_memory": meteo_bytes,
+            "particle_memory": particle_bytes,
+            "grid_memory": grid_bytes,
+            "memory": meteo_bytes + particle_bytes + grid_bytes,
+            "output_steps": Noutputs,
+            "output_size": output_bytes,
+            "ecmwf_files": len(ecmwf_files),
+            "ecmwf_size": ecmwf_bytes}
+
+def print_run_plan(config: GirafeConfig, plan: dict) -> int:
+    """
+    Logs the estimates of estimate_run_footprint() and warns about those exceeding the
+    limits of the configuration. Returns the number of exceeded limits.
+    """
+    GB = 1024**3
+    LOGGER.info(f"Particles released      : {plan['particles']} in {plan['numpoint']} releases, {plan['processes']} FLEXPART process(es) of {plan['mpi_ranks']} rank(s) (maxpart={plan['maxpart']})")
+    LOGGER.info(f"FLEXPART static memory  : {plan['memory']/GB:.2f} GB (meteo {plan['meteo_memory']/GB:.2f} GB on {'x'.join([str(size) for size in plan['par_mod_grid']])} grid points, "
+                f"particles {plan['particle_memory']/GB:.2f} GB, output grid {plan['grid_memory']/GB:.2f} GB)")
+    LOGGER.info(f"NetCDF output           : {plan['output_size']/GB:.2f} GB uncompressed ({plan['output_steps']} output steps, {config.outgrid.nx}x{config.outgrid.ny}x{len(config.outgrid.height_levels)} grid)")
+    LOGGER.info(f"ECMWF files to read     : {plan['ecmwf_files']} ({plan['ecmwf_size']/GB:.2f} GB found in {config.ecmwf_dir})")
+    Nexceeded = 0
+    if -(-plan["particles"]//plan["processes"])>plan["maxpart"]:
+        LOGGER.warning(f"{plan['particles']} particles exceed the maxpart={plan['maxpart']} of the configuration file, FLEXPART will stop")
+        Nexceeded = Nexceeded + 1
+    for key, value, limit_key, unit in [("particles", plan["particles"], "max_particles", 1),
+                                        ("memory", plan["memory"], "max_memory_gb", GB),
+                                        ("output size", plan["output_size"], "max_output_gb", GB)]:
+        if value>config.plan_limits[limit_key]*unit:
+            LOGGER.warning(f"Estimated {key} exceeds <plan/{limit_key}>={config.plan_limits[limit_key]:g}")
+            Nexceeded = Nexceeded + 1
+    return Nexceeded
+
+def parse_flexpart_progress(line: str) -> Optional[Tuple[int, int]]:
+    """
+    Returns the (simulated seconds, number of particles) of a FLEXPART progress line,
+    None for any other line.
+    """
+    for pattern in FLEXPART_PROGRESS_PATTERNS:
+        match = pattern.search(line)
+        if match is not None:
+            return abs(int(match.group(1))), int(match.group(2))
+    return None
+
+def drain_pipe(pipe, stream_name: str, lines_queue: queue.Queue) -> None:
+    for line in iter(pipe.readline, b""):
+        lines_queue.put((stream_name, line.decode("utf-8", errors="replace").rstrip()))
+    pipe.close()
+    lines_queue.put((stream_name, None))
+
+def process_group_peak_rss(pgid: int) -> int:
+    """
+    Returns the largest peak resident memory (VmHWM, bytes) of the running processes of
+    the process group pgid, 0 without /proc.
+    """
+    peak = 0
+    for entry in (os.listdir("/proc") if os.path.isdir("/proc") else []):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat", "r") as file:
+                if int(file.read().rsplit(")", 1)[1].split()[2])!=pgid:
+                    continue
+            with open(f"/proc/{entry}/status", "r") as file:
+                for line in file:
+                    if line.startswith("VmHWM:"):
+                        peak = max(peak, int(line.split()[1])*1024)
+        except (OSError, ValueError, IndexError):
+            continue
+    return peak
+
+def run_bash_command(command_string: str, working_dir: str, log_filepath: str, total_seconds: float=None,
+                     timeout: float=None, inactivity_timeout: float=None, log_prefix: str="") -> RunResult:
+    """
+    Executes a bash command in working_dir, streaming its stdout and stderr (each drained
+    by its own thread, so a full pipe never blocks the process) to log_filepath and to
+    the logger. FLEXPART progress lines are turned into simulated time progress and
+    throughput. The command (and its children) is killed when it runs longer than
+    timeout seconds, or prints nothing during inactivity_timeout seconds. log_prefix is
+    prepended to the logged lines (not to the log file). The peak memory of the command
+    is sampled every second on its process group.
+    """
+    start         = time.monotonic()
+    last_activity = start
+    last_sample   = start
+    spawn_rss     = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss*1024
+    process = subprocess.Popen(command_string, cwd=working_dir, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE, start_new_session=True)
+    lines_queue = queue.Queue()
+    for pipe, stream_name in [(process.stdout, "stdout"), (process.stderr, "stderr")]:
+        threading.Thread(target=drain_pipe, args=(pipe, stream_name, lines_queue), daemon=True).start()
+    open_streams = 2
+    status       = None
+    simulated_seconds, particles = 0, 0
+    peak_rss = process_group_peak_rss(process.pid)
+    with open(log_filepath, "w") as log_file:
+        while open_streams>0:
+            try:
+                stream_name, line = lines_queue.get(timeout=1.0)
+            except queue.Empty:
+                line = ""
+                stream_name = None
+            now = time.monotonic()
+            if now-last_sample>=1.0:
+                peak_rss    = max(peak_rss, process_group_peak_rss(process.pid))
+                last_sample = now
+            if line is None:
+                open_streams = open_streams - 1
+            elif stream_name is not None:
+                last_activity = now
+                log_file.write(line+"\n" if stream_name=="stdout" else f"[stderr] {line}\n")
+                log_file.flush()
+                if stream_name=="stdout":
+                    LOGGER.info(log_prefix+line)
+                else:
+                    LOGGER.warning(log_prefix+line)
+                progress = parse_flexpart_progress(line)
+                if progress is not None:
+                    simulated_seconds, particles = progress
+                    throughput = (simulated_seconds/3600) / max((now-start)/60, 1e-9)
+                    percent    = f" ({100*simulated_seconds/total_seconds:.0f}%)" if total_seconds else ""
+                    LOGGER.info(f"{log_prefix}Simulated {simulated_seconds/3600:.1f} h{percent}, {particles} particles, {throughput:.2f} simulated h/min")
+            if status is None:
+                if (timeout is not None) and (now-start>timeout):
+                    LOGGER.error(f"{command_string} exceeded the timeout of {timeout:g} s, killing it")
+                    status = "timeout"
+                elif (inactivity_timeout is not None) and (now-last_activity>inactivity_timeout):
+                    LOGGER.error(f"{command_string} printed nothing for {inactivity_timeout:g} s, killing it")
+                    status = "stalled"
+                if status is not None:
+                    try:
+                        os.killpg(process.pid, signal.SIGKILL)
+                    except ProcessLookupError:
+                        pass
+    # wait4 instead of process.wait() for the resource usage of the command and its children. Their
+    # ru_maxrss starts from the memory of this process when forked, it is only theirs above it
+    _, wait_status, usage = os.wait4(process.pid, 0)
+    if usage.ru_maxrss*1024>spawn_rss:
+        peak_rss = max(peak_rss, usage.ru_maxrss*1024)
+    return_code = os.waitstatus_to_exitcode(wait_status)
+    process.returncode = return_code
+    if status is None:
+        status = "finished" if return_code==0 else "failed"
+    return RunResult(status=status,
+                     return_code=return_code,
+                     wall_time=time.monotonic()-start,
+                     simulated_seconds=simulated_seconds,
+                     particles=particles,
+                     log_filepath=log_filepath,
+                     cpu_time=usage.ru_utime+usage.ru_stime,
+                     peak_rss=peak_rss)
+
+def layer_thicknesses(altitude_array: np.ndarray) -> np.ndarray:
+    """
+    Thicknesses (m) of the FLEXPART output layers, whose heights are the tops of the
+    layers above the ground.
+    """
+    return np.diff(np.concatenate([[0.0], np.asarray(altitude_array, dtype=np.float64)]))
 
+def stream_conc_integrated(nc_dataset: nc.Dataset, var_name: str, altitude_array: np.ndarray, time_indices: list=None, scale: list=None):
+    """
+    Yields the time index and the concentration of var_name integrated over the height
+    levels (masked where it is not positive) of every output time, or only of
+    time_indices. Contiguous time steps are read by chunks of at most
+    CONC_CHUNK_BYTES, so that the memory used does not depend on the number of time
+    steps, and the layers are summed in double precision, so the fields do not depend
+    on the chunking. When scale is given, its [min, max] are updated with the ones of
+    every yielded field, so the colour scale comes with the same pass. Masked (fill)
+    values count as no concentration.
+    """
+    variable   = nc_dataset.variables[var_name]
+    thickness  = layer_thicknesses(altitude_array)
+    step_bytes = int(np.prod(variable.shape[3:]))*variable.dtype.itemsize
+    chunk_size = max(1, CONC_CHUNK_BYTES//max(step_bytes, 1))
+    time_indices = list(range(variable.shape[2])) if time_indices is None else list(time_indices)
+    start = 0
+    while start<len(time_indices):
+        # Contiguous time indices are read with one slice
+        end = start+1
+        while (end<len(time_indices)) and (end-start<chunk_size) and (time_indices[end]==time_indices[end-1]+1):
+            end = end+1
+        arr    = ma.filled(variable[0,0,time_indices[start]:time_indices[end-1]+1,:,:,:], 0)
+        conc_i = np.einsum("thyx,h->tyx", arr, thickness)
+        for ii in range(end-start):
+            conc = ma.masked_where(conc_i[ii]<=0, conc_i[ii])
+            if (scale is not None) and (conc.count()>0):
+                scale[0] = ma.min(conc) if scale[0] is None else min(scale[0], ma.min(conc))
+                scale[1] = ma.max(conc) if scale[1] is None else max(scale[1], ma.max(conc))
+            yield time_indices[start+ii], conc
+        start = end
+
+QUICKLOOK_TYPES = {"mr":"Mass concentration",
+                   "pptv":"Volume mixing ratio"}
+QUICKLOOK_UNITS = {"mr":"ng/m²",
+                   "pptv":"pptv"}
+QUICKLOOK_LEVELS = 21
+
+def render_quicklooks(nc_filepath: str, output_dir: str, var: str, time_indices: list, val_min: float, val_max: float) -> list:
+    """
+    Renders the quicklooks of var at time_indices in one figure: the map background
+    (stock image, coastlines, borders, gridlines) and the colorbar, identical for all
+    the frames of a variable, are drawn once, and only the contours and the date of the
+    title are replaced from one frame to the next. Only the time steps to render are
+    read. Returns the PNG filepaths.
+    """
+    import matplotlib.colors
+    import matplotlib.pyplot as plt
+    import cartopy.crs as crs
+    import cartopy.feature as cf
+    plt.rcParams.update({'font.family':'serif'})
+    with nc.Dataset(nc_filepath) as ds:
+        lat  = np.array(ds.variables["latitude"])
+        lon  = np.array(ds.variables["longitude"])
+        alt  = np.array(ds.variables["height"])
+        time = np.array(ds.variables["time"])
+        start_time   = datetime.datetime.strptime(ds.variables["time"].units.split(" ")[2]+" "+ds.variables["time"].units.split(" ")[3],
+                                                "%Y-%m-%d %H:%M")
+        arr_datetime = [start_time + datetime.timedelta(seconds=float(elem)) for elem in time]
+        N_releases   = ds.dimensions["numpoint"].size
+        species_name = ds.variables[var].long_name
+        arr_type     = QUICKLOOK_TYPES[var.split("_")[-1]]
+        arr_units    = QUICKLOOK_UNITS[var.split("_")[-1]]
+        im_ratio     = len(lat)/len(lon)
+        countour_levels = np.logspace(math.log10(val_min),math.log10(val_max),QUICKLOOK_LEVELS)
+
+        fig = plt.figure(figsize=(11.7,8.3))
+        ax  = fig.add_axes(plt.axes(projection=crs.PlateCarree()))
+        ax.stock_img()
+        ax.set_global()
+        # Draw coastlines on the map
+        ax.add_feature(cf.COASTLINE, linewidth=0.3)
+        ax.add_feature(cf.BORDERS, linewidth=0.3)
+        # Grid line
+        gl = ax.gridlines(draw_labels=True, color='gray', alpha=0.7, linestyle='--')
+        gl.top_labels = False
+        gl.right_labels = False
+        gl.xlabel_style = {'size': 15}
+        gl.ylabel_style = {'size': 15}
+
+        filepaths = []
+        cb = None
+        for time_index, var_array in stream_conc_integrated(ds, var, alt, time_indices):
+            LOGGER.info(f"Creating figure for {var} - time {time_index+1}/{len(time)}")
+            obj = ax.contourf(lon,
+                              lat,
+                              var_array,
+                              transform=crs.PlateCarree(),
+                              levels=countour_levels,
+                              cmap="jet",
+                              norm = matplotlib.colors.LogNorm(vmin=val_min,vmax=val_max))
+            if cb is None:
                 # Create colorbar with a log scale, change log ticklabels to our data values
                 cb_ticks = np.logspace(math.log10(val_min),math.log10(val_max),10)
                 cb       = fig.colorbar(obj, ticks=cb_ticks, fraction=0.047*im_ratio)
                 cb.minorticks_off()
                 cb.ax.set_yticklabels(["{:.2e}".format(elem) for elem in cb_ticks], fontsize=15)
+            # Title, the pad of the last call applies to the three titles
+            ax.set_title(f"{datetime.datetime.strftime(arr_datetime[time_index], '%Y-%m-%d %H:%M:%S')}\n\n",
+                         loc='center',
+                         fontsize=20,
+                         fontweight="bold")
+            ax.set_title(f"{N_releases} {species_name} sources",
+                         loc='left',
+                         fontsize=20)
+            ax.set_title(f"{arr_type}\n[{arr_units}]",
+                         loc="right",
+                         fontsize=20,
+                         pad=20)
+            # Save figure
+            output_path = f"{output_dir}/QL_{var.split('_')[-1]}_time_{str(time_index+1).zfill(3)}.png"
+            fig.savefig(fname=output_path,
+                        format='png',
+                        bbox_inches='tight')
+            obj.remove()
+            filepaths.append(output_path)
+        plt.close(fig)
+    return filepaths
+
+def quicklook_scales(nc_filepath: str) -> dict:
+    """
+    Returns the (min, max) colour scale of the column integrated concentration of every
+    mass concentration variable of the FLEXPART output, over all its time steps (one
+    streaming pass per variable). Variables that are zero everywhere are left out.
+    """
+    scales = {}
+    with nc.Dataset(nc_filepath) as ds:
+        alt = np.array(ds.variables["height"])
+        for var in [elem for elem in ds.variables if ("spec" in elem) and ("mr" in elem)]:
+            scale = [None, None]
+            for _ in stream_conc_integrated(ds, var, alt, scale=scale):
+                pass
+            if scale[0] is None:
+                LOGGER.warning(f"{var} is zero everywhere, no quicklook")
+                continue
+            scales[var] = tuple(scale)
+    return scales
+
+def plot_girafe_simulation(nc_filepath, output_dir, max_workers: int=None) -> dict:
+    """
+    Plots the column integrated concentration of every mass concentration variable of
+    the FLEXPART output, one PNG per output time. The colour scale of a variable spans
+    all its time steps; the frames are then split in contiguous blocks of time steps
+    rendered by max_workers processes (default: number of cores). The processes are
+    started by a fork server, as the scratch copy-back threads can be running when the
+    quicklooks are plotted. Returns the colour scales (see quicklook_scales()).
+    """
+    scales = quicklook_scales(nc_filepath)
+    with nc.Dataset(nc_filepath) as ds:
+        Ntime = len(ds.variables["time"])
+    max_workers = min(max_workers or os.cpu_count() or 1, max(Ntime, 1))
+    tasks = [(var, time_indices.tolist(), val_min, val_max)
+             for var, (val_min, val_max) in scales.items()
+             for time_indices in np.array_split(np.arange(Ntime), max_workers) if len(time_indices)>0]
+    if max_workers==1:
+        for var, time_indices, val_min, val_max in tasks:
+            render_quicklooks(nc_filepath, output_dir, var, time_indices, val_min, val_max)
+        return scales
+    with concurrent.futures.ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context("forkserver"),
+                                                initializer=start_worker_log, initargs=(LOGGER.level,)) as pool:
+        futures = [pool.submit(render_quicklooks, nc_filepath, output_dir, *task) for task in tasks]
+        for future in futures:
+            future.result()
+    return scales
+
+def tile_bounds(zoom: int, x: int, y: int) -> Tuple[float, float, float, float]:
+    """
+    West, east, south and north bounds (degrees) of the XYZ tile (x, y) at zoom, in the
+    spherical Web Mercator projection of web maps (y=0 at the north).
+    """
+    Ntiles = 2**zoom
+    return (x/Ntiles*360.0-180.0, (x+1)/Ntiles*360.0-180.0,
+            math.degrees(math.atan(math.sinh(math.pi*(1-2*(y+1)/Ntiles)))),
+            math.degrees(math.atan(math.sinh(math.pi*(1-2*y/Ntiles)))))
+
+def tile_pixel_coordinates(zoom: int, x: int, y: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Longitudes (west to east) and latitudes (north to south) of the pixel centres of
+    the XYZ tile (x, y) at zoom.
+    """
+    pixels = (np.arange(TILE_SIZE)+0.5)/TILE_SIZE
+    Ntiles = 2**zoom
+    return (x+pixels)/Ntiles*360.0-180.0, np.degrees(np.arctan(np.sinh(np.pi*(1-2*(y+pixels)/Ntiles))))
+
+def grid_cell_indices(coordinates: np.ndarray, grid: np.ndarray, period: float=None) -> np.ndarray:
+    """
+    Indices of the cells of the regular grid of cell centres containing coordinates, -1
+    outside the grid. Coordinates are wrapped with period (360 for longitudes).
+    """
+    step  = grid[1]-grid[0]
+    shift = np.asarray(coordinates) - (grid[0]-step/2)
+    if period is not None:
+        shift = np.mod(shift, period)
+    index = np.floor(shift/step).astype(np.int64)
+    return np.where((index>=0) & (index<len(grid)), index, -1)
+
+def tile_has_cells(valid: np.ndarray, lat: np.ndarray, lon: np.ndarray, zoom: int, x: int, y: int) -> bool:
+    """
+    True when one of the valid grid cells overlaps the tile. As the cells of a tile
+    include the ones of its children, the children of a tile without cells are empty.
+    """
+    lon_w, lon_e, lat_s, lat_n = tile_bounds(zoom, x, y)
+    dlon  = abs(lon[1]-lon[0])
+    Ncirc = int(math.ceil(360.0/dlon-1e-9))
+    first = int(np.floor(np.mod(lon_w-(lon[0]-dlon/2), 360.0)/dlon))
+    cols  = np.mod(first+np.arange(min(int(math.ceil((lon_e-lon_w)/dlon))+2, Ncirc)), Ncirc)
+    cols  = cols[cols<len(lon)]
+    dlat  = lat[1]-lat[0]
+    rows  = np.floor((np.array([lat_s, lat_n])-(lat[0]-dlat/2))/dlat).astype(np.int64)
+    if (len(cols)==0) or (rows.max()<0) or (rows.min()>=len(lat)):
+        return False
+    rows = np.arange(max(rows.min(), 0), min(rows.max(), len(lat)-1)+1)
+    return bool(valid[np.ix_(rows, cols)].any())
 
-                # Grid line
-                gl = ax.gridlines(draw_labels=True, color='gray', alpha=0.7, linestyle='--')
-                gl.top_labels = False
-                gl.right_labels = False
-                gl.xlabel_style = {'size': 15}
-                gl.ylabel_style = {'size': 15}
-
-                # Title
-                plt.title(f"{datetime.datetime.strftime(arr_datetime[time_index], '%Y-%m-%d %H:%M:%S')}\n\n",
-                        loc='center',
-                        fontsize=20,
-                        fontweight="bold")
-                plt.title(f"{N_releases} {species_name} sources",
-                        loc='left',
-                        fontsize=20)
-                plt.title(f"{arr_type}\n[{arr_units}]",
-                        loc="right",
-                        fontsize=20,
-                        pad=20)
-
-                # Save figure
-                output_path = f"{QL_dir}/QL_{var.split('_')[-1]}_time_{str(time_index+1).zfill(3)}.png"
-                fig.savefig(fname=output_path,
-                            format='png',
-                            bbox_inches='tight')
-                plt.close(fig)
+def write_tile_pyramid(nc_filepath: str, output_dir: str, min_zoom: int, max_zoom: int, scales: dict=None) -> dict:
+    """
+    Writes the column integrated concentration of every mass concentration variable of
+    the FLEXPART output as XYZ web-map tiles, one pyramid per output time in
+    output_dir/<variable>/<time>/<z>/<x>/<y>.png. The colours are the ones of the
+    quicklooks (same colour scale over all the time steps, same QUICKLOOK_LEVELS
+    classes), in palette PNGs with transparent cells below the scale or without
+    concentration. Tiles without concentration are not written (nor their children),
+    and a tile identical to one already written is a hard link to it. The colour scale,
+    times and tile counts are saved in output_dir/tiles.json, which is returned.
+    """
+    import matplotlib
+    import matplotlib.colors
+    from PIL import Image
+    scales = quicklook_scales(nc_filepath) if scales is None else scales
+    index = {"tile_size": TILE_SIZE, "min_zoom": min_zoom, "max_zoom": max_zoom, "format": "png",
+             "url": "{variable}/{time}/{z}/{x}/{y}.png", "variables": {}}
+    written, Ntiles, Nlinks = {}, 0, 0
+    with nc.Dataset(nc_filepath) as ds:
+        lat  = np.array(ds.variables["latitude"])
+        lon  = np.array(ds.variables["longitude"])
+        alt  = np.array(ds.variables["height"])
+        time = np.array(ds.variables["time"])
+        start_time   = datetime.datetime.strptime(ds.variables["time"].units.split(" ")[2]+" "+ds.variables["time"].units.split(" ")[3],
+                                                "%Y-%m-%d %H:%M")
+        arr_datetime = [start_time + datetime.timedelta(seconds=float(elem)) for elem in time]
+        for var, (val_min, val_max) in scales.items():
+            # One palette entry per contour class of the quicklooks, coloured as by contourf, 255 is transparent
+            levels  = np.logspace(math.log10(val_min), math.log10(val_max), QUICKLOOK_LEVELS)
+            colors  = matplotlib.colormaps["jet"](matplotlib.colors.LogNorm(vmin=val_min, vmax=val_max)((levels[:-1]+levels[1:])/2))
+            colors  = np.round(colors[:,:3]*255).astype(np.uint8)
+            palette = np.zeros((256, 3), dtype=np.uint8)
+            palette[:len(colors)] = colors
+            frames = []
+            for time_index, var_array in stream_conc_integrated(ds, var, alt):
+                LOGGER.info(f"Creating tiles for {var} - time {time_index+1}/{len(time)}")
+                field   = ma.filled(var_array.astype(np.float64), 0.0)
+                valid   = field>=val_min
+                # Extra row and column of transparent cells, picked by the -1 indices of the pixels outside the grid
+                classes = np.full((len(lat)+1, len(lon)+1), 255, dtype=np.uint8)
+                classes[:-1,:-1][valid] = np.clip(np.searchsorted(levels, field[valid], side="right")-1, 0, len(colors)-1)
+                frame_dir = f"{output_dir}/{var}/{str(time_index+1).zfill(3)}"
+                Nframe    = 0
+                pending   = [(0, 0, 0)]
+                while len(pending)>0:
+                    zoom, x, y = pending.pop()
+                    if not tile_has_cells(valid, lat, lon, zoom, x, y):
+                        continue
+                    if zoom<max_zoom:
+                        pending.extend([(zoom+1, 2*x+dx, 2*y+dy) for dx in (0, 1) for dy in (0, 1)])
+                    if zoom<min_zoom:
+                        continue
+                    lon_pixels, lat_pixels = tile_pixel_coordinates(zoom, x, y)
+                    tile = classes[grid_cell_indices(lat_pixels, lat)][:, grid_cell_indices(lon_pixels, lon, period=360.0)]
+                    if (tile==255).all():
+                        continue
+                    filepath = f"{frame_dir}/{zoom}/{x}/{y}.png"
+                    os.makedirs(os.path.dirname(filepath), exist_ok=True)
+                    if os.path.exists(filepath):
+                        os.remove(filepath)
+                    key = hashlib.sha1(tile.tobytes()).hexdigest()
+                    if key in written:
+                        os.link(written[key], filepath)
+                        Nlinks = Nlinks + 1
+                    else:
+                        image = Image.fromarray(tile)
+                        image.putpalette(palette.ravel().tolist())
+                        image.save(filepath, format="PNG", transparency=255)
+                        written[key] = filepath
+                    Nframe = Nframe + 1
+                frames.append({"time": arr_datetime[time_index].isoformat(), "tiles": Nframe})
+                Ntiles = Ntiles + Nframe
+            index["variables"][var] = {"min": float(val_min), "max": float(val_max), "units": QUICKLOOK_UNITS[var.split("_")[-1]],
+                                       "levels": levels.tolist(), "colors": [matplotlib.colors.to_hex(color/255) for color in colors],
+                                       "frames": frames}
+    Npyramid = sum([4**zoom for zoom in range(min_zoom, max_zoom+1)])*sum([len(value["frames"]) for value in index["variables"].values()])
+    index["tiles"], index["unique_tiles"] = Ntiles, Ntiles-Nlinks
+    with open(f"{output_dir}/tiles.json", "w") as file:
+        json.dump(index, file, indent=2)
+    LOGGER.info(f"{Ntiles} tiles written ({Ntiles-Nlinks} unique) out of the {Npyramid} tiles of the pyramids")
+    return index
 
 # ===============================================================================================================
 
 
+def read_mpi_rank_timings(log_filepath: str) -> list:
+    """
+    Returns the rank, start/end times (epoch seconds), wall time and exit code of every
+    MPI rank, from the lines printed by the MPI_RANK_TIMER wrapper in a run log.
+    """
+    timings = []
+    with open(log_filepath, "r") as file:
+        for line in file:
+            match = MPI_RANK_TIMING_PATTERN.match(line.strip())
+            if match is not None:
+                start, end = float(match.group(2)), float(match.group(3))
+                timings.append({"rank": int(match.group(1)), "start": start, "end": end,
+                                "wall_time": end-start, "return_code": int(match.group(4))})
+    return sorted(timings, key=lambda timing: timing["rank"])
+
+def launch_flexpart(config: GirafeConfig, run_dir: str, log_prefix: str="") -> RunResult:
+    """
+    Runs the FLEXPART executable of run_dir, serial or with mpirun -np <ranks> when the
+    configuration has an <execution><mpi> node. The wall time of every MPI rank is
+    logged and saved in mpi_ranks.json in run_dir.
+    """
+    command = f"./{config.flexpart_executable}"
+    if config.mpi_ranks is not None:
+        with open(f"{run_dir}/mpi_rank_timer.sh", "w") as file:
+            file.write(MPI_RANK_TIMER)
+        os.chmod(f"{run_dir}/mpi_rank_timer.sh", 0o755)
+        command = f"mpirun -np {config.mpi_ranks} ./mpi_rank_timer.sh {command}"
+    result = run_bash_command(command, run_dir, f"{run_dir}/flexpart_run.out",
+                              total_seconds=(config.end_datetime-config.begin_datetime).total_seconds(),
+                              timeout=config.run_timeout, inactivity_timeout=config.inactivity_timeout,
+                              log_prefix=log_prefix)
+    if config.mpi_ranks is not None:
+        timings = read_mpi_rank_timings(result.log_filepath)
+        with open(f"{run_dir}/mpi_ranks.json", "w") as file:
+            json.dump(timings, file, indent=2)
+        if len(timings)>0:
+            wall_times = [timing["wall_time"] for timing in timings]
+            LOGGER.info(f"{log_prefix}{len(timings)} MPI ranks, wall time {min(wall_times)/60:.1f} to {max(wall_times)/60:.1f} min")
+    return result
+
+def release_partitioning_enabled(config: GirafeConfig) -> bool:
+    """
+    Partitioned runs need one summable gridded NetCDF output: IOUT with NetCDF output
+    and no output for each release.
+    """
+    command = {key: value.strip() for key, value in config.command}
+    return (config.partitions>1) and (int(command["IOUT"])>=8) and (int(command["IOUTPUTFOREACHRELEASE"])==0)
+
+def split_releases_file(filepath: str) -> Tuple[str, list, np.ndarray]:
+    """
+    Splits a RELEASES file into its header (&RELEASES_CTRL), its &RELEASE blocks and
+    the number of particles of every block.
+    """
+    with open(filepath, "r") as file:
+        content = file.read()
+    first  = content.index("&RELEASE\n")
+    blocks = ["&RELEASE\n"+block for block in content[first:].split("&RELEASE\n")[1:]]
+    parts  = np.array([int(re.search(r"PARTS = (\d+)", block).group(1)) for block in blocks], dtype=np.int64)
+    return content[:first], blocks, parts
+
+def partition_releases(parts: np.ndarray, Npartitions: int) -> list:
+    """
+    Splits the releases in Npartitions groups with balanced numbers of particles, the
+    releases being given, by decreasing number of particles, to the least loaded group
+    (longest processing time first). Returns the sorted release indices of every group.
+    """
+    heap   = [(0, index) for index in range(Npartitions)]
+    groups = [[] for _ in range(Npartitions)]
+    for release_index in np.argsort(-parts, kind="stable"):
+        load, group_index = heapq.heappop(heap)
+        groups[group_index].append(release_index)
+        heapq.heappush(heap, (load+int(parts[release_index]), group_index))
+    return [np.sort(np.array(group, dtype=np.int64)) for group in groups]
+
+def prepare_release_partitions(config: GirafeConfig, working_dir: str) -> list:
+    """
+    Splits the RELEASES file of working_dir into config.partitions FLEXPART working
+    directories (working_dir/partitions/NNN) sharing the other options, the AVAILABLE
+    file and the ECMWF data through symbolic links. Returns the (directory, number of
+    particles) of every partition.
+    """
+    header, blocks, parts = split_releases_file(f"{working_dir}/options/RELEASES")
+    groups = partition_releases(parts, min(config.partitions, len(blocks)))
+    partitions = []
+    for index, group in enumerate(groups):
+        partition_dir = f"{working_dir}/partitions/{index:03d}"
+        if os.path.exists(partition_dir):
+            shutil.rmtree(partition_dir)
+        os.makedirs(f"{partition_dir}/options")
+        os.makedirs(f"{partition_dir}/output")
+        for entry in os.listdir(f"{working_dir}/options"):
+            if entry!="RELEASES":
+                os.symlink(f"{working_dir}/options/{entry}", f"{partition_dir}/options/{entry}")
+        os.symlink(f"{working_dir}/AVAILABLE", f"{partition_dir}/AVAILABLE")
+        with open(f"{partition_dir}/options/RELEASES", "w") as file:
+            file.write(header + "".join([blocks[release_index] for release_index in group]))
+        write_pathnames_file(config, partition_dir)
+        partitions.append((partition_dir, int(parts[group].sum())))
+    LOGGER.info(f"{len(blocks)} releases split in {len(groups)} partitions of {min([Nparts for _, Nparts in partitions])} to {max([Nparts for _, Nparts in partitions])} particles")
+    return partitions
+
+def run_release_partitions(config: GirafeConfig, working_dir: str, partition_dirs: list) -> RunResult:
+    """
+    Runs the FLEXPART executable of working_dir concurrently in every partition
+    directory, then sums their outputs into working_dir/output. The result is the
+    slowest partition, or the first one which did not finish, with the particles, CPU
+    time and peak memory of all the partitions.
+    """
+    executable = config.flexpart_executable
+    for partition_dir in partition_dirs:
+        if os.path.lexists(f"{partition_dir}/{executable}"):
+            os.remove(f"{partition_dir}/{executable}")
+        os.symlink(f"{working_dir}/{executable}", f"{partition_dir}/{executable}")
+    with concurrent.futures.ThreadPoolExecutor(max_workers=len(partition_dirs)) as pool:
+        futures = [pool.submit(launch_flexpart, config, partition_dir, log_prefix=f"[{os.path.basename(partition_dir)}] ")
+                   for partition_dir in partition_dirs]
+        results = [future.result() for future in futures]
+    failed  = [result for result in results if result.status!="finished"]
+    result  = failed[0] if len(failed)>0 else max(results, key=lambda result: result.wall_time)
+    # The partitions run at the same time, their peak memories add up
+    result  = replace(result, particles=sum([result.particles for result in results]), cpu_time=sum([result.cpu_time for result in results]),
+                      peak_rss=sum([result.peak_rss for result in results]))
+    if len(failed)>0:
+        return result
+    outputs = [find_flexpart_output(partition_dir) for partition_dir in partition_dirs]
+    if None in outputs:
+        LOGGER.error("Some of the partitions did not write a NetCDF output")
+        return replace(result, status="failed")
+    LOGGER.info(f"Merging the outputs of {len(outputs)} partitions")
+    merge_flexpart_outputs(outputs, f"{working_dir}/output/{os.path.basename(outputs[0])}")
+    return result
+
+def merge_flexpart_outputs(filepaths: list, output_filepath: str) -> None:
+    """
+    Merges the NetCDF outputs of release partitions into one file with the same layout:
+    the gridded fields (SUMMED_OUTPUT_VARIABLES) are summed one time step at a time,
+    the release variables are concatenated along numpoint, and the other variables and
+    attributes are copied from the first file.
+    """
+    sources = [nc.Dataset(filepath, "r") for filepath in filepaths]
+    first   = sources[0]
+    with nc.Dataset(output_filepath, "w", format=first.data_model) as merged:
+        merged.setncatts({name: first.getncattr(name) for name in first.ncattrs()})
+        for name, dimension in first.dimensions.items():
+            if dimension.isunlimited():
+                size = None
+            elif name=="numpoint":
+                size = sum([len(source.dimensions[name]) for source in sources])
+            else:
+                size = len(dimension)
+            merged.createDimension(name, size)
+        for source in sources:
+            source.set_auto_maskandscale(False)
+        for name, variable in first.variables.items():
+            filters    = variable.filters() or {}
+            chunking   = variable.chunking()
+            attributes = {key: variable.getncattr(key) for key in variable.ncattrs() if key!="_FillValue"}
+            output = merged.createVariable(name, variable.datatype, variable.dimensions,
+                                           zlib=filters.get("zlib", False), complevel=filters.get("complevel", 4),
+                                           shuffle=filters.get("shuffle", False),
+                                           chunksizes=None if chunking in [None, "contiguous"] else chunking,
+                                           fill_value=variable.getncattr("_FillValue") if "_FillValue" in variable.ncattrs() else None)
+            output.setncatts(attributes)
+            output.set_auto_maskandscale(False)
+            if "numpoint" in variable.dimensions:
+                axis = variable.dimensions.index("numpoint")
+                output[:] = np.concatenate([source.variables[name][:] for source in sources], axis=axis)
+            elif SUMMED_OUTPUT_VARIABLES.match(name) and ("time" in variable.dimensions):
+                axis = variable.dimensions.index("time")
+                for time_index in range(variable.shape[axis]):
+                    index = tuple([time_index if dim_axis==axis else slice(None) for dim_axis in range(variable.ndim)])
+                    output[index] = np.sum([source.variables[name][index] for source in sources], axis=0)
+            elif SUMMED_OUTPUT_VARIABLES.match(name):
+                output[:] = np.sum([source.variables[name][:] for source in sources], axis=0)
+            else:
+                output[:] = variable[:]
+    for source in sources:
+        source.close()
+
+def find_flexpart_output(working_dir: str) -> Optional[str]:
+    """
+    Returns the most recent NetCDF file written by FLEXPART in the output directory of
+    working_dir, None if there is none.
+    """
+    outputs = glob.glob(f"{working_dir}/output/grid_conc_*.nc") or glob.glob(f"{working_dir}/output/*.nc")
+    return max(outputs, key=os.path.getmtime) if len(outputs)>0 else None
+
+def restart_datetime(config: GirafeConfig) -> datetime.datetime:
+    return config.begin_datetime + datetime.timedelta(hours=config.restart_dump_hours)
+
+def count_dump_particles(filepath: str) -> int:
+    """
+    Returns the number of particles of a FLEXPART particle dump (partposit file): a
+    Fortran unformatted file with a first record holding the time, then one fixed
+    length record per particle and a last record flagging the end of the dump.
+    """
+    size = os.path.getsize(filepath)
+    with open(filepath, "rb") as file:
+        time_record_length = int(np.frombuffer(file.read(4), dtype=np.int32)[0])
+        file.seek(time_record_length+4, os.SEEK_CUR)
+        particle_record_length = int(np.frombuffer(file.read(4), dtype=np.int32)[0])
+    return (size - time_record_length - 8)//(particle_record_length + 8) - 1
+
+def remove_particle_dumps(working_dir: str):
+    """
+    Deletes the particle dumps (partposit files) left by FLEXPART in the output
+    directory, so that they are neither kept nor copied back from the scratch.
+    """
+    for filepath in glob.glob(f"{working_dir}/output/partposit_*"):
+        os.remove(filepath)
+
+def save_particle_dump(config: GirafeConfig, working_dir: str) -> Optional[str]:
+    """
+    Keeps the particle dump written by FLEXPART at config.restart_dump_hours as
+    working_dir/restart/partposit_end, with its date and number of particles in
+    restart.json, for the hot start of the next run. The dumps of the other output
+    times are deleted. Returns the restart directory, None if the dump is missing.
+    """
+    dump_datetime = restart_datetime(config)
+    # With IPOUT=2 (dump_after is the end of the simulation) FLEXPART writes partposit_end
+    if dict(config.command)["IPOUT"].strip()=="2":
+        dump_filepath = f"{working_dir}/output/partposit_end"
+    else:
+        dump_filepath = f"{working_dir}/output/partposit_{dump_datetime.strftime('%Y%m%d%H%M%S')}"
+    if not os.path.exists(dump_filepath):
+        LOGGER.warning(f"FLEXPART did not write the particle dump of {dump_datetime}, the next run will not be able to hot start from this one")
+        remove_particle_dumps(working_dir)
+        return None
+    restart_dir = f"{working_dir}/restart"
+    os.makedirs(restart_dir, exist_ok=True)
+    os.replace(dump_filepath, f"{restart_dir}/partposit_end")
+    if os.path.exists(f"{working_dir}/output/header"):
+        shutil.copy(f"{working_dir}/output/header", f"{restart_dir}/header")
+    remove_particle_dumps(working_dir)
+    Nparticles = count_dump_particles(f"{restart_dir}/partposit_end")
+    with open(f"{restart_dir}/restart.json", "w") as file:
+        json.dump({"date": dump_datetime.strftime("%Y%m%d%H%M%S"), "particles": Nparticles, "species": config.species.strip()}, file, indent=2)
+    LOGGER.info(f"Particle dump of {dump_datetime} ({Nparticles} particles) saved in {restart_dir}")
+    return restart_dir
+
+def read_restart_info(config: GirafeConfig) -> Optional[dict]:
+    """
+    Returns the restart.json of the previous run of config.restart_from if its particle
+    dump matches the start of this simulation, None (with a warning) otherwise.
+    """
+    filepath = f"{config.restart_from}/restart/restart.json"
+    if not os.path.exists(filepath):
+        LOGGER.warning(f"No particle dump in {config.restart_from}, running from scratch")
+        return None
+    with open(filepath, "r") as file:
+        info = json.load(file)
+    if info["date"]!=config.begin_datetime.strftime("%Y%m%d%H%M%S"):
+        LOGGER.warning(f"The particle dump of {config.restart_from} is at {info['date']} instead of the simulation start, running from scratch")
+        return None
+    if info["species"]!=config.species.strip():
+        LOGGER.warning(f"The particle dump of {config.restart_from} is for the species {info['species']}, running from scratch")
+        return None
+    return info
+
+def resolve_hot_start(config: GirafeConfig) -> GirafeConfig:
+    """
+    Switches the run to a hot start (ipIn=1) when the particle dump of the previous
+    run is usable, otherwise drops config.restart_from so the run starts from scratch.
+    """
+    if config.restart_from is None:
+        return config
+    if read_restart_info(config) is None:
+        return replace(config, restart_from=None)
+    return replace(config, command=set_command_value(config.command, "IPIN", "1"))
+
+def load_particle_dump(config: GirafeConfig, working_dir: str) -> int:
+    """
+    Links the particle dump of the previous run in the output directory, where FLEXPART
+    reads it with ipIn=1, and returns its number of particles.
+    """
+    restart_dir = f"{config.restart_from}/restart"
+    for filename in ["partposit_end", "header"]:
+        if os.path.exists(f"{restart_dir}/{filename}"):
+            if os.path.lexists(f"{working_dir}/output/{filename}"):
+                os.remove(f"{working_dir}/output/{filename}")
+            link_or_copy(f"{restart_dir}/{filename}", f"{working_dir}/output/{filename}")
+    info = read_restart_info(config)
+    LOGGER.info(f"Hot start from the particle dump of {config.restart_from} ({info['particles']} particles)")
+    return info["particles"]
+
+def trim_releases_file(filepath: str, start_datetime: datetime.datetime) -> int:
+    """
+    Removes from a RELEASES file the releases ending before start_datetime, whose
+    particles are already in the particle dump of a hot start, and shortens the ones
+    straddling it to their remaining part (mass and particles in proportion). Returns
+    the number of particles left.
+    """
+    header, blocks, _ = split_releases_file(filepath)
+    kept_blocks = []
+    Nparts = 0
+    for block in blocks:
+        fields = dict(re.findall(r"^ (\w+) = (.*),$", block, flags=re.MULTILINE))
+        release_start = datetime.datetime.strptime(fields["IDATE1"]+fields["ITIME1"].zfill(6), "%Y%m%d%H%M%S")
+        release_end   = datetime.datetime.strptime(fields["IDATE2"]+fields["ITIME2"].zfill(6), "%Y%m%d%H%M%S")
+        if release_end <= start_datetime:
+            continue
+        if release_start < start_datetime:
+            fraction = (release_end - start_datetime)/(release_end - release_start)
+            parts    = max(1, int(round(int(fields["PARTS"])*fraction)))
+            block = block.replace(f" IDATE1 = {fields['IDATE1']},\n", f" IDATE1 = {start_datetime.strftime('%Y%m%d')},\n")
+            block = block.replace(f" ITIME1 = {fields['ITIME1']},\n", f" ITIME1 = {start_datetime.strftime('%H%M%S')},\n")
+            block = block.replace(f" MASS = {fields['MASS']},\n", f" MASS = {float(fields['MASS'])*fraction:E},\n")
+            block = block.replace(f" PARTS = {fields['PARTS']},\n", f" PARTS = {parts},\n")
+        kept_blocks.append(block)
+        Nparts = Nparts + int(re.search(r"PARTS = (\d+)", block).group(1))
+    with open(filepath, "w") as file:
+        file.write(header + "".join(kept_blocks))
+    LOGGER.info(f"Hot start: {len(blocks)-len(kept_blocks)} releases before {start_datetime} removed, {len(kept_blocks)} left")
+    return Nparts
+
+def compare_flexpart_outputs(filepath: str, reference_filepath: str) -> pd.DataFrame:
+    """
+    Compares the gridded fields (SUMMED_OUTPUT_VARIABLES) of two FLEXPART NetCDF
+    outputs at their common output times: relative difference of the domain totals and
+    L1 difference normalized by the reference, one row per variable and time.
+    """
+    rows = []
+    with nc.Dataset(filepath, "r") as ds, nc.Dataset(reference_filepath, "r") as reference:
+        times           = nc.num2date(ds["time"][:], ds["time"].units)
+        reference_times = nc.num2date(reference["time"][:], reference["time"].units)
+        common_times    = sorted(set(times) & set(reference_times))
+        for name in ds.variables:
+            if (not SUMMED_OUTPUT_VARIABLES.match(name)) or (name not in reference.variables):
+                continue
+            axis = ds[name].dimensions.index("time")
+            for date in common_times:
+                index           = [slice(None)]*ds[name].ndim
+                index[axis]     = list(times).index(date)
+                field           = np.ma.filled(ds[name][tuple(index)], 0).astype(np.float64)
+                index[axis]     = list(reference_times).index(date)
+                reference_field = np.ma.filled(reference[name][tuple(index)], 0).astype(np.float64)
+                norm = np.abs(reference_field).sum()
+                rows.append({"variable": name,
+                             "time": date.strftime("%Y-%m-%d %H:%M"),
+                             "total_difference": abs(field.sum()-reference_field.sum())/norm if norm>0 else float(field.sum()!=0),
+                             "l1_difference": np.abs(field-reference_field).sum()/norm if norm>0 else float(np.abs(field).sum()!=0)})
+    return pd.DataFrame(rows, columns=["variable", "time", "total_difference", "l1_difference"])
+
+def archive_chunksizes(variable: nc.Variable) -> Optional[list]:
+    """
+    Time-major chunks of a field with a time dimension: one time step (and one index
+    of the dimensions before time), the following dimensions being halved, the first
+    ones first, until the chunk holds at most ARCHIVE_CHUNK_BYTES. None (default
+    chunks) for the other variables.
+    """
+    if ("time" not in variable.dimensions) or (variable.ndim==1):
+        return None
+    axis  = variable.dimensions.index("time")
+    sizes = [1]*(axis+1) + [max(size, 1) for size in variable.shape[axis+1:]]
+    for dim_axis in range(axis+1, len(sizes)):
+        while (int(np.prod(sizes))*variable.dtype.itemsize > ARCHIVE_CHUNK_BYTES) and (sizes[dim_axis]>1):
+            sizes[dim_axis] = (sizes[dim_axis]+1)//2
+    return sizes
+
+def archive_datatype(variable: nc.Variable) -> np.dtype:
+    """
+    Datatype of a variable in the archive: float64 variables whose values are all exact
+    in float32 are packed as float32 (restored by open_flexpart_output()).
+    """
+    if variable.dtype!=np.float64:
+        return variable.dtype
+    values = variable[:]
+    return np.dtype(np.float32) if np.array_equal(values.astype(np.float32).astype(np.float64), values, equal_nan=True) else variable.dtype
+
+def time_steps(variable: nc.Variable) -> list:
+    """
+    Index tuples reading a variable one time step at a time (the whole variable when it
+    has no time dimension).
+    """
+    if "time" not in variable.dimensions:
+        return [tuple([slice(None)]*variable.ndim)]
+    axis = variable.dimensions.index("time")
+    return [tuple([time_index if dim_axis==axis else slice(None) for dim_axis in range(variable.ndim)]) for time_index in range(variable.shape[axis])]
+
+def archive_flexpart_output(filepath: str, output_filepath: str, complevel: int=4, sparse: bool=False) -> None:
+    """
+    Rewrites a FLEXPART NetCDF output as NetCDF4 with deflate (complevel) and shuffle
+    compression and time-major chunks (see archive_chunksizes()), copying one time
+    step at a time. Values are copied bit for bit, float64 variables exact in float32
+    being packed as float32.
+    When sparse is True, the gridded fields (SUMMED_OUTPUT_VARIABLES) only keep their
+    non-zero cells (non-fill when they have a _FillValue): the variable holds the
+    values along a <name>_nnz dimension, with <name>_index the flat (C order) indices
+    of the cells in the dense shape, saved in the sparse_dimensions and sparse_shape
+    attributes. open_flexpart_output() reads both forms as the same xarray Dataset as
+    the original output.
+    """
+    with nc.Dataset(filepath, "r") as source, nc.Dataset(output_filepath, "w", format="NETCDF4") as archive:
+        source.set_auto_maskandscale(False)
+        archive.setncatts({name: source.getncattr(name) for name in source.ncattrs()})
+        archive.setncattr("girafe_archive", "sparse" if sparse else "dense")
+        for name, dimension in source.dimensions.items():
+            archive.createDimension(name, None if dimension.isunlimited() else len(dimension))
+        for name, variable in source.variables.items():
+            attributes = {key: variable.getncattr(key) for key in variable.ncattrs() if key!="_FillValue"}
+            fill_value = variable.getncattr("_FillValue") if "_FillValue" in variable.ncattrs() else None
+            datatype   = archive_datatype(variable)
+            if datatype!=variable.dtype:
+                attributes["girafe_dtype"] = str(variable.dtype)
+                fill_value = None if fill_value is None else datatype.type(fill_value)
+            if sparse and SUMMED_OUTPUT_VARIABLES.match(name) and ("time" in variable.dimensions):
+                background = 0 if fill_value is None else fill_value
+                archive.createDimension(f"{name}_nnz", None)
+                index_type = np.int32 if int(np.prod(variable.shape))<2**31 else np.int64
+                indices = archive.createVariable(f"{name}_index", index_type, (f"{name}_nnz",), zlib=True, complevel=complevel, shuffle=True)
+                values  = archive.createVariable(name, datatype, (f"{name}_nnz",), zlib=True, complevel=complevel, shuffle=True)
+                attributes.update({"sparse_dimensions": " ".join(variable.dimensions), "sparse_shape": np.array(variable.shape, dtype=np.int64)})
+                if fill_value is not None:
+                    attributes["sparse_fill_value"] = fill_value
+                values.setncatts(attributes)
+                axis, Nnz = variable.dimensions.index("time"), 0
+                for index in time_steps(variable):
+                    block  = variable[index]
+                    cells  = list(np.nonzero(block!=background))
+                    cells.insert(axis, np.full(len(cells[0]), index[axis], dtype=np.int64))
+                    indices[Nnz:Nnz+len(cells[0])] = np.ravel_multi_index(cells, variable.shape).astype(index_type)
+                    values[Nnz:Nnz+len(cells[0])]  = block[block!=background].astype(datatype)
+                    Nnz = Nnz + len(cells[0])
+                continue
+            output = archive.createVariable(name, datatype, variable.dimensions, zlib=True, complevel=complevel, shuffle=True,
+                                            chunksizes=archive_chunksizes(variable), fill_value=fill_value)
+            output.setncatts(attributes)
+            output.set_auto_maskandscale(False)
+            for index in time_steps(variable):
+                output[index] = variable[index].astype(datatype)
+
+def open_flexpart_output(filepath: str) -> xr.Dataset:
+    """
+    Opens a FLEXPART NetCDF output, or its dense or sparse archive written by
+    archive_flexpart_output(), as the same decoded xarray Dataset. The fields of a
+    sparse archive are rebuilt in memory.
+    """
+    ds = xr.open_dataset(filepath, decode_cf=False)
+    if ds.attrs.get("girafe_archive")=="sparse":
+        for name in [name for name in ds.variables if "sparse_shape" in ds[name].attrs]:
+            attributes = dict(ds[name].attrs)
+            shape      = tuple(int(size) for size in attributes.pop("sparse_shape"))
+            dimensions = attributes.pop("sparse_dimensions").split(" ")
+            if "sparse_fill_value" in attributes:
+                attributes["_FillValue"] = attributes.pop("sparse_fill_value")
+            dense = np.full(shape, attributes.get("_FillValue", 0), dtype=ds[name].dtype)
+            dense.flat[ds[f"{name}_index"].values] = ds[name].values
+            ds = ds.drop_vars([name, f"{name}_index"]).assign({name: xr.Variable(dimensions, dense, attributes)})
+    for name in [name for name in ds.variables if "girafe_dtype" in ds[name].attrs]:
+        attributes = dict(ds[name].attrs)
+        datatype   = np.dtype(attributes.pop("girafe_dtype"))
+        if "_FillValue" in attributes:
+            attributes["_FillValue"] = datatype.type(attributes["_FillValue"])
+        ds[name] = xr.Variable(ds[name].dims, ds[name].values.astype(datatype), attributes)
+    ds.attrs.pop("girafe_archive", None)
+    return xr.decode_cf(ds)
+
+def read_points_file(filepath: str) -> pd.DataFrame:
+    """
+    Reads a CSV file of points with latitude, longitude and height (m above ground)
+    columns, and an optional name column (default: row number).
+    """
+    points = pd.read_csv(filepath)
+    missing = [column for column in ["latitude", "longitude", "height"] if column not in points.columns]
+    if len(missing)>0:
+        LOGGER.error(f"{os.path.basename(filepath)} misses the {', '.join(missing)} columns")
+        sys.exit(1)
+    if "name" not in points.columns:
+        points["name"] = points.index.astype(str)
+    return points[["name", "latitude", "longitude", "height"]]
+
+def map_points_to_grid(points: pd.DataFrame, lat: np.ndarray, lon: np.ndarray, height: np.ndarray) -> np.ndarray:
+    """
+    Returns the (height, latitude, longitude) indices of the output grid cells holding
+    the points, one row per point, -1 when the point is outside the grid. The height
+    levels are the tops of the output layers.
+    """
+    height_index = np.searchsorted(height, points["height"].to_numpy(np.float64), side="left")
+    height_index = np.where((height_index<len(height)) & (points["height"].to_numpy(np.float64)>=0), height_index, -1)
+    return np.stack([height_index,
+                     grid_cell_indices(points["latitude"].to_numpy(np.float64), lat),
+                     grid_cell_indices(points["longitude"].to_numpy(np.float64), lon, period=360.0)], axis=1)
+
+def load_point_indices(points: pd.DataFrame, lat: np.ndarray, lon: np.ndarray, height: np.ndarray, cache: dict, cache_dir: str=None) -> np.ndarray:
+    """
+    map_points_to_grid() cached by output grid (OUTGRID) and points, in cache for the
+    outputs of one query and in cache_dir (points_<key>.npy) across queries.
+    """
+    grid_key   = hashlib.sha256(b"".join([np.asarray(array, dtype=np.float64).tobytes() for array in [lat, lon, height]])).hexdigest()[:16]
+    points_key = hashlib.sha256(points[["latitude", "longitude", "height"]].to_numpy(np.float64).tobytes()).hexdigest()[:16]
+    key = f"{grid_key}_{points_key}"
+    if key in cache:
+        return cache[key]
+    cache_filepath = None if cache_dir is None else f"{cache_dir}/points_{key}.npy"
+    if (cache_filepath is not None) and os.path.exists(cache_filepath):
+        cache[key] = np.load(cache_filepath)
+        return cache[key]
+    cache[key] = map_points_to_grid(points, lat, lon, height)
+    if cache_filepath is not None:
+        os.makedirs(cache_dir, exist_ok=True)
+        np.save(f"{cache_filepath}.{os.getpid()}.tmp.npy", cache[key])
+        os.replace(f"{cache_filepath}.{os.getpid()}.tmp.npy", cache_filepath)
+    return cache[key]
+
+def read_dense_points(variable: nc.Variable, cells: np.ndarray) -> np.ndarray:
+    """
+    Reads the values of a gridded variable at the cells (one row of indices along its
+    grid dimensions per point), for all the indices of its other dimensions, which come
+    first in the returned array (the points being the last axis). The variable is read
+    one chunk (or, when contiguous, one time step) at a time, only where there are
+    points.
+    """
+    grid_axes  = [axis for axis, name in enumerate(variable.dimensions) if name in ["height", "latitude", "longitude"]]
+    other_axes = [axis for axis in range(variable.ndim) if axis not in grid_axes]
+    chunking   = variable.chunking()
+    if chunking in [None, "contiguous"]:
+        chunking = [1 if (name=="time") or (axis<variable.dimensions.index("time")) else size
+                    for axis, (name, size) in enumerate(zip(variable.dimensions, variable.shape))]
+    values = np.zeros([variable.shape[axis] for axis in other_axes]+[len(cells)], dtype=np.float64)
+    if len(cells)==0:
+        return values
+    grid_chunks = np.array([chunking[axis] for axis in grid_axes])
+    chunk_ids, point_chunks = np.unique(cells//grid_chunks, axis=0, return_inverse=True)
+    time_axis  = variable.dimensions.index("time")
+    time_chunk = chunking[time_axis]
+    for time_start in range(0, variable.shape[time_axis], time_chunk):
+        time_slice = slice(time_start, min(time_start+time_chunk, variable.shape[time_axis]))
+        for chunk_index, chunk_id in enumerate(chunk_ids):
+            index = [slice(None)]*variable.ndim
+            index[time_axis] = time_slice
+            for axis, chunk_size, chunk_start in zip(grid_axes, grid_chunks, chunk_id*grid_chunks):
+                index[axis] = slice(chunk_start, chunk_start+chunk_size)
+            in_chunk = np.flatnonzero(point_chunks.ravel()==chunk_index)
+            block    = np.moveaxis(ma.filled(variable[tuple(index)], 0), grid_axes, list(range(variable.ndim-len(grid_axes), variable.ndim)))
+            local    = tuple((cells[in_chunk]-chunk_id*grid_chunks).T)
+            target   = [slice(None)]*len(other_axes)
+            target[other_axes.index(time_axis)] = time_slice
+            values[tuple(target)+(in_chunk,)] = block[(Ellipsis,)+local]
+    return values
+
+def read_sparse_points(ds: nc.Dataset, name: str, cells: np.ndarray) -> np.ndarray:
+    """
+    Same as read_dense_points() for a gridded variable of a sparse archive (see
+    archive_flexpart_output()): the cells are looked up in its flat indices.
+    """
+    variable   = ds.variables[name]
+    shape      = tuple(int(size) for size in variable.getncattr("sparse_shape"))
+    dimensions = variable.getncattr("sparse_dimensions").split(" ")
+    grid_axes  = [axis for axis, dim in enumerate(dimensions) if dim in ["height", "latitude", "longitude"]]
+    other_axes = [axis for axis in range(len(shape)) if axis not in grid_axes]
+    flat_index = ds.variables[f"{name}_index"][:].astype(np.int64)
+    order      = np.argsort(flat_index, kind="stable")
+    flat_index = flat_index[order]
+    stored     = ma.filled(variable[:], 0).astype(np.float64)[order]
+    # Indices of every (other dimensions..., point) combination in the dense shape
+    others  = np.indices([shape[axis] for axis in other_axes]+[len(cells)]).reshape(len(other_axes)+1, -1)
+    indices = [None]*len(shape)
+    for position, axis in enumerate(other_axes):
+        indices[axis] = others[position]
+    for position, axis in enumerate(grid_axes):
+        indices[axis] = cells[others[-1], position]
+    values = np.zeros(others.shape[1], dtype=np.float64)
+    if len(flat_index)>0:
+        wanted   = np.ravel_multi_index(indices, shape)
+        position = np.minimum(np.searchsorted(flat_index, wanted), len(flat_index)-1)
+        values   = np.where(flat_index[position]==wanted, stored[position], 0.0)
+    return values.reshape([shape[axis] for axis in other_axes]+[len(cells)])
+
+def extract_points(filepaths: list, points: pd.DataFrame, cache_dir: str=None) -> pd.DataFrame:
+    """
+    Extracts the gridded fields (SUMMED_OUTPUT_VARIABLES) of FLEXPART outputs, or of
+    their archives, at points (see read_points_file()), for all the output times, as a
+    tidy table with one row per file, point, time, variable, age class and pointspec.
+    The points are mapped to the grid cells once per output grid (see
+    load_point_indices()) and only the chunks holding points are read. The height of
+    the points is ignored for the fields without height (deposition). Points outside
+    the output grid are left out.
+    """
+    cache, tables = {}, []
+    for filepath in filepaths:
+        with nc.Dataset(filepath, "r") as ds:
+            lat    = np.array(ds.variables["latitude"][:])
+            lon    = np.array(ds.variables["longitude"][:])
+            height = np.array(ds.variables["height"][:])
+            times  = pd.to_datetime(nc.num2date(ds.variables["time"][:], ds.variables["time"].units,
+                                                only_use_cftime_datetimes=False, only_use_python_datetimes=True))
+            cells  = load_point_indices(points, lat, lon, height, cache, cache_dir)
+            sparse = "girafe_archive" in ds.ncattrs() and ds.getncattr("girafe_archive")=="sparse"
+            for name, variable in ds.variables.items():
+                if not SUMMED_OUTPUT_VARIABLES.match(name):
+                    continue
+                dimensions = variable.getncattr("sparse_dimensions").split(" ") if sparse else list(variable.dimensions)
+                grid_axes  = [position for position, dim in enumerate(["height", "latitude", "longitude"]) if dim in dimensions]
+                inside     = np.flatnonzero((cells[:, grid_axes]>=0).all(axis=1))
+                if sparse:
+                    values = read_sparse_points(ds, name, cells[inside][:, grid_axes])
+                else:
+                    values = read_dense_points(variable, cells[inside][:, grid_axes])
+                other_dims = [dim for dim in dimensions if dim not in ["height", "latitude", "longitude"]]
+                indices    = np.indices(values.shape).reshape(values.ndim, -1)
+                table = pd.DataFrame({dim: indices[position] for position, dim in enumerate(other_dims)})
+                table["point"]    = inside[indices[-1]]
+                table["time"]     = times[table["time"].to_numpy()]
+                table["variable"] = name
+                table["value"]    = values.ravel()
+                table["file"]     = filepath
+                tables.append(table)
+        outside = len(points)-len(np.flatnonzero((cells>=0).all(axis=1)))
+        if outside>0:
+            LOGGER.warning(f"{outside} points are outside the output grid of {os.path.basename(filepath)}")
+    if len(tables)==0:
+        return pd.DataFrame(columns=["file", "name", "latitude", "longitude", "height", "time", "variable", "nageclass", "pointspec", "value"])
+    table = pd.concat(tables, ignore_index=True)
+    table = table.join(points.reset_index(drop=True), on="point")
+    columns = ["file", "name", "latitude", "longitude", "height", "time", "variable"] + \
+              [column for column in ["nageclass", "pointspec"] if column in table.columns] + ["value"]
+    return table[columns]
+
+STAGES = ["available", "options", "releases", "sources", "compile", "run", "quicklooks", "tiles", "archive"]
+
+# Last stage run by each subcommand of the command line, None for the ones running no stage
+SUBCOMMAND_STAGES = {"validate": None,
+                     "plan": None,
+                     "prepare": "releases",
+                     "compile": "compile",
+                     "run": "run",
+                     "plot": "quicklooks",
+                     "tiles": "tiles",
+                     "archive": "archive"}
+
+STAGE_MANIFEST_FILENAME = "girafe_manifest.json"
+
+FINGERPRINT_CONTENT_MAX_SIZE = 64*1024**2 # bytes, larger files are fingerprinted by size and modification time
+
+def sha256_file(filepath: str) -> str:
+    sha = hashlib.sha256()
+    with open(filepath, "rb") as file:
+        for block in iter(lambda: file.read(1024**2), b""):
+            sha.update(block)
+    return sha.hexdigest()
+
+def fingerprint_file(filepath: str) -> Optional[str]:
+    """
+    Returns the sha256 of the content of a file, or its size and modification time when
+    it is larger than FINGERPRINT_CONTENT_MAX_SIZE (ECMWF files, FLEXPART outputs).
+    None if the file does not exist.
+    """
+    if not os.path.exists(filepath):
+        return None
+    stat = os.stat(filepath)
+    if stat.st_size > FINGERPRINT_CONTENT_MAX_SIZE:
+        return f"{stat.st_size}:{stat.st_mtime_ns}"
+    return sha256_file(filepath)
+
+def hash_stage_inputs(values: dict) -> str:
+    return hashlib.sha256(json.dumps(values, sort_keys=True, default=str).encode()).hexdigest()
+
+def load_stage_manifest(working_dir: str) -> dict:
+    filepath = f"{working_dir}/{STAGE_MANIFEST_FILENAME}"
+    if not os.path.exists(filepath):
+        return {}
+    try:
+        with open(filepath, "r") as file:
+            return json.load(file)
+    except ValueError:
+        LOGGER.warning(f"Unreadable stage manifest {filepath}, every stage will be run")
+        return {}
+
+def record_stage(working_dir: str, manifest: dict, stage: str, inputs: str, outputs: list, values: dict=None) -> None:
+    """
+    Records in the manifest of working_dir the inputs hash, the fingerprints of the
+    outputs and the values (particles, partitions...) of a completed stage.
+    """
+    manifest[stage] = {"inputs": inputs,
+                       "outputs": {filepath: fingerprint_file(filepath) for filepath in outputs},
+                       "values": values or {},
+                       "date": datetime.datetime.now().isoformat(timespec="seconds")}
+    filepath = f"{working_dir}/{STAGE_MANIFEST_FILENAME}"
+    with open(f"{filepath}.{os.getpid()}.tmp", "w") as file:
+        json.dump(manifest, file, indent=2)
+    os.replace(f"{filepath}.{os.getpid()}.tmp", filepath)
+
+def stage_is_current(manifest: dict, stage: str, inputs: str) -> bool:
+    """
+    True when the stage completed with the same inputs hash and its outputs are still
+    unchanged on disk.
+    """
+    record = manifest.get(stage)
+    if (record is None) or (record["inputs"]!=inputs):
+        return False
+    return all([fingerprint_file(filepath)==fingerprint for filepath, fingerprint in record["outputs"].items()])
+
+def stage_outputs_hash(manifest: dict, stages: list) -> dict:
+    return {stage: manifest.get(stage, {}).get("outputs") for stage in stages}
+
+def stat_files(filepaths: list) -> list:
+    return [(filepath, os.stat(filepath).st_size, os.stat(filepath).st_mtime_ns) if os.path.exists(filepath) else (filepath, None, None)
+            for filepath in filepaths]
+
+def emissions_fingerprint(config: GirafeConfig) -> list:
+    if is_fire_store(config.emissions):
+        return [fingerprint_file(f"{config.emissions}/fire_store.json")]
+    return stat_files([config.emissions])
+
+def read_process_io() -> dict:
+    """
+    Returns the I/O counters of the process and of its waited-for children from
+    /proc/self/io: rchar and wchar count every byte read and written (page cache
+    included), read_bytes and write_bytes only the ones going to the storage. Empty
+    when /proc is not available.
+    """
+    try:
+        with open("/proc/self/io", "r") as file:
+            return {key: int(value) for key, value in [line.split(":") for line in file if ":" in line]}
+    except (OSError, ValueError):
+        return {}
+
+def read_peak_rss() -> int:
+    """
+    Returns the peak resident memory (bytes) of the process since the last
+    reset_peak_rss(), or since its start without /proc.
+    """
+    try:
+        with open("/proc/self/status", "r") as file:
+            for line in file:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1])*1024
+    except (OSError, ValueError):
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss*1024
+
+def reset_peak_rss() -> None:
+    # Resets VmHWM to the current resident memory (Linux >= 4.0)
+    try:
+        with open("/proc/self/clear_refs", "w") as file:
+            file.write("5")
+    except OSError:
+        pass
+
+PROMETHEUS_STAGE_METRICS = [("wall_time", "girafe_stage_wall_seconds", "Wall time of the stage."),
+                            ("cpu_time", "girafe_stage_cpu_seconds", "User and system time of the stage, subprocesses included."),
+                            ("peak_rss", "girafe_stage_peak_rss_bytes", "Peak resident memory of the GIRAFE process during the stage."),
+                            ("flexpart_cpu_time", "girafe_stage_flexpart_cpu_seconds", "User and system time of the FLEXPART processes."),
+                            ("flexpart_peak_rss", "girafe_stage_flexpart_peak_rss_bytes", "Peak resident memory of the largest FLEXPART process."),
+                            ("read_bytes", "girafe_stage_read_bytes", "Bytes read by the stage, subprocesses included."),
+                            ("written_bytes", "girafe_stage_written_bytes", "Bytes written by the stage, subprocesses included.")]
+
+def prometheus_label(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+def write_prometheus_textfile(filepath: str, metrics: dict) -> None:
+    """
+    Writes the run metrics in the Prometheus text format, for the textfile collector of
+    the node exporter, through a temporary file so that the collector never reads a
+    partial file. Every sample is labelled with the configuration file name and the
+    stage; the counts of a stage are girafe_stage_count samples labelled by name.
+    """
+    simulation = prometheus_label(os.path.splitext(os.path.basename(metrics["config"]))[0])
+    stages = {stage: values for stage, values in metrics["stages"].items() if values["status"]!="skipped"}
+    lines  = []
+    for key, name, description in PROMETHEUS_STAGE_METRICS:
+        lines += [f"# HELP {name} {description}", f"# TYPE {name} gauge"]
+        lines += [f"{name}{{simulation=\"{simulation}\",stage=\"{stage}\"}} {values[key]}" for stage, values in stages.items() if values.get(key) is not None]
+    lines += ["# HELP girafe_stage_success 1 if the stage completed, 0 if it failed.", "# TYPE girafe_stage_success gauge"]
+    lines += [f"girafe_stage_success{{simulation=\"{simulation}\",stage=\"{stage}\"}} {int(values['status']=='done')}" for stage, values in stages.items()]
+    lines += ["# HELP girafe_stage_count Releases, particles, frames... handled by the stage.", "# TYPE girafe_stage_count gauge"]
+    lines += [f"girafe_stage_count{{simulation=\"{simulation}\",stage=\"{stage}\",count=\"{prometheus_label(key)}\"}} {value}"
+              for stage, values in stages.items() for key, value in values["counts"].items() if isinstance(value, (int, float))]
+    lines += ["# HELP girafe_run_end_timestamp_seconds Time of the last update of the run metrics.", "# TYPE girafe_run_end_timestamp_seconds gauge",
+              f"girafe_run_end_timestamp_seconds{{simulation=\"{simulation}\"}} {datetime.datetime.fromisoformat(metrics['end']).timestamp():.0f}"]
+    tmp_filepath = f"{filepath}.{os.getpid()}.tmp"
+    with open(tmp_filepath, "w") as file:
+        file.write("\n".join(lines)+"\n")
+    os.replace(tmp_filepath, filepath)
+
+def save_run_metrics(config: GirafeConfig, metrics: dict) -> None:
+    """
+    Writes the run metrics in run_metrics.json in the working directory and, when the
+    configuration has a <paths/prometheus_textfile>, in that Prometheus textfile.
+    """
+    metrics["end"]   = datetime.datetime.now().isoformat(timespec="seconds")
+    metrics["total"] = {key: sum([values.get(key, 0.0) for values in metrics["stages"].values()]) for key in ["wall_time", "cpu_time"]}
+    filepath = f"{config.working_dir}/{RUN_METRICS_FILENAME}"
+    with open(f"{filepath}.{os.getpid()}.tmp", "w") as file:
+        json.dump(metrics, file, indent=2)
+    os.replace(f"{filepath}.{os.getpid()}.tmp", filepath)
+    if config.prometheus_textfile is not None:
+        try:
+            write_prometheus_textfile(config.prometheus_textfile, metrics)
+        except OSError as error:
+            LOGGER.warning(f"Could not write the Prometheus textfile {config.prometheus_textfile} ({error})")
+
+@contextlib.contextmanager
+def measure_stage(config: GirafeConfig, metrics: dict, stage: str):
+    """
+    Measures the wall time, CPU time (subprocesses included), peak resident memory of
+    the process and bytes read and written (subprocesses included) of the block of a
+    stage. The block adds its counts (releases, particles, frames...) to the "counts"
+    of the yielded dictionary, and other measures (peak memory of FLEXPART) to it. The
+    measures are added to metrics and saved (see save_run_metrics()) when the block
+    ends, also when it fails.
+    """
+    measures = {"counts": {}}
+    reset_peak_rss()
+    usage, children = resource.getrusage(resource.RUSAGE_SELF), resource.getrusage(resource.RUSAGE_CHILDREN)
+    io_counters = read_process_io()
+    start  = time.monotonic()
+    status = "failed"
+    try:
+        yield measures
+        status = "done"
+    finally:
+        new_usage, new_children = resource.getrusage(resource.RUSAGE_SELF), resource.getrusage(resource.RUSAGE_CHILDREN)
+        new_io_counters = read_process_io()
+        metrics["stages"][stage] = {"status": status,
+                                    "wall_time": time.monotonic()-start,
+                                    "cpu_time": sum([new.ru_utime+new.ru_stime-old.ru_utime-old.ru_stime
+                                                     for new, old in [(new_usage, usage), (new_children, children)]]),
+                                    "peak_rss": read_peak_rss(),
+                                    "read_bytes": new_io_counters.get("rchar", 0)-io_counters.get("rchar", 0) if len(io_counters)>0 else None,
+                                    "written_bytes": new_io_counters.get("wchar", 0)-io_counters.get("wchar", 0) if len(io_counters)>0 else None,
+                                    "disk_read_bytes": new_io_counters.get("read_bytes", 0)-io_counters.get("read_bytes", 0) if len(io_counters)>0 else None,
+                                    "disk_written_bytes": new_io_counters.get("write_bytes", 0)-io_counters.get("write_bytes", 0) if len(io_counters)>0 else None,
+                                    **measures}
+        save_run_metrics(config, metrics)
+
+def run_girafe_stages(config: GirafeConfig, from_stage: str=None, only_stage: str=None, to_stage: str=None, on_output=None) -> Optional[RunResult]:
+    """
+    Prepares the inputs, compiles and runs FLEXPART and plots the quicklooks of one
+    simulation in config.working_dir, then writes the web-map tiles (<tiles> node) and
+    the compressed archives of the output (<archive> node). Each stage records its
+    inputs hash and outputs in the girafe_manifest.json of the working directory and
+    is skipped on the next run when they are unchanged. Every stage from from_stage
+    onwards is run anyway, and only only_stage is run when it is given (the previous
+    stages must be recorded). The wall time, CPU time, peak memory, I/O and counts of
+    the stages run are saved in run_metrics.json (see measure_stage()).
+    The stages after to_stage are not run, and None is returned if it is before the
+    FLEXPART run. on_output, if given, is called with the FLEXPART output once it is
+    available.
+    """
+    wdir = config.working_dir
+
+    status = prepare_working_dir(wdir)
+    if status!=0:
+        LOGGER.error("Something went wrong...")
+        sys.exit(1)
+
+    config   = resolve_hot_start(config)
+    manifest = load_stage_manifest(wdir)
+    metrics  = {"config": config.filepath, "working_dir": wdir, "start": datetime.datetime.now().isoformat(timespec="seconds"), "stages": {}}
+
+    def stage_needed(stage: str, inputs: str) -> bool:
+        if only_stage is not None:
+            needed = stage==only_stage
+        elif (from_stage is not None) and (STAGES.index(stage)>=STAGES.index(from_stage)):
+            needed = True
+        else:
+            needed = not stage_is_current(manifest, stage, inputs)
+        if not needed:
+            if stage not in manifest:
+                LOGGER.error(f"The {stage} stage was never run in {wdir}, it cannot be skipped")
+                sys.exit(1)
+            LOGGER.info(f"Skipping the {stage} stage, its inputs are unchanged since {manifest[stage]['date']}")
+            metrics["stages"][stage] = {"status": "skipped"}
+        return needed
+
+    def last_stage(stage: str) -> bool:
+        return (to_stage is not None) and (STAGES.index(stage)>=STAGES.index(to_stage))
+
+    # *************************************************************************************************
+    ecmwf_files = [f"{config.ecmwf_dir}/{filename}" for _, filename in get_ECMWF_files(config)]
+    inputs = hash_stage_inputs({"begin": config.begin_datetime, "end": config.end_datetime, "dtime": config.dtime,
+                                "par_mod": dict(config.par_mod), "ecmwf_files": stat_files(ecmwf_files)})
+    if stage_needed("available", inputs):
+        with measure_stage(config, metrics, "available") as measures:
+            write_available_file(config,wdir)
+            status = check_ECMWF_pool(config)
+            if status!=0:
+                LOGGER.error("Some of the ECMWF files are missing or invalid in your indicated directory, please check your data and configuration file and retry again.")
+                sys.exit(1)
+            record_stage(wdir, manifest, "available", inputs, [f"{wdir}/AVAILABLE"])
+            measures["counts"]["ecmwf_files"] = len(ecmwf_files)
+
+    # *************************************************************************************************
+    inputs = hash_stage_inputs({"command": config.command, "outgrid": config.outgrid, "receptors": config.receptors,
+                                "ageclass": config.ageclass, "ecmwf_dir": config.ecmwf_dir})
+    if stage_needed("options", inputs):
+        with measure_stage(config, metrics, "options") as measures:
+            write_pathnames_file(config,wdir)
+            write_command_file(config,wdir)
+            write_outgrid_file(config,wdir)
+            write_receptors_file(config,wdir)
+            write_ageclasses_file(config,wdir)
+            record_stage(wdir, manifest, "options", inputs, [f"{wdir}/{filename}" for filename in ["pathnames", "options/COMMAND", "options/OUTGRID",
+                                                                                                  "options/RECEPTORS", "options/AGECLASS"]])
+            measures["counts"]["receptors"] = len(config.receptors)
+
+    # *************************************************************************************************
+    inputs = hash_stage_inputs({"species": config.species, "fire_confidence": config.fire_confidence, "releases": config.releases,
+                                "emissions": config.emissions, "emissions_variable": config.emissions_variable,
+                                "emissions_fingerprint": emissions_fingerprint(config), "particle_budget": config.particle_budget,
+                                "aggregation_resolution": config.aggregation_resolution, "partitions": config.partitions,
+                                "command": config.command, "restart_from": config.restart_from})
+    if stage_needed("releases", inputs):
+        with measure_stage(config, metrics, "releases") as measures:
+            Nparts = write_releases_file(config,wdir)
+            if config.restart_from is not None:
+                Nparts = trim_releases_file(f"{wdir}/options/RELEASES", config.begin_datetime)
+            check_number_parts(Nparts)
+            partitions = []
+            if release_partitioning_enabled(config):
+                partitions = prepare_release_partitions(config, wdir)
+            elif config.partitions>1:
+                LOGGER.warning("Release partitioning needs the NetCDF output (IOUT>=8) without output for each release (iOfr=0), running a single FLEXPART process")
+            outputs = [f"{wdir}/options/RELEASES"] + [f"{partition_dir}/{filename}" for partition_dir, _ in partitions for filename in ["options/RELEASES", "pathnames"]]
+            record_stage(wdir, manifest, "releases", inputs, outputs, {"Nparts": Nparts, "partitions": partitions})
+            with open(f"{wdir}/options/RELEASES", "r") as file:
+                measures["counts"]["releases"] = sum([line=="&RELEASE\n" for line in file])
+            measures["counts"].update({"particles": Nparts, "partitions": len(partitions)})
+    Nparts     = manifest["releases"]["values"]["Nparts"]
+    partitions = [tuple(partition) for partition in manifest["releases"]["values"]["partitions"]]
+    if len(partitions)>0:
+        # One executable for all the partitions, sized for the largest one
+        Nparts = max([Nparts for _, Nparts in partitions])
+    if config.restart_from is not None:
+        Nparts = Nparts + load_particle_dump(config, wdir)
+    if last_stage("releases"):
+        return None
+
+    # *************************************************************************************************
+    source_files = list_flexpart_sources()
+    inputs = hash_stage_inputs({"sources": stat_files([f"{FLEXPART_ROOT}/src/{filename}" for filename in source_files])})
+    if stage_needed("sources", inputs):
+        with measure_stage(config, metrics, "sources") as measures:
+            status = copy_source_files(wdir)
+            if status==1:
+                LOGGER.error("Something went wrong during source files copy...")
+                sys.exit(1)
+            # par_mod.f90 is rewritten by the compile stage
+            record_stage(wdir, manifest, "sources", inputs, [f"{wdir}/flexpart_src/{filename}" for filename in source_files if filename!="par_mod.f90"])
+            measures["counts"]["files"] = len(source_files)
+
+    # *************************************************************************************************
+    mpi = config.mpi_ranks is not None
+    if (only_stage is None) or (only_stage=="compile"):
+        dimensions = get_par_mod_dimensions(config)
+        if dimensions is None:
+            LOGGER.error("The first ECMWF file of the simulation is missing or invalid, par_mod.f90 cannot be sized without nxmax, nymax, nuvzmax, nwzmax and nzmax in <par_mod_parameters>")
+            sys.exit(1)
+        write_par_mod_file(config,wdir,Nparts,dimensions)
+    inputs = hash_stage_inputs({"sources": hash_flexpart_sources(f"{wdir}/flexpart_src", ["make", "mpi", "ncf=yes"] if mpi else ["make", "ncf=yes"])})
+    if stage_needed("compile", inputs):
+        with measure_stage(config, metrics, "compile") as measures:
+            status = compile_flexpart(wdir, config.build_cache_dir, mpi=mpi)
+            if status!=0:
+                LOGGER.error(f"Something went wrong during compilation, check log information in the {wdir}/flexpart_compile.out")
+                sys.exit(1)
+            record_stage(wdir, manifest, "compile", inputs, [f"{wdir}/{config.flexpart_executable}"])
+            measures["counts"]["executable_bytes"] = os.path.getsize(f"{wdir}/{config.flexpart_executable}")
+    if last_stage("compile"):
+        return None
+
+    # *************************************************************************************************
+    inputs = hash_stage_inputs({"mpi_ranks": config.mpi_ranks, "restart_dump_hours": config.restart_dump_hours,
+                                "restart": None if config.restart_from is None else fingerprint_file(f"{config.restart_from}/restart/restart.json"),
+                                "stages": stage_outputs_hash(manifest, ["available", "options", "releases", "compile"])})
+    if stage_needed("run", inputs):
+        with measure_stage(config, metrics, "run") as measures:
+            if len(partitions)>0:
+                LOGGER.info(f"Launching FLEXPART in {len(partitions)} partitions")
+                result = run_release_partitions(config, wdir, [partition_dir for partition_dir, _ in partitions])
+            else:
+                LOGGER.info(f"Launching {config.flexpart_executable}" + ("" if config.mpi_ranks is None else f" on {config.mpi_ranks} MPI ranks"))
+                result = launch_flexpart(config, wdir)
+            LOGGER.info(f"FLEXPART {result.status} in {result.wall_time/60:.1f} min, {result.simulated_seconds/3600:.1f} simulated hours")
+            measures["counts"].update({"simulated_seconds": result.simulated_seconds, "particles": result.particles})
+            measures.update({"flexpart_cpu_time": result.cpu_time, "flexpart_peak_rss": result.peak_rss})
+            if (config.restart_dump_hours is not None) and (result.status!="finished"):
+                # The dumps of an unfinished run are never used for a hot start
+                remove_particle_dumps(wdir)
+            if result.status in ["timeout", "stalled"]:
+                LOGGER.error(f"FLEXPART run {result.status}, check {result.log_filepath}")
+                sys.exit(1)
+            flexpart_output = find_flexpart_output(wdir)
+            if flexpart_output is None:
+                LOGGER.error("Something went wrong with the simulation, check the FLEXPART output for more information.")
+                sys.exit(1)
+            measures["counts"]["output_bytes"] = os.path.getsize(flexpart_output)
+            if result.status=="finished":
+                restart_dir = None if config.restart_dump_hours is None else save_particle_dump(config, wdir)
+                outputs = [flexpart_output] + ([] if restart_dir is None else [f"{restart_dir}/partposit_end"])
+                record_stage(wdir, manifest, "run", inputs, outputs, {"result": vars(result), "output": flexpart_output})
+            else:
+                manifest.pop("run", None)
+    else:
+        result          = RunResult(**manifest["run"]["values"]["result"])
+        flexpart_output = manifest["run"]["values"]["output"]
+    if on_output is not None:
+        on_output(flexpart_output)
+    if last_stage("run"):
+        return result
+
+    # *************************************************************************************************
+    inputs = hash_stage_inputs({"output": {flexpart_output: fingerprint_file(flexpart_output)}})
+    if stage_needed("quicklooks", inputs):
+        with measure_stage(config, metrics, "quicklooks") as measures:
+            if not os.path.exists(f"{wdir}/quicklooks"):
+                os.mkdir(f"{wdir}/quicklooks")
+            scales = plot_girafe_simulation(flexpart_output, f"{wdir}/quicklooks", max_workers=config.plot_workers)
+            frames = sorted(glob.glob(f"{wdir}/quicklooks/*.png"))
+            record_stage(wdir, manifest, "quicklooks", inputs, frames,
+                         {"scales": {var: [float(val_min), float(val_max)] for var, (val_min, val_max) in scales.items()}})
+            measures["counts"]["frames"] = len(frames)
+    if last_stage("quicklooks"):
+        return result
+
+    # *************************************************************************************************
+    inputs = hash_stage_inputs({"zooms": config.tiles_zooms, "output": {flexpart_output: fingerprint_file(flexpart_output)}})
+    if (config.tiles_zooms is not None) and stage_needed("tiles", inputs):
+        with measure_stage(config, metrics, "tiles") as measures:
+            if os.path.exists(f"{wdir}/tiles"):
+                shutil.rmtree(f"{wdir}/tiles")
+            os.mkdir(f"{wdir}/tiles")
+            # Same colour scales as the quicklooks
+            scales = manifest["quicklooks"]["values"].get("scales")
+            index  = write_tile_pyramid(flexpart_output, f"{wdir}/tiles", *config.tiles_zooms,
+                                        scales=None if scales is None else {var: tuple(scale) for var, scale in scales.items()})
+            record_stage(wdir, manifest, "tiles", inputs, [f"{wdir}/tiles/tiles.json"])
+            measures["counts"].update({"tiles": index["tiles"], "unique_tiles": index["unique_tiles"]})
+    if last_stage("tiles"):
+        return result
+
+    # *************************************************************************************************
+    inputs = hash_stage_inputs({"complevel": config.archive_complevel, "sparse": config.archive_sparse,
+                                "output": {flexpart_output: fingerprint_file(flexpart_output)}})
+    if (config.archive_complevel is not None) and stage_needed("archive", inputs):
+        with measure_stage(config, metrics, "archive") as measures:
+            os.makedirs(f"{wdir}/archive", exist_ok=True)
+            outputs = [f"{wdir}/archive/{os.path.basename(flexpart_output)}"]
+            if config.archive_sparse:
+                outputs.append(f"{wdir}/archive/{os.path.splitext(os.path.basename(flexpart_output))[0]}_sparse.nc")
+            for output_filepath, sparse in zip(outputs, [False, True]):
+                archive_flexpart_output(flexpart_output, f"{output_filepath}.tmp", config.archive_complevel, sparse)
+                os.replace(f"{output_filepath}.tmp", output_filepath)
+                LOGGER.info(f"FLEXPART output archived in {output_filepath} ({os.path.getsize(output_filepath)/1024**2:.1f} MB, "
+                            f"{os.path.getsize(flexpart_output)/1024**2:.1f} MB before)")
+            record_stage(wdir, manifest, "archive", inputs, outputs)
+            measures["counts"].update({"archives": len(outputs), "archive_bytes": sum([os.path.getsize(output_filepath) for output_filepath in outputs])})
+    return result
+
+def scratch_working_dir(config: GirafeConfig) -> str:
+    working_dir = os.path.abspath(config.working_dir)
+    return f"{config.scratch_dir}/{os.path.basename(working_dir)}_{hashlib.sha1(working_dir.encode()).hexdigest()[:8]}"
+
+def list_copy_back_files(scratch_dir: str, subdir: str="") -> list:
+    """
+    Returns the paths, relative to scratch_dir, of the files of a scratch run copied
+    back to the working directory: everything but the staged links, the FLEXPART
+    sources and executables and the release partitions (merged in output).
+    """
+    filepaths = []
+    for root, dirs, files in os.walk(os.path.join(scratch_dir, subdir)):
+        if os.path.samefile(root, scratch_dir):
+            dirs[:] = [name for name in dirs if name not in ["flexpart_src", "partitions"]]
+        for filename in sorted(files):
+            filepath = os.path.join(root, filename)
+            if os.path.islink(filepath) or filename.startswith("FLEXPART") or filename.endswith(".tmp"):
+                continue
+            filepaths.append(os.path.relpath(filepath, scratch_dir))
+    return filepaths
+
+def copy_back_file(source: str, destination: str) -> str:
+    """
+    Copies source to destination through a temporary file, checks the sha256 of the
+    copy against the one of the source and returns it.
+    """
+    os.makedirs(os.path.dirname(destination), exist_ok=True)
+    tmp_filepath = f"{destination}.{os.getpid()}.tmp"
+    sha = hashlib.sha256()
+    with open(source, "rb") as source_file, open(tmp_filepath, "wb") as file:
+        for block in iter(lambda: source_file.read(8*1024**2), b""):
+            sha.update(block)
+            file.write(block)
+    if sha256_file(tmp_filepath)!=sha.hexdigest():
+        os.remove(tmp_filepath)
+        raise OSError(f"Checksum of the copy of {source} in {destination} differs from the original")
+    shutil.copystat(source, tmp_filepath)
+    os.replace(tmp_filepath, destination)
+    return sha.hexdigest()
+
+def run_girafe_simulation(config: GirafeConfig, from_stage: str=None, only_stage: str=None, to_stage: str=None) -> Optional[RunResult]:
+    """
+    Runs the stages of one simulation (see run_girafe_stages()) in config.working_dir or,
+    when <paths/scratch_dir> is set, in a node-local scratch directory. The FLEXPART
+    output is then copied back to the working directory in the background while the
+    quicklooks are plotted, followed by the quicklooks, tiles, logs and options files,
+    with their sha256 saved in copy_back.json (hard linked tiles are copied once and
+    linked again). The scratch directory is kept for the next
+    stages when to_stage stops before the quicklooks, and removed otherwise once
+    everything has been copied back.
+    """
+    working_dir = config.working_dir
+    scratch_dir = None if config.scratch_dir is None else scratch_working_dir(config)
+    # Replotting a run whose scratch directory is gone reads the output copied back
+    if (scratch_dir is None) or ((only_stage in ["quicklooks", "tiles", "archive"]) and not os.path.exists(f"{scratch_dir}/{STAGE_MANIFEST_FILENAME}")):
+        return run_girafe_stages(config, from_stage, only_stage, to_stage)
+    LOGGER.info(f"Running in the scratch directory {scratch_dir}, results are copied back to {working_dir}")
+    os.makedirs(scratch_dir, exist_ok=True)
+    os.makedirs(working_dir, exist_ok=True)
+    futures, links, inodes = {}, {}, {}
+    with concurrent.futures.ThreadPoolExecutor(max_workers=COPY_BACK_WORKERS) as executor:
+        def copy_back(subdir: str="") -> None:
+            for filepath in list_copy_back_files(scratch_dir, subdir):
+                if (filepath in futures) or (filepath in links):
+                    continue
+                # Hard links (deduplicated tiles) are copied once and linked again in the working directory
+                stat = os.stat(f"{scratch_dir}/{filepath}")
+                if (stat.st_nlink>1) and ((stat.st_dev, stat.st_ino) in inodes):
+                    links[filepath] = inodes[(stat.st_dev, stat.st_ino)]
+                    continue
+                inodes[(stat.st_dev, stat.st_ino)] = filepath
+                futures[filepath] = executor.submit(copy_back_file, f"{scratch_dir}/{filepath}", f"{working_dir}/{filepath}")
+        try:
+            result = run_girafe_stages(replace(config, working_dir=scratch_dir), from_stage, only_stage, to_stage,
+                                       on_output=lambda flexpart_output: copy_back("output"))
+        finally:
+            # Also run when a stage fails, so that the logs reach the working directory
+            copy_back()
+            checksums, failed = {}, []
+            for filepath, future in futures.items():
+                try:
+                    checksums[filepath] = future.result()
+                except OSError as error:
+                    LOGGER.error(f"Copy back of {filepath} failed: {error}")
+                    failed.append(filepath)
+            for filepath, target in links.items():
+                if target not in checksums:
+                    failed.append(filepath)
+                    continue
+                os.makedirs(os.path.dirname(f"{working_dir}/{filepath}"), exist_ok=True)
+                if os.path.lexists(f"{working_dir}/{filepath}"):
+                    os.remove(f"{working_dir}/{filepath}")
+                os.link(f"{working_dir}/{target}", f"{working_dir}/{filepath}")
+                checksums[filepath] = checksums[target]
+            # The copied manifest refers to the working directory, the stages of the files left in scratch will run again there
+            if STAGE_MANIFEST_FILENAME in checksums:
+                with open(f"{working_dir}/{STAGE_MANIFEST_FILENAME}", "r") as file:
+                    manifest = file.read()
+                with open(f"{working_dir}/{STAGE_MANIFEST_FILENAME}", "w") as file:
+                    file.write(manifest.replace(scratch_dir, working_dir))
+                checksums[STAGE_MANIFEST_FILENAME] = sha256_file(f"{working_dir}/{STAGE_MANIFEST_FILENAME}")
+            with open(f"{working_dir}/copy_back.json", "w") as file:
+                json.dump({"scratch_dir": scratch_dir, "files": checksums}, file, indent=2)
+    if len(failed)>0:
+        LOGGER.error(f"{len(failed)} files could not be copied back from {scratch_dir}, it is kept")
+        sys.exit(1)
+    LOGGER.info(f"{len(checksums)} files copied back to {working_dir}")
+    if (to_stage is None) or (STAGES.index(to_stage)>=STAGES.index("quicklooks")):
+        shutil.rmtree(scratch_dir)
+    if result is None:
+        return None
+    return replace(result, log_filepath=f"{working_dir}/{os.path.relpath(result.log_filepath, scratch_dir)}")
+
+def list_batch_configs(paths: list) -> list:
+    """
+    Configuration files of a batch: xml files given directly, or found in the given
+    directories (sorted by name).
+    """
+    filepaths = []
+    for path in paths:
+        if os.path.isdir(path):
+            filepaths.extend(sorted(glob.glob(f"{path}/*.xml")))
+        else:
+            filepaths.append(path)
+    return filepaths
+
+def get_available_memory() -> int:
+    try:
+        with open("/proc/meminfo", "r") as file:
+            for line in file:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1])*1024
+    except OSError:
+        pass
+    return os.sysconf("SC_PAGE_SIZE")*os.sysconf("SC_PHYS_PAGES")
+
+def run_batch_member(config_filepath: str, working_dir: str) -> RunResult:
+    """
+    Worker of run_batch(): runs one simulation in its own working directory, logging in
+    the girafe.log file of that directory instead of the terminal.
+    """
+    os.makedirs(working_dir, exist_ok=True)
+    handler = logging.FileHandler(f"{working_dir}/girafe.log", mode="w")
+    handler.setFormatter(logging.Formatter("%(asctime)s   [%(levelname)s]   %(message)s", datefmt="%d/%m/%Y %H:%M:%S"))
+    for previous_handler in LOGGER.handlers:
+        previous_handler.close()
+    LOGGER.handlers = [handler]
+    LOGGER.propagate = False
+    config = replace(load_girafe_config(config_filepath), working_dir=working_dir)
+    # The simulations of the batch already share the cores, their quicklooks are rendered serially by default
+    if config.plot_workers is None:
+        config = replace(config, plot_workers=1)
+    return run_girafe_simulation(config)
+
+def run_batch(config_filepaths: list, max_jobs: int=None, memory_limit: float=None) -> pd.DataFrame:
+    """
+    Runs the simulations of several configuration files concurrently on a process pool.
+    A run starts, in the order of the list, when a job slot is free (max_jobs, default
+    the number of cores) and when its estimated memory fits in memory_limit (default
+    the available memory) next to the running ones. Runs sharing a working directory
+    get their own sub directory named after the configuration file. Returns a summary
+    table with the status and timings of every run.
+    """
+    max_jobs     = max_jobs or os.cpu_count()
+    memory_limit = memory_limit or get_available_memory()
+    configs      = {}
+    for filepath in config_filepaths:
+        try:
+            configs[filepath] = load_girafe_config(filepath)
+        except SystemExit:
+            configs[filepath] = None
+    shared_dirs  = collections.Counter([os.path.abspath(config.working_dir) for config in configs.values() if config is not None])
+    rows = []
+    for filepath in config_filepaths:
+        config, working_dir, memory, status = configs[filepath], None, 0, "error"
+        if config is not None:
+            working_dir = config.working_dir
+            if shared_dirs[os.path.abspath(working_dir)]>1:
+                working_dir = f"{working_dir}/{os.path.splitext(os.path.basename(filepath))[0]}"
+            try:
+                memory = estimate_run_footprint(config)["memory"]
+                status = "pending"
+            except SystemExit:
+                pass
+        if memory>memory_limit:
+            LOGGER.warning(f"{filepath} needs about {memory/1024**3:.1f} GB, more than the {memory_limit/1024**3:.1f} GB limit, it will run alone")
+        rows.append({"config": filepath, "working_dir": working_dir, "status": status, "memory_gb": round(memory/1024**3, 2),
+                     "wall_time_min": 0.0, "simulated_hours": 0.0, "particles": 0})
+    pending = [index for index, row in enumerate(rows) if row["status"]=="pending"]
+    running = {}
+    starts  = {}
+    with concurrent.futures.ProcessPoolExecutor(max_workers=max_jobs) as pool:
+        while (len(pending)>0) or (len(running)>0):
+            while (len(pending)>0) and (len(running)<max_jobs):
+                used_memory = sum([rows[index]["memory_gb"]*1024**3 for index in running.values()])
+                if (len(running)>0) and (used_memory+rows[pending[0]]["memory_gb"]*1024**3>memory_limit):
+                    break
+                index = pending.pop(0)
+                LOGGER.info(f"Starting {rows[index]['config']} in {rows[index]['working_dir']}")
+                starts[index] = time.monotonic()
+                running[pool.submit(run_batch_member, rows[index]["config"], rows[index]["working_dir"])] = index
+            done, _ = concurrent.futures.wait(running, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                index = running.pop(future)
+                rows[index]["wall_time_min"] = round((time.monotonic()-starts[index])/60, 2)
+                try:
+                    result = future.result()
+                    rows[index]["status"]          = result.status
+                    rows[index]["simulated_hours"] = round(result.simulated_seconds/3600, 2)
+                    rows[index]["particles"]       = result.particles
+                except BaseException:
+                    rows[index]["status"] = "error"
+                LOGGER.info(f"{rows[index]['config']} {rows[index]['status']} in {rows[index]['wall_time_min']} min")
+    summary = pd.DataFrame(rows)
+    LOGGER.info("Batch summary:\n"+summary.to_string(index=False))
+    return summary
+
 if __name__=="__main__":
 
     import argparse
@@ -1145,76 +3741,127 @@ if __name__=="__main__":
     parser = argparse.ArgumentParser(description="Python code that prepare all FLEXPART inputs"
                                     "and launch FLEXPART simulations based on your configuration xml file", 
                                     formatter_class=argparse.RawTextHelpFormatter)
-    parser.add_argument("-gc","--config", type=str, help="Filepath to your configuration xml file.", required=True)
+    parser.add_argument("-gc","--config", type=str, help="Filepath to your configuration xml file.")
+    parser.add_argument("--ingest-fires", type=str, nargs="+", metavar="MODIS_FILE", help="Append MODIS MCD14DL text files to the fire store given by --fire-store, and exit.")
+    parser.add_argument("--fire-store", type=str, help="Directory of the fire detection store (use it as <emissions> in the configuration file).")
+    parser.add_argument("--plan", action="store_true", help="Print an estimate of the particles, memory, output size and ECMWF files of the run, and exit.")
+    parser.add_argument("--batch", type=str, nargs="+", metavar="CONFIG", help="Run the simulations of several configuration files (or directories of xml files) concurrently.")
+    parser.add_argument("--jobs", type=int, help="Maximum number of concurrent simulations in --batch mode (default: number of cores).")
+    parser.add_argument("--memory-gb", type=float, help="Memory available to the concurrent simulations in --batch mode (default: available memory).")
+    parser.add_argument("--summary", type=str, help="CSV file where the summary table of --batch mode is saved.")
+    parser.add_argument("--validate-restart", type=str, metavar="COLD_OUTPUT", help="Compare the output of the (hot-started) run of --config with the NetCDF output of a cold run, and exit.")
+    parser.add_argument("--only-stage", type=str, choices=STAGES, help="Run only this stage (e.g. quicklooks to replot a finished simulation), the previous ones must have been run.")
+
+    # Subcommands running a part of the simulation, only the libraries of their stages are imported
+    subparsers = parser.add_subparsers(dest="command", metavar="COMMAND",
+                                       help="Optional subcommand, without it all the stages of the simulation are run:\n"
+                                            "  validate   check the configuration file\n"
+                                            "  plan       print the estimate of --plan\n"
+                                            "  prepare    write the AVAILABLE, options and RELEASES files\n"
+                                            "  compile    prepare, then stage the sources and compile FLEXPART\n"
+                                            "  run        compile, then run FLEXPART\n"
+                                            "  plot       plot the quicklooks of the FLEXPART output\n"
+                                            "  tiles      write the web-map tiles of the FLEXPART output (needs <tiles>)\n"
+                                            "  archive    write the compressed archives of the FLEXPART output (needs <archive>)\n"
+                                            "  extract-points  extract the fields at the points of a CSV file (--points), from the\n"
+                                            "             output of --config or from --files")
+    subparser = subparsers.add_parser("extract-points", help="Extract the FLEXPART fields at points as a CSV table")
+    subparser.add_argument("--points", type=str, required=True, help="CSV file of the points (latitude, longitude, height in m and an optional name).")
+    subparser.add_argument("-gc","--config", type=str, help="Configuration xml file of the simulation whose output is read.")
+    subparser.add_argument("--files", type=str, nargs="+", metavar="OUTPUT", help="FLEXPART NetCDF outputs or archives (or directories of them) to read instead.")
+    subparser.add_argument("--output", type=str, required=True, help="CSV file where the table is saved.")
+    subparser.add_argument("--index-cache", type=str, help="Directory caching the grid indices of the points for every output grid.")
+    for command in SUBCOMMAND_STAGES:
+        subparser = subparsers.add_parser(command)
+        subparser.add_argument("-gc","--config", type=str, required=True, help="Filepath to your configuration xml file.")
+        if command in ["prepare", "compile", "run"]:
+            subparser.add_argument("--from-stage", type=str, choices=STAGES[:STAGES.index(SUBCOMMAND_STAGES[command])+1],
+                                   help="Run this stage and the following ones even if their inputs are unchanged.")
 
     args = parser.parse_args()
 
-    config_xmlpath = args.config
-    wdir           = get_working_dir(config_xmlpath)
+    if args.ingest_fires is not None:
+        if args.fire_store is None:
+            parser.error("--ingest-fires needs the --fire-store directory")
+        LOGGER = start_log()
+        Nadded = ingest_fire_files(args.fire_store, args.ingest_fires)
+        LOGGER.info(f"{Nadded} new fire detections in {args.fire_store}")
+        sys.exit(0)
+    if args.command=="extract-points":
+        if (args.config is None)==(args.files is None):
+            parser.error("extract-points needs either -gc/--config or --files")
+        LOGGER = start_log()
+        if args.config is not None:
+            filepaths = [find_flexpart_output(load_girafe_config(args.config).working_dir)]
+            if filepaths[0] is None:
+                LOGGER.error(f"No FLEXPART output for {args.config}")
+                sys.exit(1)
+        else:
+            filepaths = [filepath for path in args.files for filepath in (sorted(glob.glob(f"{path}/*.nc")) if os.path.isdir(path) else [path])]
+        table = extract_points(filepaths, read_points_file(args.points), cache_dir=args.index_cache)
+        table.to_csv(args.output, index=False)
+        LOGGER.info(f"{len(table)} values of {len(filepaths)} outputs saved in {args.output}")
+        sys.exit(0)
+    if (args.config is None) and (args.batch is None):
+        parser.error("the following arguments are required: -gc/--config")
+    # --from-stage is an option of the prepare, compile and run subcommands only
+    from_stage = getattr(args, "from_stage", None)
+    if (from_stage is not None) and (args.only_stage is not None):
+        parser.error("--from-stage and --only-stage are mutually exclusive")
 
-    global LOGGER, LOG_FILEPATH
     LOGGER = start_log()
-    print_header_in_terminal()
 
-    status = prepare_working_dir(wdir)
-    if status!=0:
-        LOGGER.error("Something went wrong...")
-        sys.exit(1)
+    if args.command in ["validate", "plan"]:
+        config = load_girafe_config(args.config)
+        if args.command=="plan":
+            print_run_plan(config, estimate_run_footprint(config))
+        else:
+            LOGGER.info(f"{args.config} is valid")
+        sys.exit(0)
 
-    ##########################################################################
+    print_header_in_terminal()
 
-    verif_xml_file(config_xmlpath)
+    if args.command is not None:
+        config = load_girafe_config(args.config)
+        if args.command in ["plot", "tiles", "archive"]:
+            if ((args.command=="tiles") and (config.tiles_zooms is None)) or ((args.command=="archive") and (config.archive_complevel is None)):
+                LOGGER.error(f"No <{args.command}> node in the configuration file, nothing to write")
+                sys.exit(1)
+            run_girafe_simulation(config, only_stage=SUBCOMMAND_STAGES[args.command])
+        else:
+            run_girafe_simulation(config, from_stage=from_stage, to_stage=SUBCOMMAND_STAGES[args.command])
+        sys.exit(0)
 
     ##########################################################################
 
-    write_available_file(config_xmlpath,wdir)
-    status = check_ECMWF_pool(config_xmlpath,wdir)
-    if status!=0:
-        LOGGER.error("Some of the ECMWF files are not available in your indicated directory, please check your data and configuration file and retry again.")
-        sys.exit(1)
-    
-    write_pathnames_file(config_xmlpath,wdir)
-    write_command_file(config_xmlpath,wdir)
-    write_outgrid_file(config_xmlpath,wdir)
-    write_receptors_file(config_xmlpath,wdir)
-    write_ageclasses_file(config_xmlpath,wdir)
-    Nparts = write_releases_file(config_xmlpath,wdir)
-    if Nparts==-1:
-        LOGGER.error("Error in the emissions filepath. Only MODIS MCD14DL txt files or netCDF CAMS inventories are accepted.")
-        sys.exit(1)
-    elif Nparts==-2:
-        LOGGER.error("CAMS inventory does not exist, check the filepath in your configuration file.")
-        sys.exit(1)
-    elif Nparts==-3:
-        LOGGER.error("MODIS fire inventory does not exist, check the filepath in your configuration file.")
-        sys.exit(1)
-    elif Nparts==0:
-        LOGGER.error("No release sources were found, exiting the simulation.")
-        sys.exit(1)
-    else:
-        pass
+    if args.batch is not None:
+        summary = run_batch(list_batch_configs(args.batch), max_jobs=args.jobs,
+                            memory_limit=None if args.memory_gb is None else args.memory_gb*1024**3)
+        if args.summary is not None:
+            summary.to_csv(args.summary, index=False)
+        sys.exit(0 if (summary["status"]=="finished").all() else 1)
 
-    status = copy_source_files(wdir)
-    if status==1:
-        LOGGER.error("Something went wrong during source files copy...")
-        sys.exit(1)
-    
-    write_par_mod_file(config_xmlpath,wdir,Nparts)
+    config = load_girafe_config(args.config)
 
-    status = compile_flexpart(wdir)
-    if status!=0:
-        LOGGER.error(f"Something went wrong during compilation, check log information in the {wdir}/flexpart_compile.out")
-        sys.exit(1)
+    if args.plan:
+        print_run_plan(config, estimate_run_footprint(config))
+        sys.exit(0)
 
-    LOGGER.info("Launching FLEXPART")
-    status = run_bash_command("./FLEXPART", wdir)
+    if args.validate_restart is not None:
+        flexpart_output = find_flexpart_output(config.working_dir)
+        if flexpart_output is None:
+            LOGGER.error(f"No FLEXPART output in {config.working_dir}/output")
+            sys.exit(1)
+        differences = compare_flexpart_outputs(flexpart_output, args.validate_restart)
+        if len(differences)==0:
+            LOGGER.error(f"{flexpart_output} and {args.validate_restart} have no common output time")
+            sys.exit(1)
+        LOGGER.info("Restart differences:\n"+differences.groupby("variable")[["total_difference", "l1_difference"]].max().to_string())
+        worst = differences["l1_difference"].max()
+        LOGGER.info(f"Maximum normalized L1 difference {worst:.4f} (tolerance {config.restart_tolerance})")
+        sys.exit(0 if worst<=config.restart_tolerance else 1)
 
-    try:
-        flexpart_output = glob.glob(f"{wdir}/output/*.nc")[0]
-    except:
-        LOGGER.error("Something went wrong with the simulation, check the FLEXPART output for more information.")
-        sys.exit(1)
-    if not os.path.exists(f"{wdir}/quicklooks"):
-        os.mkdir(f"{wdir}/quicklooks")
-    plot_girafe_simulation(flexpart_output, f"{wdir}/quicklooks")
+    ##########################################################################
+
+    run_girafe_simulation(config, only_stage=args.only_stage)
 